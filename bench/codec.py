@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Any, Callable, Optional
+
+from storage.codec import CODEC_META_HEADER, decode_document, encode_document
+
+_CHARS = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后"
+    "多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合"
+    "还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只"
+    "剑宗门师兄弟修炼灵气丹药秘境魔道长老弟子掌门阵法法宝妖兽天劫飞升金丹元婴筑基"
+)
+_PUNCT = "，，，。。！？；："
+
+
+def _paragraph(rng: random.Random, length: int) -> str:
+    out: list[str] = []
+    for i in range(length):
+        out.append(rng.choice(_CHARS))
+        if i and i % rng.randint(8, 20) == 0:
+            out.append(rng.choice(_PUNCT))
+    out.append("。")
+    return "".join(out)
+
+
+def _field(rng: random.Random, chars: int) -> str:
+    parts: list[str] = []
+    total = 0
+    while total < chars:
+        p = _paragraph(rng, rng.randint(80, 300))
+        parts.append(p)
+        total += len(p)
+    return "\n\n".join(parts)
+
+
+def sample_documents(seed: int = 7) -> dict[str, Any]:
+    rng = random.Random(seed)
+    story = {
+        "background": _field(rng, 1500),
+        "mainline": _field(rng, 6000),
+        "darkline": _field(rng, 3000),
+    }
+    advanced = {
+        "style": _field(rng, 400),
+        "core_design": _field(rng, 2000),
+        "reversal": _field(rng, 1500),
+        "highlights": _field(rng, 600),
+    }
+    index = [
+        {
+            "id": f"{rng.getrandbits(128):032x}",
+            "title": _paragraph(rng, rng.randint(4, 10)).rstrip("。"),
+            "created_at": "2026-01-24T08:00:00.000000Z",
+        }
+        for _ in range(2000)
+    ]
+    return {"story.json": story, "advanced.json": advanced, "index.json": index, "small": {"a": "短"}}
+
+
+def _timeit(fn: Callable[[], Any], rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def run(rounds: int = 50, *, seed: int = 7) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    for name, doc in sample_documents(seed).items():
+        legacy = json.dumps(doc, ensure_ascii=False, indent=2).encode("utf-8")
+        row: dict[str, Any] = {
+            "legacy_bytes": len(legacy),
+            "legacy_encode_ms": round(
+                _timeit(lambda: json.dumps(doc, ensure_ascii=False, indent=2).encode("utf-8"), rounds), 3
+            ),
+            "legacy_decode_ms": round(_timeit(lambda: decode_document(legacy), rounds), 3),
+        }
+        for label, prefer_zstd in (("gzip", False), ("zstd", True)):
+            data, headers = encode_document(doc, prefer_zstd=prefer_zstd)
+            codec = headers[CODEC_META_HEADER]
+            if label == "zstd" and "zstd" not in codec:
+                continue
+            assert decode_document(data, codec=codec) == doc
+            row[label] = {
+                "codec": codec,
+                "bytes": len(data),
+                "ratio": round(len(data) / len(legacy), 3),
+                "encode_ms": round(
+                    _timeit(lambda: encode_document(doc, prefer_zstd=prefer_zstd), rounds), 3
+                ),
+                "decode_ms": round(_timeit(lambda: decode_document(data, codec=codec), rounds), 3),
+            }
+        results[name] = row
+    return results
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.codec", description="存储编码体积与耗时对比")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+    print(json.dumps(run(max(1, args.rounds), seed=args.seed), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
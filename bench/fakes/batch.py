@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from typing import Any, Optional
+
+from bench.fakes.llm import FakeOpenAIServer, _OpenAIHandler, _prompt_text, _reply_for, _tokens
+
+# 在假 OpenAI 服务上再加 Batch 接口：/files 上传与下载、/batches 创建/查询/取消。
+# 每条请求按聊天接口同样的规则生成回复，但不按 token 速度睡眠，只在开头排队 queue_ms、
+# 每条 line_ms，且 workers 条并行，模拟 Batch “延迟高、吞吐大”的特点。
+# fail_every=N 时每 N 条有一条返回错误，用来测结果回写时的失败处理。
+
+
+class _BatchHandler(_OpenAIHandler):
+    @property
+    def fake(self) -> "FakeBatchServer":
+        return self.server.fake  # type: ignore[attr-defined]
+
+    def _route(self) -> list[str]:
+        path = self.path.split("?", 1)[0].rstrip("/")
+        parts = path.split("/")
+        # 兼容 /v1/... 与 /compatible-mode/v1/... 两种前缀
+        return parts[parts.index("v1") + 1 :] if "v1" in parts else parts[1:]
+
+    def do_GET(self) -> None:
+        route = self._route()
+        fake = self.fake
+        if len(route) == 2 and route[0] == "batches":
+            batch = fake.batches.get(route[1])
+            if batch is None:
+                self.send_json(404, {"error": {"message": "batch not found"}})
+                return
+            self.send_json(200, fake.batch_view(batch))
+            return
+        if len(route) == 3 and route[0] == "files" and route[2] == "content":
+            data = fake.files.get(route[1])
+            if data is None:
+                self.send_json(404, {"error": {"message": "file not found"}})
+                return
+            self.send_bytes(200, data, content_type="application/octet-stream")
+            return
+        self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        route = self._route()
+        fake = self.fake
+        if route == ["files"]:
+            fields = self._multipart()
+            data = fields.get("file", b"")
+            file_id = fake.add_file(data)
+            self.send_json(200, {
+                "id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": "batch.jsonl", "purpose": fields.get("purpose", b"batch").decode(),
+                "status": "processed",
+            })
+            return
+        if route == ["batches"]:
+            req = json.loads(self.read_body() or b"{}")
+            if req.get("input_file_id") not in fake.files:
+                self.send_json(400, {"error": {"message": "input file not found"}})
+                return
+            self.send_json(200, fake.batch_view(fake.create_batch(req)))
+            return
+        if len(route) == 3 and route[0] == "batches" and route[2] == "cancel":
+            batch = fake.batches.get(route[1])
+            if batch is None:
+                self.send_json(404, {"error": {"message": "batch not found"}})
+                return
+            batch["cancel"].set()
+            if batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+                batch["status"] = "cancelling"
+            self.send_json(200, fake.batch_view(batch))
+            return
+        super().do_POST()
+
+    def _multipart(self) -> dict[str, bytes]:
+        header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode()
+        msg = BytesParser(policy=default_policy).parsebytes(header + self.read_body())
+        fields: dict[str, bytes] = {}
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name:
+                fields[str(name)] = part.get_payload(decode=True) or b""
+        return fields
+
+
+class FakeBatchServer(FakeOpenAIServer):
+    def __init__(self, *, queue_ms: float = 200.0, line_ms: float = 20.0, workers: int = 32,
+                 fail_every: int = 0, reply_tokens: int = 120) -> None:
+        super().__init__(reply_tokens=reply_tokens)
+        self.httpd.RequestHandlerClass = _BatchHandler
+        self.queue_ms = queue_ms
+        self.line_ms = line_ms
+        self.workers = workers
+        self.fail_every = fail_every
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict[str, Any]] = {}
+        self.batch_lines = 0
+        self._lock = threading.Lock()
+
+    def add_file(self, data: bytes) -> str:
+        file_id = f"file-{uuid.uuid4().hex[:16]}"
+        with self._lock:
+            self.files[file_id] = data
+        return file_id
+
+    def create_batch(self, req: dict[str, Any]) -> dict[str, Any]:
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:16]}",
+            "status": "validating",
+            "input_file_id": req["input_file_id"],
+            "endpoint": req.get("endpoint") or "/v1/chat/completions",
+            "completion_window": req.get("completion_window") or "24h",
+            "metadata": req.get("metadata"),
+            "created_at": int(time.time()),
+            "total": 0, "completed": 0, "failed": 0,
+            "output_file_id": None, "error_file_id": None,
+            "cancel": threading.Event(),
+        }
+        with self._lock:
+            self.batches[batch["id"]] = batch
+        threading.Thread(target=self._process, args=(batch,), daemon=True).start()
+        return batch
+
+    def batch_view(self, batch: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "id": batch["id"], "object": "batch", "endpoint": batch["endpoint"],
+            "errors": None, "input_file_id": batch["input_file_id"],
+            "completion_window": batch["completion_window"], "status": batch["status"],
+            "output_file_id": batch["output_file_id"], "error_file_id": batch["error_file_id"],
+            "created_at": batch["created_at"], "metadata": batch["metadata"],
+            "request_counts": {
+                "total": batch["total"], "completed": batch["completed"], "failed": batch["failed"],
+            },
+        }
+
+    def _answer(self, index: int, line: str) -> tuple[bool, dict[str, Any]]:
+        try:
+            item = json.loads(line)
+            custom_id = item["custom_id"]
+            body = item["body"]
+        except Exception:
+            return False, {"id": f"batch_req_{index}", "custom_id": None, "response": None,
+                           "error": {"code": "invalid_request", "message": "无法解析的请求行"}}
+        rid = f"batch_req_{uuid.uuid4().hex[:12]}"
+        if self.fail_every and (index + 1) % self.fail_every == 0:
+            return False, {"id": rid, "custom_id": custom_id, "response": None,
+                           "error": {"code": "server_error", "message": "模拟失败"}}
+        time.sleep(self.line_ms / 1000)
+        prompt = _prompt_text(body.get("messages") or [])
+        max_tokens = int(body.get("max_tokens") or self.reply_tokens)
+        pieces = _tokens(_reply_for(prompt, self.reply_tokens * 2))
+        finish = "length" if len(pieces) > max_tokens else "stop"
+        pieces = pieces[:max_tokens]
+        completion = {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion",
+            "created": int(time.time()), "model": body.get("model") or "fake",
+            "choices": [{"index": 0, "finish_reason": finish,
+                         "message": {"role": "assistant", "content": "".join(pieces)}}],
+            "usage": {"prompt_tokens": max(1, len(prompt) // 2), "completion_tokens": len(pieces),
+                      "total_tokens": max(1, len(prompt) // 2) + len(pieces)},
+        }
+        return True, {"id": rid, "custom_id": custom_id, "error": None,
+                      "response": {"status_code": 200, "request_id": rid, "body": completion}}
+
+    def _process(self, batch: dict[str, Any]) -> None:
+        lines = [ln for ln in self.files[batch["input_file_id"]].decode("utf-8").splitlines()
+                 if ln.strip()]
+        batch["total"] = len(lines)
+        time.sleep(self.queue_ms / 1000)
+        batch["status"] = "in_progress"
+        outputs: list[Optional[str]] = [None] * len(lines)
+        errors: list[Optional[str]] = [None] * len(lines)
+
+        def run(index: int) -> None:
+            if batch["cancel"].is_set():
+                return
+            ok, record = self._answer(index, lines[index])
+            text = json.dumps(record, ensure_ascii=False)
+            with self._lock:
+                self.batch_lines += 1
+                if ok:
+                    outputs[index] = text
+                    batch["completed"] += 1
+                else:
+                    errors[index] = text
+                    batch["failed"] += 1
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            list(pool.map(run, range(len(lines))))
+
+        batch["status"] = "finalizing"
+        done = [t for t in outputs if t]
+        failed = [t for t in errors if t]
+        if done:
+            batch["output_file_id"] = self.add_file(("\n".join(done) + "\n").encode("utf-8"))
+        if failed:
+            batch["error_file_id"] = self.add_file(("\n".join(failed) + "\n").encode("utf-8"))
+        batch["status"] = "cancelled" if batch["cancel"].is_set() else "completed"
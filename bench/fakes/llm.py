@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import json
+import re
+import time
+import uuid
+from typing import Any
+
+from bench.fakes._server import FakeServer, QuietHandler
+
+# OpenAI 兼容的 /chat/completions（DashScope compatible-mode 同构）与千帆 /v2/ai_search/chat/completions。
+# 首 token 延迟、输出速度、输出长度都可配置；回复内容按提示词类型给出可解析的固定结果。
+
+_FILLER = "山风掠过剑冢，少年握紧了手中那柄无名铁剑，心中暗暗发誓要踏上修行之路。"
+
+
+def _prompt_text(messages: list[dict[str, Any]]) -> str:
+    parts: list[str] = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(str(c.get("text") or "") for c in content if isinstance(c, dict))
+    return "\n".join(parts)
+
+
+def _reply_for(prompt: str, tokens: int) -> str:
+    if "意图识别器" in prompt:
+        return '{"route":"chat"}'
+    if "取名助手" in prompt:
+        return '{"name":"韩立"}'
+    if "大纲策划" in prompt:
+        match = re.search(r"章节数：\s*(\d+)", prompt)
+        count = int(match.group(1)) if match else 3
+        chapters = [{"title": f"剑冢{i}", "summary": _FILLER} for i in range(1, count + 1)]
+        return json.dumps({"chapters": chapters}, ensure_ascii=False)
+    if "编辑助手" in prompt:
+        match = re.search(r"原文：\s*(.*?)\s*用户要求：", prompt, re.DOTALL)
+        original = match.group(1) if match else ""
+        if "修改列表" in prompt:
+            # 增量修改：挑原文中间一段唯一的文字改写
+            for start in range(len(original) // 2, len(original) - 20):
+                find = original[start : start + 20]
+                if original.count(find) == 1:
+                    edit = {"op": "replace", "find": find, "text": find[::-1]}
+                    return json.dumps({"edits": [edit]}, ensure_ascii=False)
+            return '{"edits":[]}'
+        # 全文重写：输出和原文一样长
+        tokens = max(tokens, len(original))
+    return (_FILLER * (tokens // len(_FILLER) + 1))[:tokens]
+
+
+def _tokens(text: str, size: int = 2) -> list[str]:
+    # 近似：中文 2 字 ≈ 1 token
+    return [text[i : i + size] for i in range(0, len(text), size)] or [""]
+
+
+class _OpenAIHandler(QuietHandler):
+    @property
+    def fake(self) -> "FakeOpenAIServer":
+        return self.server.fake  # type: ignore[attr-defined]
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        req = json.loads(self.read_body() or b"{}")
+        messages = req.get("messages") or []
+        prompt = _prompt_text(messages)
+        fake = self.fake
+        fake.requests += 1
+        max_tokens = int(req.get("max_tokens") or fake.reply_tokens)
+        pieces = _tokens(_reply_for(prompt, fake.reply_tokens * 2))
+        finish = "length" if len(pieces) > max_tokens else "stop"
+        pieces = pieces[:max_tokens]
+        usage = {
+            "prompt_tokens": max(1, len(prompt) // 2),
+            "completion_tokens": len(pieces),
+            "total_tokens": max(1, len(prompt) // 2) + len(pieces),
+            "prompt_tokens_details": {"cached_tokens": fake.cached_prefix_tokens(messages)},
+        }
+        created = int(time.time())
+        rid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = req.get("model") or "fake"
+
+        time.sleep(fake.ttft_ms / 1000)
+        if not req.get("stream"):
+            time.sleep(len(pieces) / max(fake.tokens_per_s, 1e-6))
+            self.send_json(200, {
+                "id": rid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": finish,
+                             "message": {"role": "assistant", "content": "".join(pieces)}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        interval = 1.0 / max(fake.tokens_per_s, 1e-6)
+        try:
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(interval)
+                chunk = {
+                    "id": rid, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece},
+                                 "finish_reason": finish if i == len(pieces) - 1 else None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            if (req.get("stream_options") or {}).get("include_usage"):
+                tail = {"id": rid, "object": "chat.completion.chunk", "created": created,
+                        "model": model, "choices": [], "usage": usage}
+                self.wfile.write(f"data: {json.dumps(tail)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            fake.cancelled += 1
+
+
+class FakeOpenAIServer(FakeServer):
+    def __init__(self, *, ttft_ms: float = 200.0, tokens_per_s: float = 60.0,
+                 reply_tokens: int = 120) -> None:
+        super().__init__(_OpenAIHandler)
+        self.ttft_ms = ttft_ms
+        self.tokens_per_s = tokens_per_s
+        self.reply_tokens = reply_tokens
+        self.requests = 0
+        self.cancelled = 0
+        self._prefixes: set[str] = set()
+
+    def cached_prefix_tokens(self, messages: list[dict[str, Any]]) -> int:
+        # 粗略模拟服务端前缀缓存：首条消息（系统提示）见过就算命中
+        if not messages:
+            return 0
+        head = _prompt_text(messages[:1])
+        if head in self._prefixes:
+            return len(head) // 2
+        self._prefixes.add(head)
+        return 0
+
+    def config(self, model: str = "qwen-fake") -> dict[str, Any]:
+        return {"api_key": "fake", "base_url": f"{self.base_url}/v1", "model": model}
+
+
+class _QianfanHandler(QuietHandler):
+    @property
+    def fake(self) -> "FakeQianfanServer":
+        return self.server.fake  # type: ignore[attr-defined]
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/v2/ai_search/chat/completions":
+            self.send_json(404, {"code": 404, "message": "not found"})
+            return
+        req = json.loads(self.read_body() or b"{}")
+        self.fake.requests += 1
+        time.sleep(self.fake.latency_ms / 1000)
+        content = f"根据搜索结果：{_prompt_text(req.get('messages') or [])[:50]}……[1]"
+        self.send_json(200, {
+            "request_id": uuid.uuid4().hex,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+            "references": [{"id": 1, "url": "https://example.com", "title": "示例"}],
+        })
+
+
+class FakeQianfanServer(FakeServer):
+    def __init__(self, *, latency_ms: float = 800.0) -> None:
+        super().__init__(_QianfanHandler)
+        self.latency_ms = latency_ms
+        self.requests = 0
+
+    def config(self) -> dict[str, Any]:
+        return {"api_key": "fake", "base_url": self.base_url, "model": "ernie-fake", "stream": False}
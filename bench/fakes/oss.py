@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from typing import Any, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+from bench.fakes._server import FakeServer, QuietHandler
+
+# 只实现 OssStorage 用到的子集：Put/Get/Head/Delete Object、AppendObject、ListObjectsV2。
+# 不校验签名；延迟可配置，用来模拟跨机房 RTT。
+
+
+@dataclass
+class _Object:
+    data: bytes
+    headers: dict[str, str] = field(default_factory=dict)
+    mtime: float = field(default_factory=time.time)
+
+    @property
+    def etag(self) -> str:
+        return hashlib.md5(self.data).hexdigest().upper()
+
+
+class _OssHandler(QuietHandler):
+    @property
+    def fake(self) -> "FakeOssServer":
+        return self.server.fake  # type: ignore[attr-defined]
+
+    def _split(self) -> tuple[str, str, dict[str, list[str]]]:
+        parts = urlsplit(self.path)
+        path = unquote(parts.path).lstrip("/")
+        bucket, _, key = path.partition("/")
+        return bucket, key, parse_qs(parts.query, keep_blank_values=True)
+
+    def _error(self, status: int, code: str) -> None:
+        body = (
+            f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code>'
+            f"<Message>{code}</Message><RequestId>fake</RequestId></Error>"
+        ).encode("utf-8")
+        self.send_bytes(status, body, content_type="application/xml",
+                        headers={"x-oss-request-id": "fake"})
+
+    def _object_headers(self, obj: _Object) -> dict[str, str]:
+        headers = {
+            "ETag": f'"{obj.etag}"',
+            "Last-Modified": formatdate(obj.mtime, usegmt=True),
+            "x-oss-request-id": "fake",
+            "x-oss-object-type": "Appendable" if "append" in obj.headers else "Normal",
+            "x-oss-next-append-position": str(len(obj.data)),
+        }
+        headers.update({k: v for k, v in obj.headers.items() if k.startswith("x-oss-meta-")})
+        return headers
+
+    def do_PUT(self) -> None:
+        self.fake.delay()
+        _, key, _ = self._split()
+        data = self.read_body()
+        meta = {k.lower(): v for k, v in self.headers.items() if k.lower().startswith("x-oss-meta-")}
+        if self.headers.get("Content-Type"):
+            meta["content-type"] = self.headers["Content-Type"]
+        obj = _Object(data=data, headers=meta)
+        self.fake.put(key, obj)
+        self.send_bytes(200, b"", content_type="application/xml", headers={
+            "ETag": f'"{obj.etag}"', "x-oss-request-id": "fake"})
+
+    def do_POST(self) -> None:
+        self.fake.delay()
+        _, key, query = self._split()
+        if "append" not in query:
+            self._error(400, "InvalidRequest")
+            return
+        position = int((query.get("position") or ["0"])[0] or 0)
+        data = self.read_body()
+        with self.fake.lock:
+            current = self.fake.objects.get(key)
+            size = len(current.data) if current else 0
+            if position != size:
+                self._error(409, "PositionNotEqualToLength")
+                return
+            merged = (current.data if current else b"") + data
+            meta = dict(current.headers) if current else {}
+            meta["append"] = "1"
+            self.fake.objects[key] = _Object(data=merged, headers=meta)
+        self.send_bytes(200, b"", content_type="application/xml", headers={
+            "x-oss-next-append-position": str(len(merged)),
+            "x-oss-hash-crc64ecma": "0",
+            "x-oss-request-id": "fake",
+        })
+
+    def do_GET(self) -> None:
+        self.fake.delay()
+        bucket, key, query = self._split()
+        if not key:
+            self._list(bucket, query)
+            return
+        obj = self.fake.get(key)
+        if obj is None:
+            self._error(404, "NoSuchKey")
+            return
+        self.send_bytes(200, obj.data,
+                        content_type=obj.headers.get("content-type", "application/octet-stream"),
+                        headers=self._object_headers(obj))
+
+    def do_HEAD(self) -> None:
+        self.fake.delay()
+        _, key, _ = self._split()
+        obj = self.fake.get(key)
+        if obj is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.send_header("x-oss-request-id", "fake")
+            self.end_headers()
+            return
+        self.send_response(200)
+        content_type = obj.headers.get("content-type", "application/octet-stream")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(obj.data)))
+        for name, value in self._object_headers(obj).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_DELETE(self) -> None:
+        self.fake.delay()
+        _, key, _ = self._split()
+        with self.fake.lock:
+            self.fake.objects.pop(key, None)
+        self.send_bytes(204, b"", content_type="application/xml", headers={"x-oss-request-id": "fake"})
+
+    def _list(self, bucket: str, query: dict[str, list[str]]) -> None:
+        prefix = (query.get("prefix") or [""])[0]
+        token = (query.get("continuation-token") or [""])[0]
+        max_keys = int((query.get("max-keys") or ["100"])[0] or 100)
+        with self.fake.lock:
+            keys = sorted(k for k in self.fake.objects if k.startswith(prefix) and k > token)
+            page = keys[:max_keys]
+            objects = [(k, self.fake.objects[k]) for k in page]
+        truncated = len(keys) > max_keys
+        contents = "".join(
+            f"<Contents><Key>{escape(k)}</Key>"
+            f"<LastModified>{time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(o.mtime))}</LastModified>"
+            f'<ETag>"{o.etag}"</ETag><Type>Normal</Type><Size>{len(o.data)}</Size>'
+            f"<StorageClass>Standard</StorageClass></Contents>"
+            for k, o in objects
+        )
+        next_token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?><ListBucketResult>'
+            f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>"
+            f"<MaxKeys>{max_keys}</MaxKeys><KeyCount>{len(page)}</KeyCount>"
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+            f"{next_token}{contents}</ListBucketResult>"
+        ).encode("utf-8")
+        self.send_bytes(200, body, content_type="application/xml", headers={"x-oss-request-id": "fake"})
+
+
+class FakeOssServer(FakeServer):
+    def __init__(self, *, latency_ms: float = 0.0) -> None:
+        super().__init__(_OssHandler)
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.objects: dict[str, _Object] = {}
+
+    def delay(self) -> None:
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000)
+
+    def put(self, key: str, obj: _Object) -> None:
+        with self.lock:
+            self.objects[key] = obj
+
+    def get(self, key: str) -> Optional[_Object]:
+        with self.lock:
+            return self.objects.get(key)
+
+    def config(self, bucket: str = "novelai-bench") -> dict[str, Any]:
+        return {
+            "endpoint": self.base_url,
+            "bucket": bucket,
+            "domain": "",
+            "access_key_id": "fake",
+            "access_key_secret": "fake",
+        }
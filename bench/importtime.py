@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Optional
+
+# 各入口模块的冷启动导入预算（毫秒，不含解释器自身启动）。
+# web.app 的下限由 FastAPI/pydantic 决定，这里约束的是我们自己叠加上去的部分不要膨胀。
+DEFAULT_BUDGETS_MS: dict[str, float] = {
+    "storage.sync_config": 100,
+    "storage.backup": 100,
+    "novel_gen.naming": 100,
+    "web.app": 900,
+}
+
+
+def _project_root() -> Path:
+    return Path(__file__).resolve().parents[1]
+
+
+def _parse_importtime(stderr: str) -> list[tuple[str, int, int]]:
+    rows: list[tuple[str, int, int]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        try:
+            rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return rows
+
+
+def _run(code: str) -> list[tuple[str, int, int]]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (str(_project_root()), env.get("PYTHONPATH", "")) if p
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=str(_project_root()),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return _parse_importtime(proc.stderr)
+
+
+def _top_level(rows: list[tuple[str, int, int]]) -> dict[str, int]:
+    # importtime 用缩进表示嵌套层级，只有一个前导空格的是顶层导入
+    return {name.strip(): cum for name, _, cum in rows if not name.startswith("  ")}
+
+
+def measure(module: str, *, rounds: int = 3) -> dict[str, Any]:
+    baseline = set(_top_level(_run("pass")))
+    best_ms: Optional[float] = None
+    heaviest: list[tuple[str, int]] = []
+    for _ in range(max(1, rounds)):
+        rows = _run(f"import {module}")
+        total_us = sum(cum for name, cum in _top_level(rows).items() if name not in baseline)
+        ms = total_us / 1000
+        if best_ms is None or ms < best_ms:
+            best_ms = ms
+            heaviest = sorted(((n.strip(), s) for n, s, _ in rows), key=lambda x: -x[1])[:8]
+    return {
+        "module": module,
+        "import_ms": round(best_ms or 0.0, 1),
+        "heaviest_self_us": heaviest,
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.importtime",
+        description="基于 -X importtime 统计入口模块冷启动耗时，超出预算时返回非零退出码",
+    )
+    parser.add_argument("modules", nargs="*", help="默认检查全部预设入口")
+    parser.add_argument("--budget-ms", type=float, default=None, help="统一覆盖所有模块的预算")
+    parser.add_argument("--rounds", type=int, default=3, help="取多次运行中的最好成绩")
+    args = parser.parse_args(argv)
+
+    modules = args.modules or list(DEFAULT_BUDGETS_MS)
+    report: list[dict[str, Any]] = []
+    failed = False
+    for module in modules:
+        row = measure(module, rounds=args.rounds)
+        budget = args.budget_ms if args.budget_ms is not None else DEFAULT_BUDGETS_MS.get(module)
+        row["budget_ms"] = budget
+        row["ok"] = budget is None or row["import_ms"] <= budget
+        failed = failed or not row["ok"]
+        report.append(row)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
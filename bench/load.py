@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional
+from urllib.parse import urlsplit
+
+from bench.fakes.llm import FakeOpenAIServer, FakeQianfanServer
+from bench.fakes.oss import FakeOssServer
+
+# 离线压测：本地起假 OSS / DashScope / 千帆，再用真实的 web.app 跑各个场景，
+# 输出每个场景的吞吐与 p50/p99 延迟（JSON），便于前后对比抓回归。
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return int(s.getsockname()[1])
+
+
+def _write_config(path: Path, oss: FakeOssServer, llm: FakeOpenAIServer,
+                  qianfan: FakeQianfanServer) -> None:
+    import yaml
+
+    data = {**llm.config(), "oss": oss.config(), "qianfan": qianfan.config()}
+    path.write_text(yaml.safe_dump(data, allow_unicode=True), encoding="utf-8")
+
+
+class _AppServer:
+    # web.app 跑在独立进程里，避免与压测客户端、假服务争抢同一个 GIL
+    def __init__(self, env: dict[str, str]) -> None:
+        self.port = _free_port()
+        self.env = env
+        self.proc: Optional[subprocess.Popen[bytes]] = None
+
+    def start(self) -> "_AppServer":
+        root = Path(__file__).resolve().parents[1]
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "web.app:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--log-level", "warning", "--no-access-log"],
+            cwd=str(root),
+            env=self.env,
+        )
+        deadline = time.time() + 30
+        while True:
+            if self.proc.poll() is not None:
+                raise RuntimeError("web.app 启动失败")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.2):
+                    return self
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError("web.app 启动超时")
+                time.sleep(0.05)
+
+    def stop(self) -> None:
+        if self.proc is None:
+            return
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+class _Client:
+    _local = threading.local()
+
+    def __init__(self, base_url: str) -> None:
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = int(parts.port or 80)
+
+    def _conn(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            self._local.conn = conn
+        return conn
+
+    def request(self, method: str, path: str, body: Any = None) -> tuple[int, bytes, float]:
+        # 返回 (状态码, 响应体, 首字节耗时)
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        for attempt in range(2):
+            conn = self._conn()
+            try:
+                started = time.perf_counter()
+                conn.request(method, path, body=payload, headers=headers)
+                resp = conn.getresponse()
+                first = resp.read(1)
+                ttfb = time.perf_counter() - started
+                rest = resp.read()
+                return resp.status, first + rest, ttfb
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+        raise RuntimeError("unreachable")
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def _run_scenario(name: str, fn: Callable[[int], tuple[bool, float]], *,
+                  requests: int, concurrency: int) -> dict[str, Any]:
+    latencies: list[float] = []
+    ttfbs: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok, ttfb = fn(i)
+        except Exception:
+            ok, ttfb = False, 0.0
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            ttfbs.append(ttfb)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests / wall, 2) if wall > 0 else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "ttfb_p50_ms": round(_percentile(ttfbs, 0.50) * 1000, 2),
+        "ttfb_p99_ms": round(_percentile(ttfbs, 0.99) * 1000, 2),
+    }
+
+
+def _scenarios(client: _Client, novel_ids: list[str]) -> dict[str, Callable[[int], tuple[bool, float]]]:
+    story = {"background": "灵气复苏的末法时代。" * 40, "mainline": "少年入宗门。" * 200,
+             "darkline": "长老暗中布局。" * 100}
+
+    def pick(i: int) -> str:
+        return novel_ids[i % len(novel_ids)]
+
+    def list_novels(i: int) -> tuple[bool, float]:
+        status, _, ttfb = client.request("GET", "/api/novels")
+        return status == 200, ttfb
+
+    def create_novel(i: int) -> tuple[bool, float]:
+        status, body, ttfb = client.request("POST", "/api/novels", {"title": f"压测小说{i}"})
+        if status == 200:
+            novel_ids.append(json.loads(body)["id"])
+        return status == 200, ttfb
+
+    def get_novel(i: int) -> tuple[bool, float]:
+        status, _, ttfb = client.request("GET", f"/api/novels/{pick(i)}")
+        return status == 200, ttfb
+
+    def save_story(i: int) -> tuple[bool, float]:
+        status, _, ttfb = client.request("POST", f"/api/novels/{pick(i)}/story", story)
+        return status == 200, ttfb
+
+    def chat_stream(i: int) -> tuple[bool, float]:
+        status, body, ttfb = client.request(
+            "POST", "/api/chat/send_stream", {"message": f"帮我设计一个反派{i}", "use_search": False}
+        )
+        return status == 200 and bool(body), ttfb
+
+    def optimize(i: int) -> tuple[bool, float]:
+        status, body, ttfb = client.request(
+            "POST", "/api/optimize",
+            {"original": story["mainline"], "instruction": "更紧凑", "field": "mainline"},
+        )
+        return status == 200 and bool(json.loads(body).get("text")), ttfb
+
+    return {
+        "create_novel": create_novel,
+        "list_novels": list_novels,
+        "get_novel": get_novel,
+        "save_story": save_story,
+        "chat_stream": chat_stream,
+        "optimize": optimize,
+    }
+
+
+def run(
+    *,
+    scenarios: Optional[list[str]] = None,
+    requests: int = 200,
+    concurrency: int = 16,
+    llm_requests: int = 40,
+    oss_latency_ms: float = 5.0,
+    ttft_ms: float = 200.0,
+    tokens_per_s: float = 80.0,
+    reply_tokens: int = 120,
+    qianfan_latency_ms: float = 800.0,
+) -> dict[str, Any]:
+    oss = FakeOssServer(latency_ms=oss_latency_ms).start()
+    llm = FakeOpenAIServer(ttft_ms=ttft_ms, tokens_per_s=tokens_per_s,
+                           reply_tokens=reply_tokens).start()
+    qianfan = FakeQianfanServer(latency_ms=qianfan_latency_ms).start()
+    tmp = tempfile.TemporaryDirectory(prefix="novelai-bench-")
+    config_path = Path(tmp.name) / "base.yaml"
+    _write_config(config_path, oss, llm, qianfan)
+    env = dict(os.environ)
+    env["NOVELAI_CONFIG_PATH"] = str(config_path)
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env.setdefault("CHAT_ROUTE_MODE", "auto")
+    # 聊天记录写到临时目录，不碰项目下的 data/chat
+    env.setdefault("NOVELAI_CHAT_STORE", f"log://{Path(tmp.name) / 'chat'}")
+
+    app_server = _AppServer(env).start()
+    try:
+        client = _Client(f"http://127.0.0.1:{app_server.port}")
+        novel_ids: list[str] = []
+        table = _scenarios(client, novel_ids)
+        selected = scenarios or list(table)
+        if "create_novel" not in selected:
+            # 其他场景依赖已有的小说
+            table["create_novel"](0)
+        results = []
+        for name in selected:
+            is_llm = name in ("chat_stream", "optimize")
+            results.append(_run_scenario(
+                name, table[name],
+                requests=llm_requests if is_llm else requests,
+                concurrency=concurrency,
+            ))
+        return {
+            "settings": {
+                "oss_latency_ms": oss_latency_ms, "ttft_ms": ttft_ms,
+                "tokens_per_s": tokens_per_s, "reply_tokens": reply_tokens,
+                "concurrency": concurrency,
+            },
+            "results": results,
+        }
+    finally:
+        app_server.stop()
+        for srv in (oss, llm, qianfan):
+            srv.stop()
+        tmp.cleanup()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.load", description="离线负载场景压测")
+    parser.add_argument("--scenario", action="append", dest="scenarios",
+                        help="可多次指定；默认全部：create_novel list_novels get_novel save_story chat_stream optimize")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--llm-requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--oss-latency-ms", type=float, default=5.0)
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--tokens-per-s", type=float, default=80.0)
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--qianfan-latency-ms", type=float, default=800.0)
+    parser.add_argument("--output", help="结果另存为 JSON 文件")
+    args = parser.parse_args(argv)
+
+    report = run(
+        scenarios=args.scenarios,
+        requests=max(1, args.requests),
+        concurrency=max(1, args.concurrency),
+        llm_requests=max(1, args.llm_requests),
+        oss_latency_ms=args.oss_latency_ms,
+        ttft_ms=args.ttft_ms,
+        tokens_per_s=args.tokens_per_s,
+        reply_tokens=args.reply_tokens,
+        qianfan_latency_ms=args.qianfan_latency_ms,
+    )
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+    return 0 if all(r["errors"] == 0 for r in report["results"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
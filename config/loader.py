@@ -1,16 +1,17 @@
 from __future__ import annotations
 
+import hashlib
 import os
+import signal
+import threading
+import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Mapping, Optional
+from typing import Any, Callable, Mapping, Optional
 
 from config.log import get_logger
 
 _logger = get_logger(__name__)
-_CACHED_BASE_CONFIG: Optional["BaseConfig"] = None
-_CACHED_OSS_CONFIG: Optional["OssConfig"] = None
-_CACHED_QIANFAN_CONFIG: Optional["QianfanConfig"] = None
 
 
 @dataclass(frozen=True)
@@ -27,6 +28,7 @@ class OssConfig:
     domain: str
     access_key_id: str
     access_key_secret: str
+    document_codec: str = "gzip"  # 大文档的压缩格式：gzip / zstd
 
 
 @dataclass(frozen=True)
@@ -40,6 +42,109 @@ class QianfanConfig:
     stream: bool
 
 
+@dataclass(frozen=True)
+class PresignConfig:
+    get_ttl_s: int
+    put_ttl_s: int
+    max_upload_mb: float
+    cache_size: int
+
+
+@dataclass(frozen=True)
+class ServerConfig:
+    host: str
+    port: int
+    workers: int
+    graceful_timeout_s: float
+    chat_store: str
+    search_index: str
+
+
+@dataclass(frozen=True)
+class ProviderLimit:
+    max_concurrent: int
+    max_queue: int
+    max_wait_s: float
+    rate_per_s: float
+    burst: int
+
+
+@dataclass(frozen=True)
+class ProviderConfig:
+    name: str
+    api_key: str
+    base_url: str
+    model: str
+    cache_hints: bool
+    fast_model: str
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    name: str
+    model: str
+    providers: tuple[str, ...]
+    max_tokens: Optional[int]
+    temperature: Optional[float]
+    stop: tuple[str, ...]
+    timeout_s: float
+    stream: bool
+
+
+@dataclass(frozen=True)
+class RouterConfig:
+    hedge: bool
+    hedge_quantile: float
+    hedge_min_delay_s: float
+    failure_threshold: int
+    cooldown_s: float
+
+
+@dataclass(frozen=True)
+class JobsConfig:
+    workers: int
+    max_queue: int
+    retention_s: float
+
+
+@dataclass(frozen=True)
+class BatchConfig:
+    provider: str
+    completion_window: str
+    poll_interval_s: float
+    max_requests: int
+
+
+@dataclass(frozen=True)
+class RetrievalConfig:
+    enabled: bool
+    embedder: str
+    model: str
+    dim: int
+    top_k: int
+    min_score: float
+    dir: str
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    base: BaseConfig
+    oss: OssConfig
+    presign: PresignConfig
+    qianfan: QianfanConfig
+    server: ServerConfig
+    limits: Mapping[str, ProviderLimit]
+    providers: tuple[ProviderConfig, ...]
+    router: RouterConfig
+    profiles: Mapping[str, GenerationProfile]
+    jobs: JobsConfig
+    batch: BatchConfig
+    retrieval: RetrievalConfig
+    path: Path
+    digest: str
+    version: int
+
+
 def _project_root() -> Path:
     return Path(__file__).resolve().parents[1]
 
@@ -48,19 +153,31 @@ def _default_config_path() -> Path:
     return _project_root() / "config" / "data" / "base.yaml"
 
 
-def _read_yaml(path: Path) -> Mapping[str, Any]:
+def _resolve_path(config_path: Optional[str | Path] = None) -> Path:
+    path = (
+        Path(config_path)
+        if config_path is not None
+        else Path(os.getenv("NOVELAI_CONFIG_PATH") or _default_config_path())
+    )
+    return path.resolve()
+
+
+def _parse_yaml(raw: bytes, *, path: Path) -> Mapping[str, Any]:
     try:
         import yaml
     except Exception as exc:
         raise RuntimeError("缺少依赖：PyYAML。请先安装：pip install pyyaml") from exc
 
-    raw = path.read_text(encoding="utf-8")
-    data = yaml.safe_load(raw) or {}
+    data = yaml.safe_load(raw.decode("utf-8")) or {}
     if not isinstance(data, dict):
         raise ValueError(f"配置文件内容必须是YAML字典：{path}")
     return data
 
 
+def _read_yaml(path: Path) -> Mapping[str, Any]:
+    return _parse_yaml(path.read_bytes(), path=path)
+
+
 def _as_str(value: Any, *, field_name: str, path: Path) -> str:
     if value is None:
         return ""
@@ -94,6 +211,17 @@ def _as_bool(value: Any, *, field_name: str, path: Path, default: bool) -> bool:
     raise ValueError(f"字段 {field_name} 必须是布尔值：{path}")
 
 
+def _as_number(value: Any, *, field_name: str, path: Path, default: float) -> float:
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"字段 {field_name} 必须是数字：{path}")
+    try:
+        return float(value)
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f"字段 {field_name} 必须是数字：{path}") from exc
+
+
 def _normalize_urlish(value: str) -> str:
     v = (value or "").strip()
     if not v:
@@ -103,53 +231,28 @@ def _normalize_urlish(value: str) -> str:
     return v
 
 
-def load_base_config(config_path: Optional[str | Path] = None) -> BaseConfig:
-    path = (
-        Path(config_path)
-        if config_path is not None
-        else Path(os.getenv("NOVELAI_CONFIG_PATH") or _default_config_path())
-    )
-    path = path.resolve()
-
-    data = _read_yaml(path)
-
-    api_key = os.getenv("DASHSCOPE_API_KEY") or _as_str(
-        data.get("api_key"), field_name="api_key", path=path
+def _build_base_config(data: Mapping[str, Any], *, path: Path) -> BaseConfig:
+    api_key = (
+        os.getenv("AI_API_KEY")
+        or os.getenv("DASHSCOPE_API_KEY")
+        or _as_str(data.get("api_key"), field_name="api_key", path=path)
     )
-    base_url = os.getenv("DASHSCOPE_BASE_URL") or _as_str(
-        data.get("base_url"), field_name="base_url", path=path
+    base_url = (
+        os.getenv("AI_BASE_URL")
+        or os.getenv("DASHSCOPE_BASE_URL")
+        or _as_str(data.get("base_url"), field_name="base_url", path=path)
     )
-    model = os.getenv("DASHSCOPE_MODEL") or _as_str(
-        data.get("model"), field_name="model", path=path
+    model = (
+        os.getenv("AI_MODEL")
+        or os.getenv("DASHSCOPE_MODEL")
+        or _as_str(data.get("model"), field_name="model", path=path)
     )
 
     base_url = _normalize_urlish(base_url)
-    cfg = BaseConfig(api_key=api_key, base_url=base_url, model=model)
-    _logger.info(
-        "BaseConfig loaded (api_key=%s, base_url=%s, model=%s)",
-        "set" if bool(cfg.api_key) else "empty",
-        cfg.base_url,
-        cfg.model,
-    )
-    return cfg
-
-
-def get_base_config() -> BaseConfig:
-    global _CACHED_BASE_CONFIG
-    if _CACHED_BASE_CONFIG is None:
-        _CACHED_BASE_CONFIG = load_base_config()
-    return _CACHED_BASE_CONFIG
+    return BaseConfig(api_key=api_key, base_url=base_url, model=model)
 
 
-def load_oss_config(config_path: Optional[str | Path] = None) -> OssConfig:
-    path = (
-        Path(config_path)
-        if config_path is not None
-        else Path(os.getenv("NOVELAI_CONFIG_PATH") or _default_config_path())
-    )
-    path = path.resolve()
-
-    data = _read_yaml(path)
+def _build_oss_config(data: Mapping[str, Any], *, path: Path) -> OssConfig:
     oss_data = _as_mapping(data.get("oss"), field_name="oss", path=path)
 
     endpoint = os.getenv("OSS_ENDPOINT") or _as_str(
@@ -174,40 +277,47 @@ def load_oss_config(config_path: Optional[str | Path] = None) -> OssConfig:
         )
     )
 
-    cfg = OssConfig(
+    # zstd 要求所有 worker 都装了 zstandard，否则读不了别的 worker 写的文档，所以只能显式开启
+    document_codec = (
+        os.getenv("NOVELAI_DOCUMENT_CODEC")
+        or _as_str(oss_data.get("document_codec"), field_name="oss.document_codec", path=path)
+        or "gzip"
+    ).strip().lower()
+    if document_codec not in ("gzip", "zstd"):
+        raise ValueError(f"字段 oss.document_codec 只能是 gzip 或 zstd：{path}")
+
+    return OssConfig(
         endpoint=endpoint,
         bucket=bucket,
         domain=domain,
         access_key_id=access_key_id,
         access_key_secret=access_key_secret,
+        document_codec=document_codec,
     )
-    _logger.info(
-        "OssConfig loaded (bucket=%s, endpoint=%s, domain=%s, access_key_id=%s, access_key_secret=%s)",
-        cfg.bucket,
-        cfg.endpoint,
-        cfg.domain,
-        "set" if bool(cfg.access_key_id) else "empty",
-        "set" if bool(cfg.access_key_secret) else "empty",
-    )
-    return cfg
 
 
-def get_oss_config() -> OssConfig:
-    global _CACHED_OSS_CONFIG
-    if _CACHED_OSS_CONFIG is None:
-        _CACHED_OSS_CONFIG = load_oss_config()
-    return _CACHED_OSS_CONFIG
+def _build_presign_config(data: Mapping[str, Any], *, path: Path) -> PresignConfig:
+    ps_data = _as_mapping(data.get("presign"), field_name="presign", path=path)
 
+    def number(key: str, default: float) -> float:
+        return _as_number(ps_data.get(key), field_name=f"presign.{key}", path=path, default=default)
 
-def load_qianfan_config(config_path: Optional[str | Path] = None) -> QianfanConfig:
-    path = (
-        Path(config_path)
-        if config_path is not None
-        else Path(os.getenv("NOVELAI_CONFIG_PATH") or _default_config_path())
+    # 下载链接的过期时间按 get_ttl_s 的一半对齐，同一窗口内各 worker 签出的链接相同，
+    # 浏览器和 CDN 的缓存能命中
+    get_ttl_s = number("get_ttl_s", 900)
+    put_ttl_s = number("put_ttl_s", 600)
+    max_upload_mb = number("max_upload_mb", 50)
+    cache_size = number("cache_size", 2048)
+
+    return PresignConfig(
+        get_ttl_s=max(60, int(get_ttl_s)),
+        put_ttl_s=max(60, int(put_ttl_s)),
+        max_upload_mb=max(0.0, max_upload_mb),
+        cache_size=max(0, int(cache_size)),
     )
-    path = path.resolve()
 
-    data = _read_yaml(path)
+
+def _build_qianfan_config(data: Mapping[str, Any], *, path: Path) -> QianfanConfig:
     qf_data = _as_mapping(
         data.get("qianfan") or data.get("baidu_qianfan"), field_name="qianfan", path=path
     )
@@ -234,21 +344,26 @@ def load_qianfan_config(config_path: Optional[str | Path] = None) -> QianfanConf
     )
 
     enable_corner_markers = _as_bool(
-        qf_data.get("enable_corner_markers"),
+        os.getenv("BAIDU_QIANFAN_ENABLE_CORNER_MARKERS", qf_data.get("enable_corner_markers")),
         field_name="qianfan.enable_corner_markers",
         path=path,
         default=True,
     )
     enable_deep_search = _as_bool(
-        qf_data.get("enable_deep_search"),
+        os.getenv("BAIDU_QIANFAN_ENABLE_DEEP_SEARCH", qf_data.get("enable_deep_search")),
         field_name="qianfan.enable_deep_search",
         path=path,
         default=True,
     )
-    stream = _as_bool(qf_data.get("stream"), field_name="qianfan.stream", path=path, default=False)
+    stream = _as_bool(
+        os.getenv("BAIDU_QIANFAN_STREAM", qf_data.get("stream")),
+        field_name="qianfan.stream",
+        path=path,
+        default=False,
+    )
 
     base_url = _normalize_urlish(base_url)
-    cfg = QianfanConfig(
+    return QianfanConfig(
         api_key=api_key,
         base_url=base_url,
         model=model,
@@ -257,18 +372,537 @@ def load_qianfan_config(config_path: Optional[str | Path] = None) -> QianfanConf
         enable_deep_search=enable_deep_search,
         stream=stream,
     )
+
+
+def _build_server_config(data: Mapping[str, Any], *, path: Path) -> ServerConfig:
+    srv_data = _as_mapping(data.get("server"), field_name="server", path=path)
+
+    host = os.getenv("NOVELAI_HOST") or _as_str(
+        srv_data.get("host"), field_name="server.host", path=path
+    ) or "0.0.0.0"
+    port = _as_number(
+        os.getenv("NOVELAI_PORT") or srv_data.get("port"),
+        field_name="server.port",
+        path=path,
+        default=8000,
+    )
+    workers = _as_number(
+        os.getenv("WEB_CONCURRENCY") or srv_data.get("workers"),
+        field_name="server.workers",
+        path=path,
+        default=1,
+    )
+    graceful_timeout_s = _as_number(
+        os.getenv("NOVELAI_GRACEFUL_TIMEOUT") or srv_data.get("graceful_timeout_s"),
+        field_name="server.graceful_timeout_s",
+        path=path,
+        default=30,
+    )
+    # log:///绝对目录 / log:相对目录 / sqlite:///绝对路径 / sqlite:相对路径 / redis://host:port/db / memory；
+    # 默认落盘到 data/chat，重启、多 worker 都不丢聊天记录
+    chat_store = os.getenv("NOVELAI_CHAT_STORE") or _as_str(
+        srv_data.get("chat_store"), field_name="server.chat_store", path=path
+    ) or "log:data/chat"
+    # 全文检索索引：sqlite:///绝对路径 / sqlite:相对路径
+    search_index = os.getenv("NOVELAI_SEARCH_INDEX") or _as_str(
+        srv_data.get("search_index"), field_name="server.search_index", path=path
+    ) or "sqlite:data/search.db"
+
+    return ServerConfig(
+        host=host.strip(),
+        port=int(port),
+        workers=max(1, int(workers)),
+        graceful_timeout_s=max(0.0, graceful_timeout_s),
+        chat_store=chat_store.strip(),
+        search_index=search_index.strip(),
+    )
+
+
+# 每个 worker 进程各自生效；多 worker 部署时按 上游配额 / worker 数 来配
+_DEFAULT_LIMITS: dict[str, dict[str, float]] = {
+    "default": {
+        "max_concurrent": 8, "max_queue": 32, "max_wait_s": 30, "rate_per_s": 0, "burst": 0,
+    },
+    "qianfan": {"max_concurrent": 4, "max_queue": 16},
+}
+
+
+def _build_limits_config(data: Mapping[str, Any], *, path: Path) -> dict[str, ProviderLimit]:
+    limits_data = _as_mapping(data.get("limits"), field_name="limits", path=path)
+    names = set(_DEFAULT_LIMITS) | set(limits_data)
+    result: dict[str, ProviderLimit] = {}
+    for name in sorted(names):
+        defaults = {**_DEFAULT_LIMITS["default"], **_DEFAULT_LIMITS.get(name, {})}
+        item = _as_mapping(limits_data.get(name), field_name=f"limits.{name}", path=path)
+        values = {
+            key: _as_number(
+                item.get(key), field_name=f"limits.{name}.{key}", path=path, default=default
+            )
+            for key, default in defaults.items()
+        }
+        max_concurrent = max(1, int(values["max_concurrent"]))
+        result[name] = ProviderLimit(
+            max_concurrent=max_concurrent,
+            max_queue=max(0, int(values["max_queue"])),
+            max_wait_s=max(0.0, values["max_wait_s"]),
+            rate_per_s=max(0.0, values["rate_per_s"]),
+            burst=max(1, int(values["burst"]) or max_concurrent),
+        )
+    return result
+
+
+def default_fast_model(base_url: str) -> str:
+    # 分类、取名这类短输出调用默认换成同一后端的便宜快速模型；识别不出后端时沿用主模型
+    return "qwen-turbo" if "dashscope" in base_url else ""
+
+
+def _build_providers_config(
+    data: Mapping[str, Any], base: BaseConfig, *, path: Path
+) -> tuple[ProviderConfig, ...]:
+    # 未配置 providers 时，顶层的 api_key/base_url/model 就是唯一的后端
+    raw = data.get("providers")
+    if raw is None:
+        return (
+            ProviderConfig(
+                name="dashscope",
+                api_key=base.api_key,
+                base_url=base.base_url,
+                model=base.model,
+                cache_hints="dashscope" in base.base_url,
+                fast_model=default_fast_model(base.base_url),
+            ),
+        )
+    if not isinstance(raw, list):
+        raise ValueError(f"字段 providers 必须是YAML列表：{path}")
+
+    result: list[ProviderConfig] = []
+    for i, item in enumerate(raw):
+        field = f"providers[{i}]"
+        item = _as_mapping(item, field_name=field, path=path)
+        name = _as_str(item.get("name"), field_name=f"{field}.name", path=path).strip()
+        if not name:
+            raise ValueError(f"字段 {field}.name 不能为空：{path}")
+        if any(p.name == name for p in result):
+            raise ValueError(f"providers 中的 name 重复：{name}（{path}）")
+        # api_key_env 让密钥留在环境变量里，配置文件可以放心提交
+        key_env = _as_str(item.get("api_key_env"), field_name=f"{field}.api_key_env", path=path)
+        api_key = (os.getenv(key_env) if key_env else None) or _as_str(
+            item.get("api_key"), field_name=f"{field}.api_key", path=path
+        ) or base.api_key
+        base_url = _normalize_urlish(
+            _as_str(item.get("base_url"), field_name=f"{field}.base_url", path=path)
+        ) or base.base_url
+        model = _as_str(item.get("model"), field_name=f"{field}.model", path=path) or base.model
+        # 显式缓存标记默认只对 DashScope 开启
+        cache_hints = _as_bool(
+            item.get("cache_hints"),
+            field_name=f"{field}.cache_hints",
+            path=path,
+            default="dashscope" in base_url,
+        )
+        fast_model = _as_str(
+            item.get("fast_model"), field_name=f"{field}.fast_model", path=path
+        ) or default_fast_model(base_url)
+        result.append(
+            ProviderConfig(
+                name=name,
+                api_key=api_key,
+                base_url=base_url,
+                model=model,
+                cache_hints=cache_hints,
+                fast_model=fast_model.strip(),
+            )
+        )
+    if not result:
+        raise ValueError(f"providers 不能为空列表：{path}")
+    return tuple(result)
+
+
+def _build_router_config(data: Mapping[str, Any], *, path: Path) -> RouterConfig:
+    router_data = _as_mapping(data.get("router"), field_name="router", path=path)
+
+    hedge = _as_bool(
+        os.getenv("NOVELAI_LLM_HEDGE", router_data.get("hedge")),
+        field_name="router.hedge",
+        path=path,
+        default=False,
+    )
+    def number(key: str, default: float) -> float:
+        return _as_number(
+            router_data.get(key), field_name=f"router.{key}", path=path, default=default
+        )
+
+    hedge_quantile = number("hedge_quantile", 0.95)
+    hedge_min_delay_s = number("hedge_min_delay_s", 1.0)
+    failure_threshold = number("failure_threshold", 3)
+    cooldown_s = number("cooldown_s", 30)
+
+    return RouterConfig(
+        hedge=hedge,
+        hedge_quantile=min(0.999, max(0.5, hedge_quantile)),
+        hedge_min_delay_s=max(0.0, hedge_min_delay_s),
+        failure_threshold=max(1, int(failure_threshold)),
+        cooldown_s=max(0.0, cooldown_s),
+    )
+
+
+# 按调用场景限定输出长度、采样和超时；未列出的场景用 default。
+# model 留空用后端自己的模型，写 fast 用后端的 fast_model，写具体模型名则所有后端都用它
+# （不同厂商的模型名不通用，这时配合 providers 限定后端）。max_tokens 为 0 表示不限制。
+_DEFAULT_PROFILES: dict[str, dict[str, Any]] = {
+    "default": {
+        "model": "", "providers": [], "max_tokens": 2048, "temperature": 0.7, "stop": [],
+        "timeout_s": 120, "stream": True,
+    },
+    "route": {
+        "model": "fast", "max_tokens": 32, "temperature": 0, "timeout_s": 10, "stream": False,
+    },
+    "naming": {
+        "model": "fast", "max_tokens": 64, "temperature": 1.0, "timeout_s": 20, "stream": False,
+    },
+    "summary": {"max_tokens": 800, "temperature": 0.3, "timeout_s": 60, "stream": False},
+    "optimize": {"max_tokens": 4096, "timeout_s": 120, "stream": False},
+    "outline": {"max_tokens": 4096, "temperature": 0.8, "timeout_s": 180, "stream": False},
+    "chat": {"max_tokens": 2048, "temperature": 0.8, "timeout_s": 120},
+    "chapter": {"max_tokens": 8192, "temperature": 0.9, "timeout_s": 300},
+}
+
+
+def _as_str_list(value: Any, *, field_name: str, path: Path) -> tuple[str, ...]:
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"字段 {field_name} 必须是字符串列表：{path}")
+    return tuple(v for v in value if v)
+
+
+def _build_profiles_config(
+    data: Mapping[str, Any], *, path: Path
+) -> dict[str, GenerationProfile]:
+    profiles_data = _as_mapping(data.get("profiles"), field_name="profiles", path=path)
+    names = set(_DEFAULT_PROFILES) | set(profiles_data)
+    result: dict[str, GenerationProfile] = {}
+    for name in sorted(names):
+        field = f"profiles.{name}"
+        item = {
+            **_DEFAULT_PROFILES["default"],
+            **_DEFAULT_PROFILES.get(name, {}),
+            **_as_mapping(profiles_data.get(name), field_name=field, path=path),
+        }
+        max_tokens = _as_number(
+            item.get("max_tokens"), field_name=f"{field}.max_tokens", path=path, default=0
+        )
+        temperature = item.get("temperature")
+        if temperature is not None:
+            temperature = _as_number(
+                temperature, field_name=f"{field}.temperature", path=path, default=0.7
+            )
+        stop = _as_str_list(item.get("stop"), field_name=f"{field}.stop", path=path)
+        if len(stop) > 4:
+            raise ValueError(f"字段 {field}.stop 最多4个：{path}")
+        timeout_s = _as_number(
+            item.get("timeout_s"), field_name=f"{field}.timeout_s", path=path, default=120
+        )
+        result[name] = GenerationProfile(
+            name=name,
+            model=_as_str(item.get("model"), field_name=f"{field}.model", path=path).strip(),
+            providers=_as_str_list(
+                item.get("providers"), field_name=f"{field}.providers", path=path
+            ),
+            max_tokens=int(max_tokens) if max_tokens > 0 else None,
+            temperature=None if temperature is None else min(2.0, max(0.0, temperature)),
+            stop=stop,
+            timeout_s=max(1.0, timeout_s),
+            stream=_as_bool(
+                item.get("stream"), field_name=f"{field}.stream", path=path, default=True
+            ),
+        )
+    return result
+
+
+def _build_jobs_config(data: Mapping[str, Any], *, path: Path) -> JobsConfig:
+    jobs_data = _as_mapping(data.get("jobs"), field_name="jobs", path=path)
+
+    workers = _as_number(
+        os.getenv("NOVELAI_JOB_WORKERS") or jobs_data.get("workers"),
+        field_name="jobs.workers",
+        path=path,
+        default=4,
+    )
+    max_queue = _as_number(
+        jobs_data.get("max_queue"), field_name="jobs.max_queue", path=path, default=64
+    )
+    # 结束的任务在内存里保留多久（结果已落 OSS，过期后查询走存储）
+    retention_s = _as_number(
+        jobs_data.get("retention_s"), field_name="jobs.retention_s", path=path, default=3600
+    )
+
+    return JobsConfig(
+        workers=max(1, int(workers)),
+        max_queue=max(0, int(max_queue)),
+        retention_s=max(0.0, retention_s),
+    )
+
+
+def _build_batch_config(data: Mapping[str, Any], *, path: Path) -> BatchConfig:
+    batch_data = _as_mapping(data.get("batch"), field_name="batch", path=path)
+
+    # 走哪个后端的 Batch 接口（providers 里的 name），留空用第一个
+    provider = os.getenv("NOVELAI_BATCH_PROVIDER") or _as_str(
+        batch_data.get("provider"), field_name="batch.provider", path=path
+    )
+    completion_window = _as_str(
+        batch_data.get("completion_window"), field_name="batch.completion_window", path=path
+    ) or "24h"
+    poll_interval_s = _as_number(
+        batch_data.get("poll_interval_s"), field_name="batch.poll_interval_s", path=path, default=30
+    )
+    # 单个 Batch 文件的请求条数上限（DashScope 为 5 万），超出的分成多个 Batch 提交
+    max_requests = _as_number(
+        batch_data.get("max_requests"), field_name="batch.max_requests", path=path, default=50000
+    )
+
+    return BatchConfig(
+        provider=provider.strip(),
+        completion_window=completion_window.strip(),
+        poll_interval_s=max(0.1, poll_interval_s),
+        max_requests=max(1, int(max_requests)),
+    )
+
+
+def _build_retrieval_config(data: Mapping[str, Any], *, path: Path) -> RetrievalConfig:
+    rt_data = _as_mapping(data.get("retrieval"), field_name="retrieval", path=path)
+
+    enabled = _as_bool(
+        os.getenv("NOVELAI_RETRIEVAL") or rt_data.get("enabled"),
+        field_name="retrieval.enabled",
+        path=path,
+        default=True,
+    )
+    # hashing：本地哈希 n-gram，离线可用；openai：走主后端的 OpenAI 兼容 embeddings 接口
+    embedder = os.getenv("NOVELAI_EMBEDDER") or _as_str(
+        rt_data.get("embedder"), field_name="retrieval.embedder", path=path
+    ) or "hashing"
+    model = _as_str(
+        rt_data.get("model"), field_name="retrieval.model", path=path
+    ) or "text-embedding-v3"
+    dim = _as_number(rt_data.get("dim"), field_name="retrieval.dim", path=path, default=1024)
+    top_k = _as_number(rt_data.get("top_k"), field_name="retrieval.top_k", path=path, default=4)
+    min_score = _as_number(
+        rt_data.get("min_score"), field_name="retrieval.min_score", path=path, default=0.1
+    )
+    # 向量文件目录，相对路径按项目根解析；同机多个 worker 共用
+    vec_dir = _as_str(rt_data.get("dir"), field_name="retrieval.dir", path=path) or "data/vectors"
+
+    return RetrievalConfig(
+        enabled=enabled,
+        embedder=embedder.strip().lower(),
+        model=model.strip(),
+        dim=max(16, int(dim)),
+        top_k=max(0, int(top_k)),
+        min_score=float(min_score),
+        dir=vec_dir.strip(),
+    )
+
+
+def load_base_config(config_path: Optional[str | Path] = None) -> BaseConfig:
+    path = _resolve_path(config_path)
+    return _build_base_config(_read_yaml(path), path=path)
+
+
+def load_oss_config(config_path: Optional[str | Path] = None) -> OssConfig:
+    path = _resolve_path(config_path)
+    return _build_oss_config(_read_yaml(path), path=path)
+
+
+def load_qianfan_config(config_path: Optional[str | Path] = None) -> QianfanConfig:
+    path = _resolve_path(config_path)
+    return _build_qianfan_config(_read_yaml(path), path=path)
+
+
+def load_server_config(config_path: Optional[str | Path] = None) -> ServerConfig:
+    path = _resolve_path(config_path)
+    return _build_server_config(_read_yaml(path), path=path)
+
+
+# ---- 共享配置快照：一次解析，按 mtime/哈希 原子替换，并通知订阅者 ----
+
+ConfigListener = Callable[[ConfigSnapshot, Optional[ConfigSnapshot]], None]
+
+_snapshot: Optional[ConfigSnapshot] = None
+_snapshot_lock = threading.Lock()
+_listeners: list[ConfigListener] = []
+_last_stat: Optional[tuple[str, int, int]] = None
+_last_check = 0.0
+
+
+def _check_interval_s() -> float:
+    try:
+        return max(0.0, float(os.getenv("NOVELAI_CONFIG_CHECK_INTERVAL") or 2.0))
+    except ValueError:
+        return 2.0
+
+
+def _stat_key(path: Path) -> Optional[tuple[str, int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (str(path), st.st_mtime_ns, st.st_size)
+
+
+def _build_snapshot(raw: bytes, *, path: Path, digest: str, version: int) -> ConfigSnapshot:
+    data = _parse_yaml(raw, path=path)
+    base = _build_base_config(data, path=path)
+    snap = ConfigSnapshot(
+        base=base,
+        oss=_build_oss_config(data, path=path),
+        presign=_build_presign_config(data, path=path),
+        qianfan=_build_qianfan_config(data, path=path),
+        server=_build_server_config(data, path=path),
+        limits=_build_limits_config(data, path=path),
+        providers=_build_providers_config(data, base, path=path),
+        router=_build_router_config(data, path=path),
+        profiles=_build_profiles_config(data, path=path),
+        jobs=_build_jobs_config(data, path=path),
+        batch=_build_batch_config(data, path=path),
+        retrieval=_build_retrieval_config(data, path=path),
+        path=path,
+        digest=digest,
+        version=version,
+    )
     _logger.info(
-        "QianfanConfig loaded (api_key=%s, base_url=%s, model=%s, search_source=%s)",
-        "set" if bool(cfg.api_key) else "empty",
-        cfg.base_url,
-        cfg.model,
-        cfg.search_source,
+        "Config snapshot loaded (version=%s, digest=%s, path=%s, model=%s, api_key=%s, "
+        "bucket=%s, oss_key=%s, qianfan_key=%s, chat_store=%s, providers=%s)",
+        snap.version,
+        snap.digest[:12],
+        path,
+        snap.base.model,
+        "set" if bool(snap.base.api_key) else "empty",
+        snap.oss.bucket,
+        "set" if bool(snap.oss.access_key_id and snap.oss.access_key_secret) else "empty",
+        "set" if bool(snap.qianfan.api_key) else "empty",
+        snap.server.chat_store.split("://", 1)[0],
+        ",".join(p.name for p in snap.providers),
     )
-    return cfg
+    return snap
+
+
+def _notify(new: ConfigSnapshot, old: Optional[ConfigSnapshot]) -> None:
+    for listener in list(_listeners):
+        try:
+            listener(new, old)
+        except Exception:
+            _logger.exception("配置变更回调执行失败: %r", listener)
+
+
+def reload_config(*, force: bool = False) -> ConfigSnapshot:
+    global _snapshot, _last_stat, _last_check
+    path = _resolve_path()
+    with _snapshot_lock:
+        old = _snapshot
+        stat = _stat_key(path)
+        _last_check = time.monotonic()
+        if old is not None and not force and stat is not None and stat == _last_stat:
+            return old
+        try:
+            raw = path.read_bytes()
+            digest = hashlib.sha256(raw).hexdigest()
+            if old is not None and old.path == path and old.digest == digest:
+                _last_stat = stat
+                return old
+            new = _build_snapshot(
+                raw, path=path, digest=digest, version=(old.version + 1) if old else 1
+            )
+        except Exception:
+            if old is None:
+                raise
+            _logger.exception("配置重新加载失败，继续使用旧配置 (path=%s)", path)
+            return old
+        _snapshot = new
+        _last_stat = stat
+    if old is not None:
+        _notify(new, old)
+    return new
+
+
+def get_config_snapshot() -> ConfigSnapshot:
+    snap = _snapshot
+    if snap is None or time.monotonic() - _last_check >= _check_interval_s():
+        return reload_config()
+    return snap
+
+
+def subscribe(listener: ConfigListener) -> Callable[[], None]:
+    with _snapshot_lock:
+        _listeners.append(listener)
+
+    def unsubscribe() -> None:
+        with _snapshot_lock:
+            if listener in _listeners:
+                _listeners.remove(listener)
+
+    return unsubscribe
+
+
+def install_sighup_reload() -> bool:
+    sighup = getattr(signal, "SIGHUP", None)
+    if sighup is None or threading.current_thread() is not threading.main_thread():
+        return False
+
+    def _handler(signum: int, frame: Any) -> None:
+        # 信号处理函数里不做文件 IO，交给后台线程
+        threading.Thread(
+            target=reload_config, kwargs={"force": True}, name="config-reload", daemon=True
+        ).start()
+
+    signal.signal(sighup, _handler)
+    return True
+
+
+def get_base_config() -> BaseConfig:
+    return get_config_snapshot().base
+
+
+def get_oss_config() -> OssConfig:
+    return get_config_snapshot().oss
+
+
+def get_presign_config() -> PresignConfig:
+    return get_config_snapshot().presign
 
 
 def get_qianfan_config() -> QianfanConfig:
-    global _CACHED_QIANFAN_CONFIG
-    if _CACHED_QIANFAN_CONFIG is None:
-        _CACHED_QIANFAN_CONFIG = load_qianfan_config()
-    return _CACHED_QIANFAN_CONFIG
+    return get_config_snapshot().qianfan
+
+
+def get_server_config() -> ServerConfig:
+    return get_config_snapshot().server
+
+
+def get_provider_limit(provider: str) -> ProviderLimit:
+    limits = get_config_snapshot().limits
+    return limits.get(provider) or limits["default"]
+
+
+def get_providers_config() -> tuple[ProviderConfig, ...]:
+    return get_config_snapshot().providers
+
+
+def get_generation_profile(name: Optional[str] = None) -> GenerationProfile:
+    profiles = get_config_snapshot().profiles
+    return profiles.get(name or "default") or profiles["default"]
+
+
+def get_jobs_config() -> JobsConfig:
+    return get_config_snapshot().jobs
+
+
+def get_batch_config() -> BatchConfig:
+    return get_config_snapshot().batch
+
+
+def get_retrieval_config() -> RetrievalConfig:
+    return get_config_snapshot().retrieval
@@ -1,43 +1,195 @@
 from __future__ import annotations
 
+import atexit
+import json
 import logging
 import os
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
 _CONFIGURED = False
+_BOOTSTRAPPED = False
+_setup_lock = threading.Lock()
+_listener: Any = None
+
+DEFAULT_QUEUE_SIZE = 10000
 
 
 def _project_root() -> Path:
     return Path(__file__).resolve().parents[1]
 
 
+def _resolve_level(level: Optional[str] = None) -> int:
+    resolved_level = (level or os.getenv("LOG_LEVEL") or "INFO").upper()
+    return getattr(logging, resolved_level, logging.INFO)
+
+
+class _BootstrapHandler(logging.Handler):
+    # 占位 handler：第一条日志真正输出时才创建文件与 handler，让 import 保持轻量
+    def emit(self, record: logging.LogRecord) -> None:
+        setup_logging()
+        for handler in logging.getLogger().handlers:
+            if handler is not self and record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_bootstrap_handler = _BootstrapHandler()
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload: dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def _parse_sample_rates(raw: str) -> dict[str, float]:
+    # 例如 LOG_SAMPLE="storage.oss_storage=0.01,web.app=0.5"
+    rates: dict[str, float] = {}
+    for item in (raw or "").split(","):
+        name, sep, value = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(value)))
+        except ValueError:
+            continue
+    return rates
+
+
+class _SamplingFilter(logging.Filter):
+    # 只对 WARNING 以下的高频成功日志按模块抽样，告警与错误始终保留
+    def __init__(self, rates: dict[str, float]) -> None:
+        super().__init__()
+        self._rules = sorted(rates.items(), key=lambda kv: -len(kv[0]))
+        self._counters: dict[str, int] = {}
+
+    def _rate(self, name: str) -> Optional[float]:
+        for prefix, rate in self._rules:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self._rules:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        every = max(1, round(1 / rate))
+        n = self._counters.get(record.name, 0)
+        self._counters[record.name] = n + 1
+        return n % every == 0
+
+
+class _BoundedQueueHandler(logging.Handler):
+    # 与 logging.handlers.QueueHandler 等价，但队列满时不阻塞调用线程：
+    # WARNING 以下直接丢弃；WARNING 及以上挤掉队首一条旧日志后入队。
+    def __init__(self, q: "queue.Queue[logging.LogRecord]") -> None:
+        super().__init__()
+        self.queue = q
+        self.dropped = 0
+        self._reported = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 在调用线程里把参数与异常栈固化成字符串，避免跨线程持有可变对象
+        msg = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = msg
+        record.msg = msg
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+    def _put(self, record: logging.LogRecord) -> bool:
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            pass
+        if record.levelno >= logging.WARNING:
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+                self.queue.put_nowait(record)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+        self.dropped += 1
+        return False
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self.dropped != self._reported and not self.queue.full():
+                lost = self.dropped - self._reported
+                self._reported = self.dropped
+                self._put(
+                    logging.makeLogRecord(
+                        {
+                            "name": __name__,
+                            "levelno": logging.WARNING,
+                            "levelname": "WARNING",
+                            "msg": f"日志队列已满，已丢弃 {lost} 条日志",
+                        }
+                    )
+                )
+            self._put(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
 def setup_logging(
     *,
     level: Optional[str] = None,
     log_file: Optional[str | Path] = None,
 ) -> None:
-    global _CONFIGURED
+    with _setup_lock:
+        _setup_logging_locked(level=level, log_file=log_file)
+
+
+def _setup_logging_locked(*, level: Optional[str], log_file: Optional[str | Path]) -> None:
+    global _CONFIGURED, _listener
     if _CONFIGURED:
         return
+    from logging.handlers import QueueListener, RotatingFileHandler
 
-    resolved_level = (level or os.getenv("LOG_LEVEL") or "INFO").upper()
-    numeric_level = getattr(logging, resolved_level, logging.INFO)
+    numeric_level = _resolve_level(level)
 
     root_logger = logging.getLogger()
+    root_logger.removeHandler(_bootstrap_handler)
     root_logger.setLevel(numeric_level)
 
-    formatter = logging.Formatter(
-        fmt="%(asctime)s %(levelname)s %(name)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
+    formatter: logging.Formatter
+    if (os.getenv("LOG_FORMAT") or "").strip().lower() == "json":
+        formatter = _JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            fmt="%(asctime)s %(levelname)s %(name)s - %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
 
     stream_handler = logging.StreamHandler(stream=sys.stderr)
     stream_handler.setLevel(numeric_level)
     stream_handler.setFormatter(formatter)
-    root_logger.addHandler(stream_handler)
 
     resolved_log_file = (
         Path(log_file)
@@ -54,12 +206,44 @@ def setup_logging(
     )
     file_handler.setLevel(numeric_level)
     file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
+
+    # 业务线程只负责入队，格式化后的落盘/输出由后台监听线程完成
+    try:
+        queue_size = int(os.getenv("LOG_QUEUE_SIZE") or DEFAULT_QUEUE_SIZE)
+    except ValueError:
+        queue_size = DEFAULT_QUEUE_SIZE
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=max(1, queue_size))
+    queue_handler = _BoundedQueueHandler(log_queue)
+    queue_handler.setLevel(numeric_level)
+    queue_handler.addFilter(_SamplingFilter(_parse_sample_rates(os.getenv("LOG_SAMPLE") or "")))
+    root_logger.addHandler(queue_handler)
+
+    _listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
 
     _CONFIGURED = True
 
 
+def shutdown_logging() -> None:
+    # 刷出队列中剩余的日志；进程退出时由 atexit 调用
+    global _listener
+    listener = _listener
+    _listener = None
+    if listener is not None:
+        listener.stop()
+
+
+def _bootstrap() -> None:
+    global _BOOTSTRAPPED
+    if _BOOTSTRAPPED or _CONFIGURED:
+        return
+    root_logger = logging.getLogger()
+    root_logger.setLevel(_resolve_level())
+    root_logger.addHandler(_bootstrap_handler)
+    _BOOTSTRAPPED = True
+
+
 def get_logger(name: Optional[str] = None) -> logging.Logger:
-    setup_logging()
+    _bootstrap()
     return logging.getLogger(name if name else "novelAI")
-
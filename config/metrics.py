@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+# 进程内指标：HDR 风格的对数-线性直方图 + 计数器 + 仪表，按 Prometheus 文本格式导出。
+# 记录一次观测只需一次加锁和一次字典自增，开销在微秒级以内。
+
+_SUB_BUCKET_BITS = 5  # 保留 5 位有效二进制位：每个 2 的幂区间 16 档，相对误差约 6%
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_UNITS_PER_SECOND = 1_000_000  # 秒级数值按微秒分桶
+
+DEFAULT_LATENCY_BOUNDS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _bucket_index(units: int) -> int:
+    if units < _SUB_BUCKETS:
+        return units
+    exponent = units.bit_length() - _SUB_BUCKET_BITS
+    mantissa = units >> exponent
+    return (exponent << _SUB_BUCKET_BITS) + mantissa
+
+
+def _bucket_upper(index: int) -> int:
+    if index < _SUB_BUCKETS:
+        return index
+    exponent = index >> _SUB_BUCKET_BITS
+    mantissa = index & (_SUB_BUCKETS - 1)
+    return ((mantissa + 1) << exponent) - 1
+
+
+class Histogram:
+    def __init__(self, *, scale: int = _UNITS_PER_SECOND) -> None:
+        self.scale = scale
+        self._lock = threading.Lock()
+        self._counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        if value < 0 or math.isnan(value):
+            return
+        index = _bucket_index(int(value * self.scale))
+        with self._lock:
+            self._counts[index] = self._counts.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def snapshot(self) -> tuple[list[tuple[float, int]], int, float, float]:
+        with self._lock:
+            items = sorted(self._counts.items())
+            count, total, vmax = self.count, self.total, self.max
+        return [(_bucket_upper(i) / self.scale, c) for i, c in items], count, total, vmax
+
+    def quantile(self, q: float) -> float:
+        buckets, count, _, vmax = self.snapshot()
+        return _quantile(buckets, count, vmax, q)
+
+
+def _quantile(buckets: list[tuple[float, int]], count: int, vmax: float, q: float) -> float:
+    if count <= 0:
+        return 0.0
+    rank = max(1, math.ceil(q * count))
+    seen = 0
+    for upper, c in buckets:
+        seen += c
+        if seen >= rank:
+            return min(upper, vmax)
+    return vmax
+
+
+class _Family:
+    def __init__(self, name: str, kind: str, help_text: str, **options: Any) -> None:
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.options = options
+        self.lock = threading.Lock()
+        self.children: dict[LabelKey, Any] = {}
+
+
+_registry_lock = threading.Lock()
+_families: dict[str, _Family] = {}
+_collectors: list[Callable[[], Iterable[tuple[str, str, LabelKey, float]]]] = []
+
+
+def _family(name: str, kind: str, help_text: str, **options: Any) -> _Family:
+    fam = _families.get(name)
+    if fam is None:
+        with _registry_lock:
+            fam = _families.get(name)
+            if fam is None:
+                fam = _Family(name, kind, help_text, **options)
+                _families[name] = fam
+    if fam.kind != kind:
+        raise ValueError(f"指标 {name} 已注册为 {fam.kind}，不能再作为 {kind} 使用")
+    return fam
+
+
+def _label_key(labels: dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def histogram(
+    name: str,
+    help_text: str = "",
+    *,
+    bounds: tuple[float, ...] = DEFAULT_LATENCY_BOUNDS,
+    scale: int = _UNITS_PER_SECOND,
+    **labels: Any,
+) -> Histogram:
+    fam = _family(name, "histogram", help_text, bounds=bounds, scale=scale)
+    key = _label_key(labels)
+    child = fam.children.get(key)
+    if child is None:
+        with fam.lock:
+            child = fam.children.setdefault(key, Histogram(scale=fam.options["scale"]))
+    return child
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    histogram(name, **labels).observe(value)
+
+
+def inc(name: str, value: float = 1.0, *, help_text: str = "", **labels: Any) -> None:
+    fam = _family(name, "counter", help_text)
+    key = _label_key(labels)
+    with fam.lock:
+        fam.children[key] = fam.children.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, *, help_text: str = "", **labels: Any) -> None:
+    fam = _family(name, "gauge", help_text)
+    with fam.lock:
+        fam.children[_label_key(labels)] = float(value)
+
+
+def add_gauge(name: str, delta: float, *, help_text: str = "", **labels: Any) -> None:
+    fam = _family(name, "gauge", help_text)
+    key = _label_key(labels)
+    with fam.lock:
+        fam.children[key] = fam.children.get(key, 0.0) + delta
+
+
+def register_collector(
+    collector: Callable[[], Iterable[tuple[str, str, LabelKey, float]]],
+) -> None:
+    # collector 在抓取时被调用，产出 (name, kind, labels, value)，适合读取线程池占用等瞬时状态
+    with _registry_lock:
+        _collectors.append(collector)
+
+
+@contextmanager
+def span(name: str, **labels: Any) -> Iterator[dict[str, Any]]:
+    # 计时一段操作；异常时 outcome=error。调用方可以往 yield 出来的字典里补充标签。
+    extra: dict[str, Any] = {}
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield extra
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe(name, elapsed, outcome=extra.pop("outcome", outcome), **labels, **extra)
+
+
+def timed(name: str, **labels: Any) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        import functools
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in items
+    )
+    return "{" + body + "}"
+
+
+def _fmt_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def render_prometheus() -> str:
+    lines: list[str] = []
+    with _registry_lock:
+        families = sorted(_families.values(), key=lambda f: f.name)
+        collectors = list(_collectors)
+
+    for fam in families:
+        with fam.lock:
+            children = list(fam.children.items())
+        if fam.help:
+            lines.append(f"# HELP {fam.name} {fam.help}")
+        lines.append(f"# TYPE {fam.name} {fam.kind}")
+        if fam.kind != "histogram":
+            for key, value in children:
+                lines.append(f"{fam.name}{_fmt_labels(key)} {_fmt_value(value)}")
+            continue
+        quantile_lines: list[str] = []
+        for key, hist in children:
+            buckets, count, total, vmax = hist.snapshot()
+            cumulative = 0
+            i = 0
+            for bound in fam.options["bounds"]:
+                while i < len(buckets) and buckets[i][0] <= bound:
+                    cumulative += buckets[i][1]
+                    i += 1
+                lines.append(
+                    f"{fam.name}_bucket{_fmt_labels(key, ('le', _fmt_value(bound)))} {cumulative}"
+                )
+            lines.append(f"{fam.name}_bucket{_fmt_labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{fam.name}_sum{_fmt_labels(key)} {_fmt_value(total)}")
+            lines.append(f"{fam.name}_count{_fmt_labels(key)} {count}")
+            for q in DEFAULT_QUANTILES:
+                value = _quantile(buckets, count, vmax, q)
+                quantile_lines.append(
+                    f"{fam.name}_quantile{_fmt_labels(key, ('quantile', str(q)))} {_fmt_value(value)}"
+                )
+        if quantile_lines:
+            lines.append(f"# TYPE {fam.name}_quantile gauge")
+            lines.extend(quantile_lines)
+
+    seen_types: set[str] = set()
+    for collector in collectors:
+        try:
+            samples = list(collector())
+        except Exception:
+            continue
+        for name, kind, key, value in samples:
+            if name not in seen_types:
+                lines.append(f"# TYPE {name} {kind}")
+                seen_types.add(name)
+            lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    with _registry_lock:
+        _families.clear()
+        _collectors.clear()
@@ -1,10 +1,10 @@
 from __future__ import annotations
 
-import os
 from dataclasses import dataclass
 from typing import Any, Optional
 
 from config.log import get_logger
+from config.metrics import span
 
 _logger = get_logger(__name__)
 
@@ -20,50 +20,19 @@ class BaiduAiSearchConfig:
     stream: bool
 
 
-def _as_bool(value: str | None, *, default: bool) -> bool:
-    if value is None:
-        return default
-    v = value.strip().lower()
-    if v in ("1", "true", "yes", "y", "on"):
-        return True
-    if v in ("0", "false", "no", "n", "off"):
-        return False
-    return default
-
-
-def _normalize_base_url(value: str) -> str:
-    v = (value or "").strip()
-    if not v:
-        return ""
-    v = v.strip("`").strip()
-    v = v.rstrip(",").strip()
-    return v
-
-
 def _resolve_config() -> BaiduAiSearchConfig:
     from config.loader import get_qianfan_config
 
+    # 环境变量覆盖已在配置快照中统一处理，这里只做字段映射
     qf = get_qianfan_config()
-
-    api_key = os.getenv("BAIDU_QIANFAN_API_KEY") or os.getenv("QIANFAN_API_KEY") or qf.api_key
-    base_url = _normalize_base_url(os.getenv("BAIDU_QIANFAN_BASE_URL") or qf.base_url)
-    model = os.getenv("BAIDU_QIANFAN_MODEL") or qf.model
-    search_source = os.getenv("BAIDU_QIANFAN_SEARCH_SOURCE") or qf.search_source
-    enable_corner_markers = _as_bool(
-        os.getenv("BAIDU_QIANFAN_ENABLE_CORNER_MARKERS"), default=qf.enable_corner_markers
-    )
-    enable_deep_search = _as_bool(
-        os.getenv("BAIDU_QIANFAN_ENABLE_DEEP_SEARCH"), default=qf.enable_deep_search
-    )
-    stream = _as_bool(os.getenv("BAIDU_QIANFAN_STREAM"), default=qf.stream)
     return BaiduAiSearchConfig(
-        api_key=api_key or "",
-        base_url=base_url or "https://qianfan.baidubce.com",
-        model=model or "ernie-3.5-8k",
-        search_source=search_source or "baidu_search_v2",
-        enable_corner_markers=enable_corner_markers,
-        enable_deep_search=enable_deep_search,
-        stream=stream,
+        api_key=qf.api_key or "",
+        base_url=qf.base_url or "https://qianfan.baidubce.com",
+        model=qf.model or "ernie-3.5-8k",
+        search_source=qf.search_source or "baidu_search_v2",
+        enable_corner_markers=qf.enable_corner_markers,
+        enable_deep_search=qf.enable_deep_search,
+        stream=qf.stream,
     )
 
 
@@ -85,6 +54,31 @@ class BaiduAiSearchClient:
         enable_corner_markers: Optional[bool] = None,
         search_source: Optional[str] = None,
         timeout_s: float = 180,
+    ) -> Optional[str]:
+        with span("llm_request_seconds", provider="qianfan", op="ai_search") as sp:
+            reply = self._chat_completions(
+                messages=messages,
+                instruction=instruction,
+                model=model,
+                enable_deep_search=enable_deep_search,
+                enable_corner_markers=enable_corner_markers,
+                search_source=search_source,
+                timeout_s=timeout_s,
+            )
+            if reply is None:
+                sp["outcome"] = "error"
+            return reply
+
+    def _chat_completions(
+        self,
+        *,
+        messages: list[dict[str, Any]],
+        instruction: str = "",
+        model: Optional[str] = None,
+        enable_deep_search: Optional[bool] = None,
+        enable_corner_markers: Optional[bool] = None,
+        search_source: Optional[str] = None,
+        timeout_s: float = 180,
     ) -> Optional[str]:
         resolved_model = (model or self.cfg.model).strip()
         resolved_search_source = (search_source or self.cfg.search_source).strip()
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+
+from config.loader import (
+    BaseConfig,
+    BatchConfig,
+    ProviderConfig,
+    get_batch_config,
+    get_generation_profile,
+    get_providers_config,
+)
+from config.log import get_logger
+from config.metrics import inc, observe
+from llm.qwen_client import QwenClient
+
+_logger = get_logger(__name__)
+
+# OpenAI 兼容的 Batch 接口（DashScope compatible-mode 同样支持）：请求按行写成 JSONL 上传，
+# 服务端在 completion_window 内跑完，按 custom_id 取回结果。
+# 不占交互请求的并发和限流配额，单价通常是实时调用的一半，适合不赶时间的批量活。
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+FINAL_STATES = frozenset(("completed", "failed", "expired", "cancelled"))
+LENGTH_CUT = "length"
+
+
+@dataclass(frozen=True)
+class BatchRequest:
+    custom_id: str
+    messages: list[dict[str, Any]]
+    profile: str = "default"
+
+
+@dataclass(frozen=True)
+class BatchStatus:
+    id: str
+    status: str
+    total: int
+    completed: int
+    failed: int
+    output_file_id: str
+    error_file_id: str
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINAL_STATES
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    custom_id: str
+    text: str
+    error: str  # 空表示成功；LENGTH_CUT 表示输出被 max_tokens 截断
+
+
+def _resolve_provider(name: str) -> ProviderConfig:
+    providers = get_providers_config()
+    if not name:
+        return providers[0]
+    for p in providers:
+        if p.name == name:
+            return p
+    raise ValueError(f"Batch 配置的后端不存在：{name}")
+
+
+class BatchClient:
+    def __init__(
+        self, provider: Optional[ProviderConfig] = None, cfg: Optional[BatchConfig] = None
+    ) -> None:
+        self.cfg = cfg or get_batch_config()
+        self.provider = provider or _resolve_provider(self.cfg.provider)
+        self.llm = QwenClient(
+            BaseConfig(
+                api_key=self.provider.api_key,
+                base_url=self.provider.base_url,
+                model=self.provider.model,
+            ),
+            provider=self.provider.name,
+            cache_hints=self.provider.cache_hints,
+            fast_model=self.provider.fast_model,
+        )
+
+    def encode(self, requests: Iterable[BatchRequest]) -> bytes:
+        lines: list[str] = []
+        seen: set[str] = set()
+        for req in requests:
+            if req.custom_id in seen:
+                raise ValueError(f"custom_id 重复：{req.custom_id}")
+            seen.add(req.custom_id)
+            body = self.llm.request_body(req.messages, profile=get_generation_profile(req.profile))
+            line = {"custom_id": req.custom_id, "method": "POST", "url": BATCH_ENDPOINT}
+            lines.append(json.dumps({**line, "body": body}, ensure_ascii=False))
+        if len(lines) > self.cfg.max_requests:
+            raise ValueError(
+                f"单个 Batch 最多 {self.cfg.max_requests} 条请求，实际 {len(lines)} 条"
+            )
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def submit(
+        self, requests: list[BatchRequest], *, metadata: Optional[dict[str, str]] = None
+    ) -> str:
+        data = self.encode(requests)
+        upload = self.llm.client.files.create(
+            file=("batch.jsonl", data, "application/jsonl"), purpose="batch"
+        )
+        batch = self.llm.client.batches.create(
+            input_file_id=upload.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.cfg.completion_window,  # type: ignore[arg-type]
+            metadata=metadata,
+        )
+        inc("llm_batch_requests_total", len(requests), provider=self.provider.name)
+        _logger.info(
+            "Batch 已提交 (provider=%s, batch_id=%s, requests=%s, bytes=%s)",
+            self.provider.name,
+            batch.id,
+            len(requests),
+            len(data),
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> BatchStatus:
+        batch = self.llm.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return BatchStatus(
+            id=batch.id,
+            status=str(batch.status),
+            total=int(getattr(counts, "total", 0) or 0),
+            completed=int(getattr(counts, "completed", 0) or 0),
+            failed=int(getattr(counts, "failed", 0) or 0),
+            output_file_id=batch.output_file_id or "",
+            error_file_id=batch.error_file_id or "",
+        )
+
+    def cancel(self, batch_id: str) -> None:
+        self.llm.client.batches.cancel(batch_id)
+
+    def check(self, batch_id: str, *, started: float) -> BatchStatus:
+        # 查一次状态，不等待；started 是开始等待的 time.monotonic()，结束时据此记耗时
+        st = self.status(batch_id)
+        if st.done:
+            observe(
+                "llm_batch_seconds",
+                time.monotonic() - started,
+                provider=self.provider.name,
+                status=st.status,
+            )
+        return st
+
+    def wait(
+        self, batch_id: str, *, on_progress: Optional[Callable[[BatchStatus], None]] = None
+    ) -> BatchStatus:
+        started = time.monotonic()
+        while True:
+            st = self.check(batch_id, started=started)
+            if on_progress is not None:
+                on_progress(st)
+            if st.done:
+                return st
+            time.sleep(self.cfg.poll_interval_s)
+
+    def results(self, st: BatchStatus) -> dict[str, BatchResult]:
+        results: dict[str, BatchResult] = {}
+        for file_id in (st.output_file_id, st.error_file_id):
+            if not file_id:
+                continue
+            content = self.llm.client.files.content(file_id).text
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    result = self._parse_line(json.loads(line))
+                except Exception:
+                    _logger.warning("Batch 结果行无法解析 (batch_id=%s): %s", st.id, line[:500])
+                    continue
+                if result is not None:
+                    results[result.custom_id] = result
+        failed = sum(1 for r in results.values() if r.error)
+        name = self.provider.name
+        inc("llm_batch_results_total", len(results) - failed, provider=name, outcome="ok")
+        inc("llm_batch_results_total", failed, provider=name, outcome="error")
+        return results
+
+    def _parse_line(self, item: dict[str, Any]) -> Optional[BatchResult]:
+        custom_id = str(item.get("custom_id") or "")
+        if not custom_id:
+            return None
+        error = item.get("error")
+        response = item.get("response") or {}
+        body = response.get("body") or {}
+        if error or int(response.get("status_code") or 0) != 200:
+            detail = error or body.get("error")
+            message = detail.get("message") if isinstance(detail, dict) else detail
+            return BatchResult(custom_id, "", str(message or "请求失败"))
+        _record_tokens(body.get("usage"), provider=self.provider.name)
+        try:
+            content = body["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            content = None
+        if not isinstance(content, str) or not content.strip():
+            return BatchResult(custom_id, "", "模型返回空内容")
+        if body["choices"][0].get("finish_reason") == "length":
+            # 被 max_tokens 截断的半截内容一律按失败处理，不能写回去覆盖用户的全文
+            inc("llm_max_tokens_hit_total", provider=self.provider.name, profile="batch")
+            return BatchResult(custom_id, "", LENGTH_CUT)
+        return BatchResult(custom_id, content, "")
+
+
+def _record_tokens(usage: Any, *, provider: str) -> None:
+    if not isinstance(usage, dict):
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind)
+        if isinstance(value, int) and value > 0:
+            inc("llm_tokens_total", value, provider=provider, op="batch", kind=kind)
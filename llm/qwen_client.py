@@ -1,83 +1,360 @@
 from __future__ import annotations
 
 import json
-import os
 import re
-from typing import Any, Iterable, Optional
+import time
+from threading import Lock
+from typing import Any, Iterable, Iterator, Optional
 
-from config.loader import BaseConfig, get_base_config
+from config.loader import (
+    BaseConfig,
+    GenerationProfile,
+    default_fast_model,
+    get_base_config,
+    get_generation_profile,
+    subscribe,
+)
 from config.log import get_logger
+from config.metrics import histogram, inc, observe, span
 
 _logger = get_logger(__name__)
 
+_TOKEN_RATE_BOUNDS = (1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 50.0, 75.0, 100.0, 150.0, 200.0, 500.0)
 
-def _resolve_config() -> BaseConfig:
-    cfg = get_base_config()
-    api_key = os.getenv("AI_API_KEY") or os.getenv("DASHSCOPE_API_KEY") or cfg.api_key
-    base_url = os.getenv("AI_BASE_URL") or os.getenv("DASHSCOPE_BASE_URL") or cfg.base_url
-    model = os.getenv("AI_MODEL") or os.getenv("DASHSCOPE_MODEL") or cfg.model
-    return BaseConfig(api_key=api_key, base_url=base_url, model=model)
+_shared_lock = Lock()
+_shared_client: Optional["QwenClient"] = None
+_shared_subscribed = False
+
+
+class OutputTruncated(ValueError):
+    # 输出达到 max_tokens 被截断。complete() 抛出它，由调用方决定半截内容能不能用：
+    # chat / chat_messages 这类宽松接口照旧返回 text，改写用户原文的场景应当放弃结果
+    def __init__(self, text: str, *, provider: str, profile: str) -> None:
+        super().__init__(f"模型输出达到 max_tokens 被截断 (provider={provider}, profile={profile})")
+        self.text = text
+        self.provider = provider
+        self.profile = profile
 
 
 class QwenClient:
-    def __init__(self) -> None:
-        cfg = _resolve_config()
+    def __init__(
+        self,
+        cfg: Optional[BaseConfig] = None,
+        *,
+        provider: str = "dashscope",
+        max_retries: int = 2,
+        cache_hints: Optional[bool] = None,
+        fast_model: Optional[str] = None,
+    ) -> None:
+        # 环境变量覆盖已在配置快照中统一处理
+        self.cfg = cfg or get_base_config()
+        cfg = self.cfg
+        self.provider = provider
         self.model = cfg.model
         self.base_url = cfg.base_url
+        # 显式上下文缓存标记（cache_control）目前只有 DashScope 认，其余后端发送前剥掉
+        self.cache_hints = supports_cache_hints(cfg.base_url) if cache_hints is None else cache_hints
+        # 生成配置里 model 写 fast 时用的便宜模型，空则沿用主模型
+        self.fast_model = default_fast_model(cfg.base_url) if fast_model is None else fast_model
 
         try:
             from openai import OpenAI
         except Exception as exc:
             raise RuntimeError("缺少依赖：openai。请先安装：pip install openai") from exc
 
-        self.client = OpenAI(api_key=cfg.api_key, base_url=cfg.base_url)
+        self.client = OpenAI(api_key=cfg.api_key, base_url=cfg.base_url, max_retries=max_retries)
 
-    def chat(self, prompt: str) -> Optional[str]:
+    def chat(self, prompt: str, *, profile: Optional[str] = None) -> Optional[str]:
         try:
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "user", "content": [{"type": "text", "text": prompt}]}
-                ],
+            return self.complete(
+                prompt_messages(prompt), op="chat", profile=get_generation_profile(profile)
             )
-            return completion.choices[0].message.content
+        except OutputTruncated as exc:
+            return exc.text
         except Exception:
             _logger.exception("调用Qwen模型失败 (base_url=%s, model=%s)", self.base_url, self.model)
             return None
 
-    def chat_messages(self, messages: list[dict[str, Any]]) -> Optional[str]:
+    def chat_messages(
+        self, messages: list[dict[str, Any]], *, profile: Optional[str] = None
+    ) -> Optional[str]:
         try:
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
+            return self.complete(
+                messages, op="chat_messages", profile=get_generation_profile(profile)
             )
-            return completion.choices[0].message.content
+        except OutputTruncated as exc:
+            return exc.text
         except Exception:
             _logger.exception(
                 "调用Qwen模型失败 (base_url=%s, model=%s)", self.base_url, self.model
             )
             return None
 
-    def chat_messages_stream(self, messages: list[dict[str, Any]]) -> Iterable[str]:
+    def chat_messages_stream(
+        self,
+        messages: list[dict[str, Any]],
+        *,
+        stats: Optional[dict[str, Any]] = None,
+        profile: Optional[str] = None,
+    ) -> Iterable[str]:
+        prof = get_generation_profile(profile)
+        emitted = False
+        try:
+            if prof.stream:
+                for part in self.stream(messages, stats=stats, profile=prof):
+                    emitted = True
+                    yield part
+                return
+            # 该场景配置为不走流式：整段拿到后一次交给调用方
+            try:
+                text = self.complete(messages, op="chat_messages_stream", profile=prof)
+            except OutputTruncated as exc:
+                text = exc.text
+                if stats is not None:
+                    stats["finish_reason"] = "length"
+            yield text
+        except Exception as exc:
+            _logger.exception(
+                "调用Qwen模型失败 (stream, base_url=%s, model=%s)", self.base_url, self.model
+            )
+            # 与路由器一致：已输出过内容记为截断，否则记为失败
+            if stats is not None:
+                if emitted:
+                    stats["truncated"] = True
+                else:
+                    stats["error"] = str(exc) or type(exc).__name__
+
+    def model_for(self, profile: GenerationProfile) -> str:
+        if profile.model == "fast":
+            return self.fast_model or self.model
+        return profile.model or self.model
+
+    def _options(self, profile: Optional[GenerationProfile]) -> dict[str, Any]:
+        prof = profile or get_generation_profile()
+        options: dict[str, Any] = {"model": self.model_for(prof), "timeout": prof.timeout_s}
+        if prof.max_tokens is not None:
+            options["max_tokens"] = prof.max_tokens
+        if prof.temperature is not None:
+            options["temperature"] = prof.temperature
+        if prof.stop:
+            options["stop"] = list(prof.stop)
+        return options
+
+    def request_body(
+        self, messages: list[dict[str, Any]], *, profile: Optional[GenerationProfile] = None
+    ) -> dict[str, Any]:
+        # 与 complete 发出的请求体一致（不含超时），供 Batch 文件逐行写入
+        options = self._options(profile)
+        options.pop("timeout", None)
+        return {**options, "messages": self._prepare(messages)}
+
+    def complete(
+        self,
+        messages: list[dict[str, Any]],
+        *,
+        op: str = "chat_messages",
+        profile: Optional[GenerationProfile] = None,
+    ) -> str:
+        # 失败或空回复直接抛异常，由调用方（如路由器）决定是否换后端；
+        # 被 max_tokens 截断时抛 OutputTruncated（带上半截内容）
+        options = self._options(profile)
+        with span("llm_request_seconds", provider=self.provider, op=op):
+            completion = self.client.chat.completions.create(
+                messages=self._prepare(messages), **options
+            )
+            _record_usage(getattr(completion, "usage", None), op=op, provider=self.provider)
+            choice = completion.choices[0]
+            content = choice.message.content
+            if not isinstance(content, str) or not content.strip():
+                raise ValueError(
+                    f"模型返回空内容 (provider={self.provider}, model={options['model']})"
+                )
+            if getattr(choice, "finish_reason", None) == "length":
+                _record_length_cut(options, provider=self.provider, profile=profile)
+                raise OutputTruncated(
+                    content,
+                    provider=self.provider,
+                    profile=profile.name if profile is not None else "default",
+                )
+            return content
+
+    def _prepare(self, messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        return messages if self.cache_hints else strip_cache_hints(messages)
+
+    def stream(
+        self,
+        messages: list[dict[str, Any]],
+        *,
+        stats: Optional[dict[str, Any]] = None,
+        profile: Optional[GenerationProfile] = None,
+    ) -> Iterator[str]:
+        # stats 非空时在结束后填入本次调用的 token 用量、首 token 耗时和 finish_reason，
+        # 供上层回报给前端或判断输出是否完整
+        started = time.perf_counter()
+        first_at: Optional[float] = None
+        chunks = 0
+        usage: Any = None
+        outcome = "error"
+        stream: Any = None
+        finish_reason: Optional[str] = None
+        options = self._options(profile)
         try:
             stream = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
+                messages=self._prepare(messages),
                 stream=True,
+                stream_options={"include_usage": True},
+                **options,
             )
             for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
                 try:
-                    delta = chunk.choices[0].delta
+                    choice = chunk.choices[0]
+                    delta = choice.delta
                     content = getattr(delta, "content", None)
-                    if isinstance(content, str) and content:
-                        yield content
+                    finish_reason = getattr(choice, "finish_reason", None) or finish_reason
                 except Exception:
                     continue
-        except Exception:
-            _logger.exception(
-                "调用Qwen模型失败 (stream, base_url=%s, model=%s)", self.base_url, self.model
+                if isinstance(content, str) and content:
+                    if first_at is None:
+                        first_at = time.perf_counter()
+                        observe(
+                            "llm_ttft_seconds", first_at - started, provider=self.provider
+                        )
+                    chunks += 1
+                    yield content
+            outcome = "ok"
+            if finish_reason == "length":
+                _record_length_cut(options, provider=self.provider, profile=profile)
+        except GeneratorExit:
+            outcome = "cancelled"
+            raise
+        finally:
+            if stream is not None and outcome != "ok":
+                # 被取消或出错时主动关掉上游 HTTP 流，服务端随即停止生成，连接不再占着
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            ended = time.perf_counter()
+            observe(
+                "llm_request_seconds",
+                ended - started,
+                provider=self.provider,
+                op="chat_messages_stream",
+                outcome=outcome,
             )
-            return
+            _record_usage(usage, op="chat_messages_stream", provider=self.provider)
+            if stats is not None:
+                stats.update(usage_dict(usage), provider=self.provider, model=options["model"])
+                if first_at is not None:
+                    stats["ttft_s"] = round(first_at - started, 3)
+                if finish_reason:
+                    stats["finish_reason"] = finish_reason
+            if first_at is not None and ended > first_at:
+                # 没有 usage 时用增量块数近似 token 数
+                completion_tokens = getattr(usage, "completion_tokens", None) or chunks
+                histogram(
+                    "llm_output_tokens_per_second", bounds=_TOKEN_RATE_BOUNDS, scale=1000,
+                    provider=self.provider,
+                ).observe(completion_tokens / (ended - first_at))
+
+
+def prompt_messages(prompt: str) -> list[dict[str, Any]]:
+    return [{"role": "user", "content": [{"type": "text", "text": prompt}]}]
+
+
+def supports_cache_hints(base_url: str) -> bool:
+    return "dashscope" in (base_url or "")
+
+
+def cache_hint(text: str) -> dict[str, Any]:
+    # 标在稳定前缀的末尾：之前的内容命中缓存时按缓存价计费，首 token 也更快
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
+
+def strip_cache_hints(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    result: list[dict[str, Any]] = []
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, list) and any("cache_control" in part for part in content):
+            parts = [{k: v for k, v in part.items() if k != "cache_control"} for part in content]
+            if all(p.get("type") == "text" for p in parts):
+                msg = {**msg, "content": "".join(str(p.get("text") or "") for p in parts)}
+            else:
+                msg = {**msg, "content": parts}
+        result.append(msg)
+    return result
+
+
+def usage_dict(usage: Any) -> dict[str, int]:
+    result: dict[str, int] = {}
+    if usage is None:
+        return result
+    for kind in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        value = getattr(usage, kind, None)
+        if isinstance(value, int):
+            result[kind] = value
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None)
+    if cached is None and isinstance(details, dict):
+        cached = details.get("cached_tokens")
+    if isinstance(cached, int):
+        result["cached_tokens"] = cached
+    return result
+
+
+def _record_usage(usage: Any, *, op: str, provider: str = "dashscope") -> None:
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if isinstance(value, int) and value > 0:
+            inc("llm_tokens_total", value, provider=provider, op=op, kind=kind)
+    # 命中前缀缓存的输入 token（DashScope 隐式/显式缓存都会回报）
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None)
+    if cached is None and isinstance(details, dict):
+        cached = details.get("cached_tokens")
+    if isinstance(cached, int) and cached > 0:
+        inc("llm_tokens_total", cached, provider=provider, op=op, kind="cached_prompt_tokens")
+
+
+def _record_length_cut(
+    options: dict[str, Any], *, provider: str, profile: Optional[GenerationProfile]
+) -> None:
+    # 输出被 max_tokens 截断：调用方拿到的是半截内容，持续出现说明该场景的上限配小了
+    name = profile.name if profile is not None else "default"
+    inc("llm_max_tokens_hit_total", provider=provider, profile=name)
+    _logger.warning(
+        "模型输出达到 max_tokens 被截断 (provider=%s, profile=%s, max_tokens=%s)",
+        provider,
+        name,
+        options.get("max_tokens"),
+    )
+
+
+def _drop_shared_client(new: Any, old: Any) -> None:
+    global _shared_client
+    if old is not None and new.base == old.base:
+        return
+    with _shared_lock:
+        _shared_client = None
+    _logger.info("模型配置已变更，共享 QwenClient 将在下次使用时重建")
+
+
+def get_shared_client() -> QwenClient:
+    # 进程内复用同一个 OpenAI 客户端（连接池），配置变更时自动重建
+    global _shared_client, _shared_subscribed
+    # 先取配置（可能触发热加载并回调 _drop_shared_client），再加锁，避免回调里重入同一把锁
+    cfg = get_base_config()
+    with _shared_lock:
+        if not _shared_subscribed:
+            subscribe(_drop_shared_client)
+            _shared_subscribed = True
+        if _shared_client is None or _shared_client.cfg != cfg:
+            _shared_client = QwenClient(cfg)
+        return _shared_client
 
 
 def extract_json_from_text(text: Optional[str]) -> Optional[dict[str, Any]]:
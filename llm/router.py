@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Any, Iterable, Optional
+
+from config.loader import (
+    BaseConfig,
+    GenerationProfile,
+    ProviderConfig,
+    RouterConfig,
+    get_config_snapshot,
+    get_generation_profile,
+    subscribe,
+)
+from config.log import get_logger
+from config.metrics import Histogram, inc, register_collector
+from llm.qwen_client import OutputTruncated, QwenClient, prompt_messages
+
+_logger = get_logger(__name__)
+
+# 多个 OpenAI 兼容后端（DashScope 的不同 Qwen 模型、千帆 ERNIE 的 /v2 兼容接口……）组成一个池：
+# 按 EWMA 延迟 × 错误率 给后端打分，每次请求先走分数最低的健康后端，失败自动换下一个；
+# 连续失败的后端熔断一段时间。可选对冲：主请求超过该后端 p95 还没回来，就并行发给第二个后端，谁先回用谁。
+
+_EWMA_ALPHA = 0.3
+_ERROR_DECAY = 0.9
+_MIN_HEDGE_SAMPLES = 20
+
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+_shared_lock = Lock()
+_shared_router: Optional["ProviderRouter"] = None
+_shared_subscribed = False
+
+
+class _Backend:
+    def __init__(self, cfg: ProviderConfig, *, max_retries: int) -> None:
+        self.cfg = cfg
+        self.name = cfg.name
+        self.client = QwenClient(
+            BaseConfig(api_key=cfg.api_key, base_url=cfg.base_url, model=cfg.model),
+            provider=cfg.name,
+            max_retries=max_retries,
+            cache_hints=cfg.cache_hints,
+            fast_model=cfg.fast_model,
+        )
+        self._lock = Lock()
+        # complete 记整次耗时，stream 记首 token 耗时，两者分开打分
+        self.ewma_s: dict[str, Optional[float]] = {"complete": None, "stream": None}
+        self.latency = {"complete": Histogram(), "stream": Histogram()}
+        self.error_rate = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def score(self, kind: str) -> float:
+        # 没有本类样本时借用另一类的延迟；完全没有成功样本：没出过错的优先拿来探测，出过错的排后面
+        other = "stream" if kind == "complete" else "complete"
+        latency = self.ewma_s[kind]
+        if latency is None:
+            latency = self.ewma_s[other]
+        if latency is None:
+            latency = 0.0 if self.error_rate == 0 else 60.0
+        return latency * (1.0 + 4.0 * self.error_rate)
+
+    def record_ok(self, kind: str, elapsed: float) -> None:
+        with self._lock:
+            prev = self.ewma_s[kind]
+            self.ewma_s[kind] = elapsed if prev is None else prev + _EWMA_ALPHA * (elapsed - prev)
+            self.error_rate *= _ERROR_DECAY
+            self.failures = 0
+            self.open_until = 0.0
+        self.latency[kind].observe(elapsed)
+
+    def record_error(self, cfg: RouterConfig) -> None:
+        with self._lock:
+            self.error_rate = self.error_rate * _ERROR_DECAY + (1.0 - _ERROR_DECAY)
+            self.failures += 1
+            if self.failures >= cfg.failure_threshold:
+                # 熔断时间随连续失败次数翻倍，最多 8 倍
+                factor = min(8, 2 ** (self.failures - cfg.failure_threshold))
+                self.open_until = time.monotonic() + cfg.cooldown_s * factor
+        if self.failures == cfg.failure_threshold:
+            _logger.warning("模型后端连续失败，暂时熔断 (provider=%s)", self.name)
+
+    def hedge_delay(self, cfg: RouterConfig) -> Optional[float]:
+        hist = self.latency["complete"]
+        if hist.count < _MIN_HEDGE_SAMPLES:
+            return None
+        return max(cfg.hedge_min_delay_s, hist.quantile(cfg.hedge_quantile))
+
+
+class ProviderRouter:
+    def __init__(self, providers: tuple[ProviderConfig, ...], cfg: RouterConfig) -> None:
+        self.providers = providers
+        self.cfg = cfg
+        # 池里有别的后端可换时 SDK 不再自己重试，失败尽快交给路由器
+        retries = 0 if len(providers) > 1 else 2
+        self.backends = [_Backend(p, max_retries=retries) for p in providers]
+        self.model = self.backends[0].client.model
+
+    def ranked(
+        self, kind: str = "complete", profile: Optional[GenerationProfile] = None
+    ) -> list[_Backend]:
+        now = time.monotonic()
+        backends = self.backends
+        if profile is not None and profile.providers:
+            # 生成配置限定了后端（比如分类调用只走有快速模型的那家）；一个都对不上时不限定
+            backends = [b for b in backends if b.name in profile.providers] or backends
+        healthy = [b for b in backends if b.healthy(now)]
+        broken = [b for b in backends if not b.healthy(now)]
+        healthy.sort(key=lambda b: b.score(kind))
+        # 全部熔断时仍按“最早恢复”的顺序尝试，总比直接失败强
+        broken.sort(key=lambda b: b.open_until)
+        return healthy + broken
+
+    def chat(self, prompt: str, *, profile: Optional[str] = None) -> Optional[str]:
+        return self._complete_or_none(
+            prompt_messages(prompt), op="chat", profile=get_generation_profile(profile)
+        )
+
+    def chat_messages(
+        self, messages: list[dict[str, Any]], *, profile: Optional[str] = None
+    ) -> Optional[str]:
+        return self._complete_or_none(
+            messages, op="chat_messages", profile=get_generation_profile(profile)
+        )
+
+    def _complete_or_none(
+        self, messages: list[dict[str, Any]], *, op: str, profile: GenerationProfile
+    ) -> Optional[str]:
+        try:
+            return self.complete(messages, op=op, profile=profile)
+        except OutputTruncated as exc:
+            # 宽松接口：被截断的半截内容照旧返回（截断已记了指标和告警）
+            return exc.text
+        except Exception:
+            _logger.exception("所有模型后端均调用失败 (providers=%s)", [b.name for b in self.backends])
+            return None
+
+    def complete(
+        self,
+        messages: list[dict[str, Any]],
+        *,
+        op: str = "chat_messages",
+        profile: Optional[GenerationProfile] = None,
+    ) -> str:
+        order = self.ranked("complete", profile)
+        if self.cfg.hedge and len(order) > 1:
+            return self._complete_hedged(order, messages, op=op, profile=profile)
+        last_exc: Optional[BaseException] = None
+        for i, backend in enumerate(order):
+            if i:
+                inc("llm_router_failover_total", provider=order[i - 1].name)
+            try:
+                return self._call(backend, messages, op, profile)
+            except OutputTruncated:
+                # 截断是生成上限的问题，不是后端故障，换后端也一样
+                raise
+            except Exception as exc:
+                last_exc = exc
+                _logger.warning("模型后端调用失败，尝试下一个 (provider=%s): %s", backend.name, exc)
+        assert last_exc is not None
+        raise last_exc
+
+    def _call(
+        self,
+        backend: _Backend,
+        messages: list[dict[str, Any]],
+        op: str,
+        profile: Optional[GenerationProfile],
+    ) -> str:
+        started = time.perf_counter()
+        try:
+            text = backend.client.complete(messages, op=op, profile=profile)
+        except OutputTruncated:
+            backend.record_ok("complete", time.perf_counter() - started)
+            raise
+        except Exception:
+            backend.record_error(self.cfg)
+            raise
+        backend.record_ok("complete", time.perf_counter() - started)
+        inc("llm_router_requests_total", provider=backend.name, op=op)
+        return text
+
+    def _complete_hedged(
+        self,
+        order: list[_Backend],
+        messages: list[dict[str, Any]],
+        *,
+        op: str,
+        profile: Optional[GenerationProfile],
+    ) -> str:
+        pending: dict[Future[str], _Backend] = {}
+        last_exc: Optional[BaseException] = None
+        next_index = 0
+
+        def launch() -> None:
+            nonlocal next_index
+            backend = order[next_index]
+            next_index += 1
+            pending[_hedge_pool.submit(self._call, backend, messages, op, profile)] = backend
+
+        launch()
+        while pending:
+            timeout = None
+            if len(pending) == 1 and next_index < len(order):
+                timeout = next(iter(pending.values())).hedge_delay(self.cfg)
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # 主请求已超过它自己的 p95：再发一份给下一个后端
+                inc("llm_router_hedges_total", provider=order[next_index].name)
+                launch()
+                continue
+            for fut in done:
+                backend = pending.pop(fut)
+                try:
+                    text = fut.result()
+                except OutputTruncated:
+                    raise
+                except Exception as exc:
+                    last_exc = exc
+                    inc("llm_router_failover_total", provider=backend.name)
+                    _logger.warning("模型后端调用失败，尝试下一个 (provider=%s): %s", backend.name, exc)
+                    continue
+                if pending:
+                    # 落后的那份不取消（同步 SDK 无法中断），跑完照样计入统计
+                    inc("llm_router_hedge_wins_total", provider=backend.name)
+                return text
+            if not pending and next_index < len(order):
+                launch()
+        assert last_exc is not None
+        raise last_exc
+
+    def chat_messages_stream(
+        self,
+        messages: list[dict[str, Any]],
+        *,
+        stats: Optional[dict[str, Any]] = None,
+        profile: Optional[str] = None,
+    ) -> Iterable[str]:
+        prof = get_generation_profile(profile)
+        if not prof.stream:
+            # 该场景配置为不走流式：整段拿到后一次交给调用方（仍可换后端、对冲）
+            text: Optional[str] = None
+            try:
+                text = self.complete(messages, op="chat_messages_stream", profile=prof)
+            except OutputTruncated as exc:
+                text = exc.text
+                if stats is not None:
+                    stats["finish_reason"] = "length"
+            except Exception:
+                _logger.exception(
+                    "所有模型后端均调用失败 (providers=%s)", [b.name for b in self.backends]
+                )
+            if text:
+                yield text
+            elif stats is not None:
+                stats["error"] = "所有模型后端均调用失败"
+            return
+        # 流式只能在首个 token 之前换后端；已经输出了内容再失败就只能截断
+        order = self.ranked("stream", prof)
+        for i, backend in enumerate(order):
+            if i:
+                inc("llm_router_failover_total", provider=order[i - 1].name)
+            started = time.perf_counter()
+            emitted = False
+            try:
+                for part in backend.client.stream(messages, stats=stats, profile=prof):
+                    if not emitted:
+                        emitted = True
+                        backend.record_ok("stream", time.perf_counter() - started)
+                        inc(
+                            "llm_router_requests_total",
+                            provider=backend.name,
+                            op="chat_messages_stream",
+                        )
+                    yield part
+                if emitted:
+                    return
+                raise ValueError(f"模型返回空内容 (provider={backend.name})")
+            except Exception as exc:
+                backend.record_error(self.cfg)
+                if emitted:
+                    _logger.exception("模型流式输出中断 (provider=%s)", backend.name)
+                    if stats is not None:
+                        stats["truncated"] = True
+                    return
+                _logger.warning("模型后端流式调用失败，尝试下一个 (provider=%s): %s", backend.name, exc)
+        _logger.error("所有模型后端流式调用均失败 (providers=%s)", [b.name for b in self.backends])
+        # 不抛异常（调用方多是生成器链），失败原因放进 stats 交给上层决定怎么告诉用户
+        if stats is not None:
+            stats["error"] = "所有模型后端均调用失败"
+
+    def samples(self) -> Iterable[tuple[str, str, tuple[tuple[str, str], ...], float]]:
+        now = time.monotonic()
+        for b in self.backends:
+            key = (("provider", b.name),)
+            for kind, value in b.ewma_s.items():
+                if value is not None:
+                    yield "llm_router_ewma_seconds", "gauge", key + (("kind", kind),), value
+            yield "llm_router_error_rate", "gauge", key, b.error_rate
+            yield "llm_router_healthy", "gauge", key, 1.0 if b.healthy(now) else 0.0
+
+
+def _collect() -> Iterable[tuple[str, str, tuple[tuple[str, str], ...], float]]:
+    router = _shared_router
+    if router is None:
+        return ()
+    return list(router.samples())
+
+
+def _drop_shared_router(new: Any, old: Any) -> None:
+    global _shared_router
+    if old is not None and new.providers == old.providers and new.router == old.router:
+        return
+    with _shared_lock:
+        _shared_router = None
+    _logger.info("模型后端配置已变更，共享路由器将在下次使用时重建")
+
+
+def get_shared_router() -> ProviderRouter:
+    # 进程内复用同一组后端（各自的连接池与延迟统计），配置变更时重建
+    global _shared_router, _shared_subscribed
+    snap = get_config_snapshot()
+    with _shared_lock:
+        if not _shared_subscribed:
+            subscribe(_drop_shared_router)
+            register_collector(_collect)
+            _shared_subscribed = True
+        router = _shared_router
+        if router is None or router.providers != snap.providers or router.cfg != snap.router:
+            router = ProviderRouter(snap.providers, snap.router)
+            _shared_router = router
+        return router
@@ -1,36 +1,171 @@
 from __future__ import annotations
 
-from typing import Optional
+import time
+from typing import Any, Optional
 
+from config.loader import get_generation_profile
 from config.log import get_logger
-from llm.qwen_client import QwenClient
+from config.metrics import inc, observe
+from llm.qwen_client import OutputTruncated, QwenClient, extract_json_from_text
+from llm.router import get_shared_router
+from novel_gen.context import context_for_prompt
+from novel_gen.edits import EditError, apply_edits, diff_segments, parse_edits
+from novel_gen.prompt import build_messages, labeled
+from novel_gen.singleflight import SingleFlight, flight_key
 
 _logger = get_logger(__name__)
 
 
+# 连点、重复提交的同一优化请求只调用一次模型
+_optimize_flight = SingleFlight("optimize")
+
+_OPTIMIZE_SYSTEM = (
+    "你是网文小说编辑助手。\n"
+    "请按用户要求优化原文，保持关键信息与风格一致，表达更清晰有张力。\n"
+    "只输出优化后的文本，不要输出解释或多余内容。\n"
+)
+
+# 长文本只改几句时，让模型输出修改操作而不是整篇重写：输出 token 少一个数量级
+_EDIT_SYSTEM = (
+    "你是网文小说编辑助手。\n"
+    "请按用户要求修改原文，只改需要改的地方，其余内容保持逐字不变。\n"
+    "不要输出全文，只输出JSON修改列表：\n"
+    '{"edits":[{"op":"replace","find":"要替换的原文片段","text":"替换后的内容"}]}\n'
+    "op 可选 replace（把 find 替换为 text）、insert_before / insert_after"
+    "（在 find 之前/之后插入 text）、delete（删除 find）。\n"
+    "find 必须从原文逐字复制、在原文中只出现一次，一般取10到60字；各条修改不要重叠。\n"
+    '不需要修改时输出 {"edits":[]}。\n'
+)
+
+OPTIMIZE_MODES = ("auto", "edit", "rewrite")
+EDIT_MIN_CHARS = 600  # auto 模式下原文达到这个长度才走增量修改
+
+
+class OptimizeTruncated(RuntimeError):
+    pass
+
+
 def optimize_text(
     *,
     original: str,
     instruction: str = "",
     field: str = "",
+    novel_id: str = "",
     client: Optional[QwenClient] = None,
 ) -> str:
+    return optimize_detailed(
+        original=original,
+        instruction=instruction,
+        field=field,
+        novel_id=novel_id,
+        client=client,
+    )["text"]
+
+
+def resolve_optimize_mode(original: str, mode: str = "auto") -> str:
+    resolved = (mode or "auto").strip().lower()
+    if resolved not in OPTIMIZE_MODES:
+        raise ValueError(f"不支持的优化方式：{mode}")
+    if resolved == "auto":
+        resolved = "edit" if len(original) >= EDIT_MIN_CHARS else "rewrite"
+    return resolved
+
+
+def optimize_messages(
+    *, original: str, instruction: str, field: str, novel_id: str, mode: str
+) -> list[dict[str, Any]]:
+    context = context_for_prompt(novel_id) if novel_id else ""
+    user = labeled(("目标字段", field or "未指定"), ("原文", original), ("用户要求", instruction))
+    system = _EDIT_SYSTEM if mode == "edit" else _OPTIMIZE_SYSTEM
+    return build_messages(system=system, context=context, user=user)
+
+
+def apply_edit_reply(original: str, reply: Optional[str]) -> dict[str, Any]:
+    # 把 edit 模式的模型回复应用到原文；对不上时抛 EditError
+    text, diff = apply_edits(original, parse_edits(extract_json_from_text(reply)))
+    return {"text": text.strip() or original, "mode": "edit", "diff": diff}
+
+
+def rewrite_result(original: str, reply: Optional[str]) -> dict[str, Any]:
+    if isinstance(reply, str) and reply.strip():
+        text = reply.strip()
+    else:
+        _logger.warning("优化结果为空，返回原文")
+        text = original
+    return {"text": text, "mode": "rewrite", "diff": diff_segments(original, text)}
+
+
+def optimize_detailed(
+    *,
+    original: str,
+    instruction: str = "",
+    field: str = "",
+    novel_id: str = "",
+    mode: str = "auto",
+    client: Optional[QwenClient] = None,
+) -> dict[str, Any]:
+    # 返回 {"text", "mode", "diff"}；mode 是实际采用的方式（edit / rewrite），diff 供前端展示对比
     resolved_original = (original or "").strip()
     resolved_instruction = (instruction or "").strip()
     resolved_field = (field or "").strip()
+    resolved_mode = resolve_optimize_mode(resolved_original, mode)
+    args = (resolved_original, resolved_instruction, resolved_field, novel_id, resolved_mode)
+    if client is not None:
+        return _optimize(*args, client=client)
+    return _optimize_flight.do(flight_key("optimize", *args), _optimize, *args, client=None)
+
+
+def _optimize(
+    original: str,
+    instruction: str,
+    field: str,
+    novel_id: str,
+    mode: str,
+    *,
+    client: Optional[QwenClient],
+) -> dict[str, Any]:
+    llm = client or get_shared_router()
+    started = time.perf_counter()
+
+    def messages(mode: str) -> list[dict[str, Any]]:
+        return optimize_messages(
+            original=original, instruction=instruction, field=field, novel_id=novel_id, mode=mode
+        )
+
+    def ask(mode: str) -> Optional[str]:
+        # 走严格接口：被 max_tokens 截断时抛 OutputTruncated，半截内容不能当成优化结果
+        try:
+            return llm.complete(
+                messages(mode), op="chat_messages", profile=get_generation_profile("optimize")
+            )
+        except OutputTruncated:
+            raise
+        except Exception:
+            _logger.exception("优化调用模型失败 (mode=%s)", mode)
+            return None
+
+    if mode == "edit" and original:
+        try:
+            result = apply_edit_reply(original, ask("edit"))
+            observe("optimize_seconds", time.perf_counter() - started, mode="edit")
+            return result
+        except OutputTruncated:
+            inc("optimize_edit_fallback_total", reason="length")
+            _logger.info("增量修改列表被截断，改为全文重写")
+        except EditError as exc:
+            inc("optimize_edit_fallback_total", reason=exc.reason)
+            _logger.info("增量修改无法应用，改为全文重写：%s", exc)
 
-    prompt = (
-        "你是网文小说编辑助手。\n"
-        f"目标字段：{resolved_field if resolved_field else '未指定'}\n"
-        f"原文：\n{resolved_original if resolved_original else '无'}\n"
-        f"用户要求：\n{resolved_instruction if resolved_instruction else '无'}\n"
-        "请优化原文，保持关键信息与风格一致，表达更清晰有张力。\n"
-        "只输出优化后的文本，不要输出解释或多余内容。\n"
-    )
-
-    llm = client or QwenClient()
-    text = llm.chat(prompt)
-    if isinstance(text, str) and text.strip():
-        return text.strip()
-    _logger.warning("优化结果为空，返回原文")
-    return resolved_original
+    try:
+        reply = ask("rewrite")
+    except OutputTruncated as exc:
+        # 重写结果不完整：宁可失败保留原文，也不能把后半段悄悄丢掉
+        inc("optimize_truncated_total")
+        _logger.warning("优化结果被 max_tokens 截断，保留原文 (chars=%s)", len(original))
+        raise OptimizeTruncated(
+            "优化结果超出长度上限被截断，已保留原文；"
+            "可以缩短原文或调大 profiles.optimize.max_tokens"
+        ) from exc
+    result = rewrite_result(original, reply)
+    observe("optimize_seconds", time.perf_counter() - started, mode="rewrite")
+    return result
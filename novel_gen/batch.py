@@ -0,0 +1,515 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Optional
+
+from config.log import get_logger
+from config.metrics import inc
+from llm.batch import LENGTH_CUT, BatchClient, BatchRequest, BatchResult, BatchStatus
+from novel_gen.edits import EditError
+from storage.novels import ADVANCED_FIELDS, STORY_FIELDS
+
+if TYPE_CHECKING:
+    from novel_gen.jobs import Job
+
+_logger = get_logger(__name__)
+
+# 批量离线任务：给很多本小说逐字段优化、批量取名这类不赶时间的活，打包成一个 Batch 提交，
+# 跑完按 custom_id 写回存储。custom_id 形如 optimize:{novel_id}:{field}、naming:{序号}。
+# 提交清单（每条请求对应哪本小说的哪个字段、提交时原文的哈希）存在 OSS 的 batches/{id}.json，
+# 进程重启后用 resume 接着等结果、写回；写回前原文已被改过的字段不覆盖。
+
+BATCH_KINDS = ("optimize", "naming")
+MAX_NAMES = 500
+_MAX_ERRORS = 20
+
+
+def batch_key(record_id: str) -> str:
+    return f"batches/{record_id}.json"
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _Plan:
+    requests: list[BatchRequest] = field(default_factory=list)
+    manifest: dict[str, dict[str, str]] = field(default_factory=dict)
+
+
+def _plan_optimize(params: dict[str, Any]) -> _Plan:
+    from novel_gen import optimize_messages, resolve_optimize_mode
+    from storage.novels import load_index, read_advanced, read_story
+    from storage.oss_storage import get_shared_storage
+
+    oss = get_shared_storage()
+    novel_ids = [str(n).strip() for n in params.get("novel_ids") or [] if str(n).strip()]
+    if not novel_ids:
+        if not params.get("all"):
+            raise ValueError("缺少 novel_ids（或传 all=true 处理全部小说）")
+        novel_ids = [str(item.get("id")) for item in load_index(oss) if item.get("id")]
+    fields = tuple(params.get("fields") or STORY_FIELDS + ADVANCED_FIELDS)
+    unknown = [f for f in fields if f not in STORY_FIELDS + ADVANCED_FIELDS]
+    if unknown:
+        raise ValueError(f"不支持的字段：{','.join(unknown)}")
+    instruction = str(params.get("instruction") or "").strip()
+    instructions = params.get("instructions") or {}
+    mode = str(params.get("mode") or "auto")
+
+    plan = _Plan()
+    for novel_id in dict.fromkeys(novel_ids):
+        values = {**read_story(oss, novel_id), **read_advanced(oss, novel_id)}
+        for name in fields:
+            original = values.get(name, "").strip()
+            if not original:
+                continue
+            resolved_mode = resolve_optimize_mode(original, mode)
+            custom_id = f"optimize:{novel_id}:{name}"
+            messages = optimize_messages(
+                original=original,
+                instruction=str(instructions.get(name) or instruction),
+                field=name,
+                novel_id=novel_id,
+                mode=resolved_mode,
+            )
+            plan.requests.append(BatchRequest(custom_id, messages, profile="optimize"))
+            plan.manifest[custom_id] = {
+                "novel_id": novel_id,
+                "field": name,
+                "mode": resolved_mode,
+                "digest": _digest(original),
+            }
+    return plan
+
+
+def _plan_naming(params: dict[str, Any]) -> _Plan:
+    from novel_gen.naming import naming_messages
+
+    count = min(MAX_NAMES, max(1, int(params.get("count") or 1)))
+    messages = naming_messages(
+        gender=str(params.get("gender") or "男"),
+        style=str(params.get("style") or "仙侠"),
+        description=str(params.get("description") or ""),
+    )
+    plan = _Plan()
+    for i in range(count):
+        custom_id = f"naming:{i}"
+        plan.requests.append(BatchRequest(custom_id, messages, profile="naming"))
+        plan.manifest[custom_id] = {}
+    return plan
+
+
+def _apply_optimize(record: dict[str, Any], results: dict[str, BatchResult]) -> dict[str, Any]:
+    from novel_gen import apply_edit_reply, rewrite_result
+    from novel_gen.context import refresh_summary
+    from storage.novels import (
+        advanced_key,
+        read_advanced,
+        read_novel,
+        read_story,
+        story_key,
+    )
+    from storage.oss_storage import get_shared_storage
+    from storage.search_index import index_novel
+
+    apply = bool(record.get("params", {}).get("apply", True))
+    oss = get_shared_storage()
+    counts = {"applied": 0, "failed": 0, "conflict": 0, "missing": 0}
+    errors: list[dict[str, str]] = []
+    texts: dict[str, str] = {}
+
+    def fail(custom_id: str, outcome: str, error: str) -> None:
+        counts[outcome] += 1
+        if len(errors) < _MAX_ERRORS:
+            errors.append({"custom_id": custom_id, "error": error})
+
+    by_novel: dict[str, list[str]] = defaultdict(list)
+    for custom_id, entry in record["manifest"].items():
+        by_novel[entry["novel_id"]].append(custom_id)
+
+    for novel_id, custom_ids in by_novel.items():
+        item = read_novel(oss, novel_id)
+        if item is None:
+            for custom_id in custom_ids:
+                fail(custom_id, "missing", "小说已删除")
+            continue
+        story = read_story(oss, novel_id)
+        advanced = read_advanced(oss, novel_id)
+        changed: dict[str, str] = {}
+        for custom_id in custom_ids:
+            entry = record["manifest"][custom_id]
+            name = entry["field"]
+            result = results.get(custom_id)
+            if result is None:
+                fail(custom_id, "missing", "Batch 没有返回这条结果")
+                continue
+            if result.error == LENGTH_CUT:
+                inc("optimize_truncated_total")
+                fail(custom_id, "failed", "优化结果超出长度上限被截断，已保留原文")
+                continue
+            if result.error:
+                fail(custom_id, "failed", result.error)
+                continue
+            target = story if name in STORY_FIELDS else advanced
+            original = target.get(name, "").strip()
+            if _digest(original) != entry["digest"]:
+                # 批量跑的这段时间里用户改过这个字段，以用户为准
+                fail(custom_id, "conflict", "字段在提交后被修改过，未覆盖")
+                continue
+            try:
+                if entry["mode"] == "edit":
+                    text = apply_edit_reply(original, result.text)["text"]
+                else:
+                    text = rewrite_result(original, result.text)["text"]
+            except EditError as exc:
+                inc("optimize_edit_fallback_total", reason=exc.reason)
+                fail(custom_id, "failed", str(exc))
+                continue
+            counts["applied"] += 1
+            texts[custom_id] = text
+            if apply:
+                target[name] = text
+                changed[name] = text
+        if not changed:
+            continue
+        if any(name in STORY_FIELDS for name in changed):
+            oss.put_json(story_key(novel_id), story)
+        if any(name in ADVANCED_FIELDS for name in changed):
+            oss.put_json(advanced_key(novel_id), advanced)
+        refresh_summary(novel_id)
+        index_novel(novel_id, {"title": str(item.get("title") or ""), **changed})
+
+    summary: dict[str, Any] = {**counts, "errors": errors}
+    if not apply:
+        summary["texts"] = texts
+    return summary
+
+
+def _apply_naming(record: dict[str, Any], results: dict[str, BatchResult]) -> dict[str, Any]:
+    from novel_gen.naming import parse_name
+
+    names: list[str] = []
+    failed = 0
+    for custom_id in record["manifest"]:
+        result = results.get(custom_id)
+        name = parse_name(result.text) if result is not None and not result.error else None
+        if name is None:
+            failed += 1
+        elif name not in names:
+            names.append(name)
+    return {"names": names, "failed": failed}
+
+
+_PLANNERS = {"optimize": _plan_optimize, "naming": _plan_naming}
+_APPLIERS = {"optimize": _apply_optimize, "naming": _apply_naming}
+
+
+def _save(record: dict[str, Any]) -> None:
+    from storage.oss_storage import get_shared_storage
+
+    record["updated_at"] = _now_iso()
+    get_shared_storage().put_json(batch_key(record["id"]), record)
+
+
+def load_batch(record_id: str) -> Optional[dict[str, Any]]:
+    from storage.oss_storage import get_shared_storage
+
+    data = get_shared_storage().get_json(batch_key(record_id))
+    return data if isinstance(data, dict) else None
+
+
+def _submit(
+    params: dict[str, Any], *, job: Optional["Job"] = None
+) -> tuple[dict[str, Any], Optional[BatchClient]]:
+    # 整理请求并分块提交；没有要处理的请求时返回的 client 为 None
+    kind = str(params.get("kind") or "").strip()
+    if kind not in BATCH_KINDS:
+        raise ValueError(f"不支持的批量任务类型：{kind}")
+    if job is not None:
+        job.report(0.0, "正在整理批量请求")
+    plan = _PLANNERS[kind](params)
+    record: dict[str, Any] = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "params": params,
+        "status": "empty",
+        "batch_ids": [],
+        "manifest": plan.manifest,
+        "created_at": _now_iso(),
+    }
+    if not plan.requests:
+        return record, None
+
+    client = BatchClient()
+    record["provider"] = client.provider.name
+    record["status"] = "submitting"
+    _save(record)
+    # 每提交一个分块就落一次盘：中途失败时已提交的 Batch 仍能 resume 或取消，不会成为孤儿
+    step = client.cfg.max_requests
+    try:
+        for start in range(0, len(plan.requests), step):
+            chunk = plan.requests[start : start + step]
+            batch_id = client.submit(chunk, metadata={"record_id": record["id"], "kind": kind})
+            record["batch_ids"].append(batch_id)
+            _save(record)
+    except Exception:
+        _logger.exception(
+            "Batch 分块提交失败，已提交的部分可以 resume (record_id=%s, submitted=%s)",
+            record["id"],
+            len(record["batch_ids"]),
+        )
+        record["status"] = "partial"
+        _save(record)
+        raise
+    record["status"] = "submitted"
+    _save(record)
+    if job is not None:
+        job.report(0.0, f"已提交 {len(plan.requests)} 条请求", record_id=record["id"])
+    return record, client
+
+
+def _empty_summary(record: dict[str, Any]) -> dict[str, Any]:
+    return {"id": record["id"], "kind": record["kind"], "requests": 0}
+
+
+def run_batch(params: dict[str, Any]) -> dict[str, Any]:
+    # 命令行用：提交后在当前线程里一直等到出结果
+    record, client = _submit(params)
+    if client is None:
+        return _empty_summary(record)
+    return _collect(record, client)
+
+
+def resume_batch(record_id: str) -> dict[str, Any]:
+    record = load_batch(record_id)
+    if record is None:
+        raise ValueError(f"批量任务记录不存在：{record_id}")
+    if record.get("status") == "applied":
+        return record.get("summary") or {}
+    return _collect(record, BatchClient())
+
+
+def _collect(record: dict[str, Any], client: BatchClient) -> dict[str, Any]:
+    statuses: dict[str, str] = {}
+    results: dict[str, BatchResult] = {}
+    for batch_id in record["batch_ids"]:
+        st = client.wait(batch_id)
+        statuses[batch_id] = st.status
+        results.update(client.results(st))
+    return _apply(record, statuses, results)
+
+
+def _apply(
+    record: dict[str, Any], statuses: dict[str, str], results: dict[str, BatchResult]
+) -> dict[str, Any]:
+    summary = {
+        "id": record["id"],
+        "kind": record["kind"],
+        "requests": len(record["manifest"]),
+        "batches": statuses,
+        **_APPLIERS[record["kind"]](record, results),
+    }
+    record["status"] = "applied"
+    record["summary"] = summary
+    _save(record)
+    _logger.info(
+        "批量任务完成 (record_id=%s, kind=%s, requests=%s)",
+        record["id"],
+        record["kind"],
+        summary["requests"],
+    )
+    return summary
+
+
+# ---- 后台任务：提交后立即交出任务线程，由一个轮询线程统一等所有 Batch 的结果 ----
+# Batch 可能要跑满 completion_window（数小时），不能让它一直占着任务线程池的工作线程。
+# 轮询线程每秒看一次取消，每 poll_interval_s 查一次状态，全部跑完后写回并完成 Future。
+# 进程退出后等待随之中断，用 record_id 重新提交 batch 任务即可接着等。
+
+_WATCH_TICK_S = 1.0
+
+_watch_lock = threading.Lock()
+_watches: dict[str, "_Watch"] = {}
+_watcher: Optional[threading.Thread] = None
+
+
+@dataclass
+class _Watch:
+    record: dict[str, Any]
+    client: BatchClient
+    job: "Job"
+    future: Future[dict[str, Any]]
+    started: float = field(default_factory=time.monotonic)
+    next_poll: float = 0.0
+    progress: dict[str, BatchStatus] = field(default_factory=dict)
+    statuses: dict[str, str] = field(default_factory=dict)
+    results: dict[str, BatchResult] = field(default_factory=dict)
+
+
+def start_batch(params: dict[str, Any], *, job: "Job") -> Future[dict[str, Any]]:
+    record, client = _submit(params, job=job)
+    if client is None:
+        future: Future[dict[str, Any]] = Future()
+        future.set_result(_empty_summary(record))
+        return future
+    return _watch(record, client, job)
+
+
+def watch_batch(record_id: str, *, job: "Job") -> Future[dict[str, Any]]:
+    record = load_batch(record_id)
+    if record is None:
+        raise ValueError(f"批量任务记录不存在：{record_id}")
+    if record.get("status") == "applied":
+        future: Future[dict[str, Any]] = Future()
+        future.set_result(record.get("summary") or {})
+        return future
+    return _watch(record, BatchClient(), job)
+
+
+def _watch(record: dict[str, Any], client: BatchClient, job: "Job") -> Future[dict[str, Any]]:
+    global _watcher
+    watch = _Watch(record, client, job, Future())
+    with _watch_lock:
+        if record["id"] in _watches:
+            raise ValueError(f"批量任务已经在等待结果：{record['id']}")
+        _watches[record["id"]] = watch
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch_loop, name="novel-batch-watch", daemon=True)
+            _watcher.start()
+    return watch.future
+
+
+def _watch_loop() -> None:
+    global _watcher
+    while True:
+        with _watch_lock:
+            watches = list(_watches.values())
+            if not watches:
+                _watcher = None
+                return
+        for watch in watches:
+            try:
+                finished = _poll(watch)
+            except Exception as exc:
+                _logger.exception("Batch 轮询失败 (record_id=%s)", watch.record["id"])
+                watch.future.set_exception(exc)
+                finished = True
+            if finished:
+                with _watch_lock:
+                    _watches.pop(watch.record["id"], None)
+        tick = min([_WATCH_TICK_S] + [w.client.cfg.poll_interval_s for w in watches])
+        time.sleep(tick)
+
+
+def _poll(watch: _Watch) -> bool:
+    # 返回这条记录是否已经结束（写回完成、被取消）
+    from novel_gen.jobs import JobCancelled
+
+    record, client = watch.record, watch.client
+    if watch.job.cancelled:
+        # 任务取消时一并取消服务端还没跑完的 Batch，已完成的部分不写回
+        for batch_id in record["batch_ids"]:
+            if batch_id not in watch.statuses:
+                try:
+                    client.cancel(batch_id)
+                except Exception:
+                    _logger.exception("Batch 取消失败 (batch_id=%s)", batch_id)
+        record["status"] = "cancelled"
+        _save(record)
+        watch.future.set_exception(JobCancelled())
+        return True
+    now = time.monotonic()
+    if now < watch.next_poll:
+        return False
+    watch.next_poll = now + client.cfg.poll_interval_s
+    for batch_id in record["batch_ids"]:
+        if batch_id in watch.statuses:
+            continue
+        st = client.check(batch_id, started=watch.started)
+        watch.progress[batch_id] = st
+        if st.done:
+            watch.statuses[batch_id] = st.status
+            watch.results.update(client.results(st))
+    total = sum(st.total for st in watch.progress.values())
+    done = sum(st.completed + st.failed for st in watch.progress.values())
+    finished = len(watch.statuses)
+    watch.job.report(
+        done / total if total else 0.0,
+        f"批量处理中：{done}/{total}（{finished}/{len(record['batch_ids'])} 个 Batch 已结束）",
+    )
+    if finished < len(record["batch_ids"]):
+        return False
+    watch.future.set_result(_apply(record, watch.statuses, watch.results))
+    return True
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m novel_gen.batch", description="通过 Batch 接口离线批量优化设定、批量取名"
+    )
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_opt = sub.add_parser("optimize", help="批量优化小说设定字段并写回")
+    p_opt.add_argument(
+        "--novel", action="append", default=[], help="小说 id，可重复；不传则处理全部"
+    )
+    p_opt.add_argument("--field", action="append", default=[], help="字段名，可重复；默认全部字段")
+    p_opt.add_argument("--instruction", default="")
+    p_opt.add_argument("--mode", default="auto", choices=("auto", "edit", "rewrite"))
+    p_opt.add_argument("--dry-run", action="store_true", help="只取回结果，不写回")
+
+    p_name = sub.add_parser("naming", help="批量取名")
+    p_name.add_argument("--count", type=int, default=20)
+    p_name.add_argument("--gender", default="男")
+    p_name.add_argument("--style", default="仙侠")
+    p_name.add_argument("--description", default="")
+
+    p_resume = sub.add_parser("resume", help="接着等待已提交的批量任务并写回")
+    p_resume.add_argument("record_id")
+
+    args = parser.parse_args(argv)
+    if args.cmd == "optimize":
+        result = run_batch(
+            {
+                "kind": "optimize",
+                "novel_ids": args.novel,
+                "all": not args.novel,
+                "fields": args.field,
+                "instruction": args.instruction,
+                "mode": args.mode,
+                "apply": not args.dry_run,
+            }
+        )
+    elif args.cmd == "naming":
+        result = run_batch(
+            {
+                "kind": "naming",
+                "count": args.count,
+                "gender": args.gender,
+                "style": args.style,
+                "description": args.description,
+            }
+        )
+    else:
+        result = resume_batch(args.record_id)
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,384 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Optional
+
+from config.log import get_logger
+from config.metrics import inc, observe
+from llm.qwen_client import extract_json_from_text
+from llm.router import get_shared_router
+from novel_gen.context import context_for_prompt, load_novel_context
+from novel_gen.prompt import build_messages, labeled
+
+if TYPE_CHECKING:
+    from novel_gen.jobs import Job
+    from storage.oss_storage import OssStorage
+
+_logger = get_logger(__name__)
+
+# 章节生成：主线 → 大纲（一次调用）→ 各章并发起草。
+# 每章边生成边追加写到 OSS（不在内存里攒整章），写完一章记一次断点；
+# 进程崩了重跑同一任务会跳过已完成的章节，写了一半的章节删掉重写。
+# 所有章节共用“系统提示 + 小说设定 + 大纲”这段前缀，并发请求也能命中前缀缓存。
+
+_OUTLINE_SYSTEM = (
+    "你是小说大纲策划。\n"
+    "根据小说设定，把主线展开成连续的章节大纲，每章一个标题和100字以内的情节概要，"
+    "章节之间要有因果推进，暗线与反转按设定埋在合适的章节。\n"
+    '只输出JSON：{"chapters":[{"title":"...","summary":"..."}]}\n'
+)
+
+_CHAPTER_SYSTEM = (
+    "你是网文小说作者。\n"
+    "严格依照小说设定和章节大纲写作指定章节的正文，衔接前后章情节，不要写到其他章节的内容。\n"
+    "只输出正文，不要输出章节标题、解释或多余内容。\n"
+)
+
+MAX_CHAPTERS = 50
+MAX_CONCURRENCY = 8
+_APPEND_BYTES = 4096  # 攒够这么多字节追加一次，OSS 请求数和断点粒度之间折中
+_CHAPTER_ATTEMPTS = 2  # 流中途断开时本任务内重写几次；超过就让任务失败，续跑时再写
+
+
+class ChapterIncomplete(RuntimeError):
+    def __init__(self, index: int, reason: str) -> None:
+        detail = {
+            "truncated": "模型输出中途中断",
+            "length": "输出达到 max_tokens 上限（请调大 profiles.chapter.max_tokens）",
+        }.get(reason, reason)
+        super().__init__(f"第{index}章生成不完整：{detail}")
+        self.reason = reason
+
+_running_lock = threading.Lock()
+_running: set[str] = set()
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _outline_digest(chapters: list[dict[str, str]]) -> str:
+    raw = json.dumps(chapters, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def render_outline(chapters: list[dict[str, str]]) -> str:
+    lines = [f"第{i}章 {c['title']}：{c['summary']}" for i, c in enumerate(chapters, 1)]
+    return "章节大纲：\n" + "\n".join(lines)
+
+
+def generate_outline(novel_id: str, *, chapters: int) -> list[dict[str, str]]:
+    ctx = load_novel_context(novel_id)
+    if ctx is None or not ctx.get("mainline"):
+        raise ValueError("请先填写并保存主线，再生成章节")
+    messages = build_messages(
+        system=_OUTLINE_SYSTEM,
+        context=context_for_prompt(novel_id),
+        user=labeled(("章节数", str(chapters)), ("主线", ctx.get("mainline"))),
+    )
+    data = extract_json_from_text(get_shared_router().chat_messages(messages, profile="outline"))
+    items = data.get("chapters") if data else None
+    if not isinstance(items, list):
+        raise ValueError("大纲生成失败：模型没有返回可解析的章节列表")
+    result = [
+        {
+            "title": str(c.get("title") or "").strip(),
+            "summary": str(c.get("summary") or "").strip(),
+        }
+        for c in items
+        if isinstance(c, dict)
+    ]
+    result = [c for c in result if c["title"] or c["summary"]][:chapters]
+    if not result:
+        raise ValueError("大纲生成失败：章节列表为空")
+    return result
+
+
+def _load_or_create_outline(
+    oss: "OssStorage", novel_id: str, *, chapters: int, restart: bool
+) -> list[dict[str, str]]:
+    from storage.novels import outline_key
+
+    if not restart:
+        data = oss.get_json(outline_key(novel_id))
+        items = data.get("chapters") if isinstance(data, dict) else None
+        if isinstance(items, list) and len(items) == chapters:
+            return items
+    items = generate_outline(novel_id, chapters=chapters)
+    oss.put_json(outline_key(novel_id), {"chapters": items, "created_at": _now_iso()})
+    return items
+
+
+def _load_checkpoint(oss: "OssStorage", novel_id: str, digest: str) -> dict[str, Any]:
+    from storage.novels import checkpoint_key
+
+    data = oss.get_json(checkpoint_key(novel_id))
+    if isinstance(data, dict) and data.get("outline_digest") == digest:
+        return data
+    # 大纲变了，旧断点作废
+    return {"outline_digest": digest, "done": {}}
+
+
+def _draft_chapter(
+    oss: "OssStorage",
+    novel_id: str,
+    index: int,
+    prefix_context: str,
+    outline: list[dict[str, str]],
+    *,
+    chapter_chars: int,
+    job: Optional["Job"],
+    abort: threading.Event,
+) -> dict[str, Any]:
+    from storage.novels import chapter_key
+
+    attempt = 1
+    while True:
+        try:
+            return _write_chapter(
+                oss,
+                chapter_key(novel_id, index),
+                index,
+                prefix_context,
+                outline,
+                chapter_chars=chapter_chars,
+                job=job,
+                abort=abort,
+            )
+        except ChapterIncomplete as exc:
+            inc("chapter_incomplete_total", reason=exc.reason)
+            # 达到 max_tokens 重写也一样会被截断，直接失败；流中断可能是偶发的，重写一次
+            if exc.reason == "length" or attempt >= _CHAPTER_ATTEMPTS:
+                raise
+            _logger.warning(
+                "章节生成不完整，重新生成 (novel_id=%s, index=%s, attempt=%s)",
+                novel_id,
+                index,
+                attempt,
+            )
+            attempt += 1
+
+
+def _write_chapter(
+    oss: "OssStorage",
+    key: str,
+    index: int,
+    prefix_context: str,
+    outline: list[dict[str, str]],
+    *,
+    chapter_chars: int,
+    job: Optional["Job"],
+    abort: threading.Event,
+) -> dict[str, Any]:
+    chapter = outline[index - 1]
+    # 上次崩在这一章的半成品（或本任务里上一次没写完的）：追加写无法覆盖，先删再写
+    oss.delete(key)
+
+    messages = build_messages(
+        system=_CHAPTER_SYSTEM,
+        context=prefix_context,
+        user=labeled(
+            ("章节", f"第{index}章 {chapter['title']}"),
+            ("本章概要", chapter["summary"]),
+            ("字数", f"约{chapter_chars}字"),
+        ),
+    )
+    headers = {"Content-Type": "text/plain; charset=utf-8"}
+    position = 0
+    chars = 0
+    pending: list[bytes] = []
+    pending_bytes = 0
+    started = time.perf_counter()
+
+    def flush() -> None:
+        nonlocal position, pending_bytes
+        if pending:
+            position = oss.append_bytes(key, b"".join(pending), position=position, headers=headers)
+            pending.clear()
+            pending_bytes = 0
+
+    # 路由器吞掉中途断流、只在 stats 里标 truncated；被 max_tokens 截断时 finish_reason 为 length。
+    # 这两种都不能记成已完成，否则续跑时不会重写
+    stats: dict[str, Any] = {}
+    pending.append(f"第{index}章 {chapter['title']}\n\n".encode("utf-8"))
+    for part in get_shared_router().chat_messages_stream(messages, stats=stats, profile="chapter"):
+        if job is not None:
+            job.check_cancelled()
+        if abort.is_set():
+            raise RuntimeError(f"第{index}章已中止：其他章节生成失败")
+        chars += len(part)
+        data = part.encode("utf-8")
+        pending.append(data)
+        pending_bytes += len(data)
+        if pending_bytes >= _APPEND_BYTES:
+            flush()
+    if not chars:
+        raise ValueError(f"第{index}章生成失败：模型没有返回内容")
+    if stats.get("truncated"):
+        raise ChapterIncomplete(index, "truncated")
+    if stats.get("finish_reason") == "length":
+        raise ChapterIncomplete(index, "length")
+    pending.append(b"\n")
+    flush()
+
+    elapsed = time.perf_counter() - started
+    observe("chapter_generation_seconds", elapsed)
+    inc("chapter_chars_total", chars)
+    return {
+        "key": key,
+        "chars": chars,
+        "bytes": position,
+        "elapsed_s": round(elapsed, 3),
+        "chars_per_s": round(chars / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def generate_chapters(
+    novel_id: str,
+    *,
+    chapters: int = 10,
+    concurrency: int = 3,
+    chapter_chars: int = 2000,
+    restart: bool = False,
+    job: Optional["Job"] = None,
+) -> dict[str, Any]:
+    from storage.novels import checkpoint_key
+    from storage.oss_storage import get_shared_storage
+
+    chapters = min(MAX_CHAPTERS, max(1, int(chapters)))
+    concurrency = min(MAX_CONCURRENCY, max(1, int(concurrency)))
+    with _running_lock:
+        if novel_id in _running:
+            raise ValueError("这本小说正在生成章节，请等当前任务结束")
+        _running.add(novel_id)
+    try:
+        oss = get_shared_storage()
+        if job is not None:
+            job.report(0.0, "正在生成大纲")
+        outline = _load_or_create_outline(oss, novel_id, chapters=chapters, restart=restart)
+        digest = _outline_digest(outline)
+        checkpoint = _load_checkpoint(oss, novel_id, digest)
+        if restart:
+            checkpoint["done"] = {}
+        done: dict[str, Any] = checkpoint["done"]
+        todo = [i for i in range(1, len(outline) + 1) if str(i) not in done]
+        if len(todo) < len(outline):
+            _logger.info(
+                "从断点继续生成章节 (novel_id=%s, done=%s, todo=%s)",
+                novel_id,
+                len(outline) - len(todo),
+                len(todo),
+            )
+
+        prefix_context = "\n\n".join(
+            part for part in (context_for_prompt(novel_id), render_outline(outline)) if part
+        )
+        lock = threading.Lock()
+        abort = threading.Event()
+        started = time.perf_counter()
+        new_chars = 0
+
+        def report() -> None:
+            if job is None:
+                return
+            elapsed = time.perf_counter() - started
+            job.report(
+                len(done) / len(outline),
+                f"已完成 {len(done)}/{len(outline)} 章",
+                chars_per_s=round(new_chars / elapsed, 1) if elapsed > 0 else 0.0,
+            )
+
+        report()
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="novel-chapter")
+        try:
+            futures: dict[Future[dict[str, Any]], int] = {
+                pool.submit(
+                    _draft_chapter,
+                    oss,
+                    novel_id,
+                    index,
+                    prefix_context,
+                    outline,
+                    chapter_chars=chapter_chars,
+                    job=job,
+                    abort=abort,
+                ): index
+                for index in todo
+            }
+            while futures:
+                finished, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    index = futures.pop(fut)
+                    try:
+                        info = fut.result()
+                    except BaseException:
+                        # 任一章失败整个任务失败，其余在写的章节尽快停下；已完成的章节留在断点里
+                        abort.set()
+                        raise
+                    with lock:
+                        done[str(index)] = info
+                        new_chars += info["chars"]
+                        checkpoint["updated_at"] = _now_iso()
+                        oss.put_json(checkpoint_key(novel_id), checkpoint)
+                    report()
+        finally:
+            # 出错或取消时不再启动排队中的章节；已在写的章节检查到取消标记后自行退出
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        elapsed = time.perf_counter() - started
+        total_chars = sum(int(v.get("chars") or 0) for v in done.values())
+        chars_per_s = round(new_chars / elapsed, 1) if elapsed > 0 else 0.0
+        _logger.info(
+            "章节生成完成 (novel_id=%s, chapters=%s, new_chars=%s, elapsed=%.1fs, chars_per_s=%s)",
+            novel_id,
+            len(outline),
+            new_chars,
+            elapsed,
+            chars_per_s,
+        )
+        return {
+            "novel_id": novel_id,
+            "chapters": [
+                {"index": i, "title": c["title"], **done.get(str(i), {})}
+                for i, c in enumerate(outline, 1)
+            ],
+            "total_chars": total_chars,
+            "new_chars": new_chars,
+            "elapsed_s": round(elapsed, 3),
+            "chars_per_s": chars_per_s,
+        }
+    finally:
+        with _running_lock:
+            _running.discard(novel_id)
+
+
+def chapter_status(novel_id: str) -> dict[str, Any]:
+    from storage.novels import outline_key
+    from storage.oss_storage import get_shared_storage
+
+    oss = get_shared_storage()
+    data = oss.get_json(outline_key(novel_id))
+    outline = data.get("chapters") if isinstance(data, dict) else None
+    if not isinstance(outline, list):
+        return {"novel_id": novel_id, "chapters": []}
+    checkpoint = _load_checkpoint(oss, novel_id, _outline_digest(outline))
+    done = checkpoint.get("done") or {}
+    return {
+        "novel_id": novel_id,
+        "chapters": [
+            {
+                "index": i,
+                "title": c.get("title", ""),
+                "summary": c.get("summary", ""),
+                "done": str(i) in done,
+                "chars": int((done.get(str(i)) or {}).get("chars") or 0),
+            }
+            for i, c in enumerate(outline, 1)
+        ],
+        "updated_at": checkpoint.get("updated_at", ""),
+    }
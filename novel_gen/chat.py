@@ -1,45 +1,98 @@
 from __future__ import annotations
 
 import os
-from dataclasses import dataclass
-from threading import Lock
-from typing import Any, Optional
+import threading
+import time
+from typing import Any, Iterator, Optional
 
 from config.log import get_logger
+from config.metrics import inc, span
 from llm.baidu_client import BaiduAiSearchClient
-from llm.qwen_client import QwenClient
-from llm.qwen_client import extract_json_from_text
+from llm.qwen_client import QwenClient, extract_json_from_text
+from llm.router import get_shared_router
+from novel_gen.chat_store import DEFAULT_SESSION, ChatMessage, get_chat_store
+from novel_gen.context import context_for_prompt
+from novel_gen.prompt import build_messages, labeled
+from novel_gen.retrieval import (
+    forget_session,
+    index_chat_turn,
+    render_hits,
+    retrieval_enabled,
+    retrieve,
+)
 
 _logger = get_logger(__name__)
 
 
-@dataclass
-class ChatMessage:
-    role: str
-    content: str
-
-
-_lock = Lock()
-_messages: list[ChatMessage] = []
 _system_prompt = (
     "你是中文小说创作助手。\n"
     "你与用户进行多轮对话，帮助完善故事设定、剧情结构与写作表达。\n"
     "回答要具体可执行，优先给可直接复制到编辑框的文字。\n"
 )
 
+_EMPTY_REPLY = "我没能生成有效回复，你可以换个问法再试一次。"
+_FAILURE_MESSAGES = {
+    "upstream_failed": "模型服务暂时不可用，请稍后再试",
+    "upstream_interrupted": "模型输出中途中断，已保留生成的部分",
+}
+
 _route_mode = (os.getenv("CHAT_ROUTE_MODE") or "auto").strip().lower()
 
+# 开启检索时只带最近一段原始历史，更早的对话按相关性召回；
+# 窗口按整步裁剪，裁剪点不动的几轮里历史前缀逐字相同，仍能命中前缀缓存
+_HISTORY_WINDOW = 20
+_HISTORY_STEP = 10
+
+
+_ROUTE_SYSTEM = (
+    "你是意图识别器，只做路由判断，不要输出多余内容。\n"
+    "判断用户问题是否需要联网搜索（需要最新信息、具体事实核验、引用来源、或依赖外部网页）。\n"
+    "仅输出JSON，不要解释。\n"
+    'JSON格式：{"route":"search"} 或 {"route":"chat"}\n'
+)
+
 
-def _to_openai_messages(messages: list[ChatMessage]) -> list[dict[str, Any]]:
-    result: list[dict[str, Any]] = [{"role": "system", "content": _system_prompt}]
-    for msg in messages:
-        role = msg.role if msg.role in ("user", "assistant") else "user"
-        result.append({"role": role, "content": msg.content})
-    return result
+def _history_window(history: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    excess = len(history) - _HISTORY_WINDOW
+    if excess <= 0:
+        return history
+    cut = -(-excess // _HISTORY_STEP) * _HISTORY_STEP
+    return history[cut:]
+
+
+def _to_openai_messages(
+    messages: list[ChatMessage], *, novel_id: str = "", session_id: str = ""
+) -> list[dict[str, Any]]:
+    # 最后一条是本轮用户输入，其余是只追加的历史；小说设定由服务端注入，用户不必再粘贴
+    history = [{"role": m.role, "content": m.content} for m in messages]
+    user = history.pop()["content"] if history and history[-1]["role"] == "user" else ""
+    context = context_for_prompt(novel_id) if novel_id else ""
+    if retrieval_enabled() and user:
+        history = _history_window(history)
+        hits = retrieve(
+            user,
+            novel_id=novel_id,
+            session_id=session_id,
+            exclude_users=frozenset(m["content"] for m in history if m["role"] == "user"),
+        )
+        if hits:
+            # 召回的片段每轮都不同，只能放在最后一条 user 消息里，不破坏前面的可缓存前缀
+            user = labeled(("相关资料", render_hits(hits)), ("用户问题", user))
+    return build_messages(system=_system_prompt, context=context, history=history, user=user)
 
 
 def _detect_route(*, message: str, client: Optional[QwenClient] = None) -> str:
+    with span("chat_route_seconds") as sp:
+        route = _classify_route(message=message, client=client, info=sp)
+        sp["route"] = route
+        return route
+
+
+def _classify_route(
+    *, message: str, client: Optional[QwenClient], info: dict[str, Any]
+) -> str:
     resolved = (message or "").strip()
+    info["method"] = "forced"
     if not resolved:
         return "chat"
 
@@ -73,19 +126,15 @@ def _detect_route(*, message: str, client: Optional[QwenClient] = None) -> str:
         "来源",
         "链接",
     )
+    info["method"] = "heuristic"
     if any(k in resolved for k in heuristic_keywords):
         return "search"
 
-    prompt = (
-        "你是意图识别器，只做路由判断，不要输出多余内容。\n"
-        "判断用户问题是否需要联网搜索（需要最新信息、具体事实核验、引用来源、或依赖外部网页）。\n"
-        "仅输出JSON，不要解释。\n"
-        'JSON格式：{"route":"search"} 或 {"route":"chat"}\n'
-        f"用户问题：{resolved}\n"
+    info["method"] = "llm"
+    llm = client or get_shared_router()
+    text = llm.chat_messages(
+        build_messages(system=_ROUTE_SYSTEM, user=f"用户问题：{resolved}"), profile="route"
     )
-
-    llm = client or QwenClient()
-    text = llm.chat(prompt)
     data = extract_json_from_text(text)
     if isinstance(data, dict):
         route = data.get("route")
@@ -97,14 +146,39 @@ def _detect_route(*, message: str, client: Optional[QwenClient] = None) -> str:
     return "chat"
 
 
-def get_history() -> list[dict[str, str]]:
-    with _lock:
-        return [{"role": m.role, "content": m.content} for m in _messages]
+def _append(session_id: str, role: str, content: str, *, truncated: bool = False) -> None:
+    get_chat_store().append(
+        session_id, ChatMessage(role=role, content=content, truncated=truncated)
+    )
+
+
+def _history_item(m: ChatMessage) -> dict[str, Any]:
+    item: dict[str, Any] = {"role": m.role, "content": m.content, "seq": m.seq}
+    if m.truncated:
+        item["truncated"] = True
+    return item
+
+
+def get_history(*, session_id: str = DEFAULT_SESSION) -> list[dict[str, Any]]:
+    return [_history_item(m) for m in get_messages_snapshot(session_id=session_id)]
+
 
+def get_history_page(
+    *, session_id: str = DEFAULT_SESSION, limit: int, before: Optional[int] = None
+) -> dict[str, Any]:
+    # 只取末尾一页；往上翻时把本页第一条的 seq（返回里的 before）作为下一次的 before
+    messages, has_more, total = get_chat_store().page(session_id, limit=limit, before=before)
+    return {
+        "messages": [_history_item(m) for m in messages],
+        "before": messages[0].seq if messages else before,
+        "total": total,
+        "has_more": has_more,
+    }
 
-def clear_history() -> None:
-    with _lock:
-        _messages.clear()
+
+def clear_history(*, session_id: str = DEFAULT_SESSION) -> None:
+    get_chat_store().clear(session_id)
+    forget_session(session_id)
 
 
 def send_message(
@@ -112,6 +186,8 @@ def send_message(
     message: str,
     use_search: Optional[bool] = None,
     client: Optional[QwenClient] = None,
+    session_id: str = DEFAULT_SESSION,
+    novel_id: str = "",
 ) -> str:
     content = (message or "").strip()
     if not content:
@@ -123,10 +199,7 @@ def send_message(
     else:
         resolved_use_search = bool(use_search)
 
-    with _lock:
-        _messages.append(ChatMessage(role="user", content=content))
-        if len(_messages) > 60:
-            _messages[:] = _messages[-60:]
+    _append(session_id, "user", content)
 
     if resolved_use_search:
         try:
@@ -142,27 +215,27 @@ def send_message(
             else:
                 reply = None
     else:
-        payload = _to_openai_messages(get_messages_snapshot())
-        llm = client or QwenClient()
-        reply = llm.chat_messages(payload)
+        payload = _to_openai_messages(
+            get_messages_snapshot(session_id=session_id), novel_id=novel_id, session_id=session_id
+        )
+        llm = client or get_shared_router()
+        reply = llm.chat_messages(payload, profile="chat")
 
     if not isinstance(reply, str) or not reply.strip():
         _logger.warning("聊天回复为空")
-        reply_text = "我没能生成有效回复，你可以换个问法再试一次。"
+        reply_text = _EMPTY_REPLY
     else:
         reply_text = reply.strip()
 
-    with _lock:
-        _messages.append(ChatMessage(role="assistant", content=reply_text))
-        if len(_messages) > 60:
-            _messages[:] = _messages[-60:]
+    _append(session_id, "assistant", reply_text)
+    if reply_text != _EMPTY_REPLY:
+        index_chat_turn(session_id, content, reply_text)
 
     return reply_text
 
 
-def get_messages_snapshot() -> list[ChatMessage]:
-    with _lock:
-        return list(_messages)
+def get_messages_snapshot(*, session_id: str = DEFAULT_SESSION) -> list[ChatMessage]:
+    return get_chat_store().history(session_id)
 
 
 def send_message_stream(
@@ -170,65 +243,150 @@ def send_message_stream(
     message: str,
     use_search: Optional[bool] = None,
     client: Optional[QwenClient] = None,
+    session_id: str = DEFAULT_SESSION,
+    novel_id: str = "",
+    cancel: Optional[threading.Event] = None,
 ) -> Any:
+    # 纯文本流（/api/chat/send_stream）：只取增量文本，搜索路由先给一行提示
+    if not (message or "").strip():
+        yield ""
+        return
+    for event, data in stream_chat_events(
+        message=message,
+        use_search=use_search,
+        client=client,
+        session_id=session_id,
+        novel_id=novel_id,
+        cancel=cancel,
+    ):
+        if event == "route" and data["route"] == "search":
+            yield "正在搜索…\n"
+        elif event == "delta":
+            yield data["text"]
+
+
+def stream_chat_events(
+    *,
+    message: str,
+    use_search: Optional[bool] = None,
+    client: Optional[QwenClient] = None,
+    session_id: str = DEFAULT_SESSION,
+    novel_id: str = "",
+    cancel: Optional[threading.Event] = None,
+) -> Iterator[tuple[str, dict[str, Any]]]:
+    # 带类型的事件流：route → delta… → usage → done，供 SSE 接口使用。
+    # cancel 被置位（客户端断开）时关掉上游流，已生成的部分标记为 truncated 存入历史。
+    # 上游失败或中途断流时以 error 事件结束（不发 done），已生成的部分同样按截断保存
     content = (message or "").strip()
     if not content:
-        yield ""
         return
+    started = time.perf_counter()
 
     if use_search is None:
         route = _detect_route(message=content, client=client)
-        resolved_use_search = route == "search"
+        source = "auto"
     else:
-        resolved_use_search = bool(use_search)
+        route = "search" if use_search else "chat"
+        source = "explicit"
+    yield "route", {"route": route, "source": source}
 
-    with _lock:
-        _messages.append(ChatMessage(role="user", content=content))
-        if len(_messages) > 60:
-            _messages[:] = _messages[-60:]
+    _append(session_id, "user", content)
+    first_at: Optional[float] = None
+    stats: dict[str, Any] = {}
+    buf_parts: list[str] = []
+    truncated = False
+    failure = ""
 
-    if resolved_use_search:
-        yield "正在搜索…\n"
-        try:
-            baidu = BaiduAiSearchClient()
-            reply = baidu.chat_completions(
-                messages=[{"role": "user", "content": content}],
-                instruction=_system_prompt,
+    try:
+        if route == "search":
+            try:
+                baidu = BaiduAiSearchClient()
+                reply = baidu.chat_completions(
+                    messages=[{"role": "user", "content": content}],
+                    instruction=_system_prompt,
+                )
+                reply_text = (reply or "").strip()
+            except Exception:
+                _logger.exception("百度智能搜索调用异常")
+                reply_text = ""
+
+            if not reply_text:
+                reply_text = _EMPTY_REPLY
+            # 搜索结果是一次性拿到的，切片发送期间断开也按完整回复保存
+            buf_parts.append(reply_text)
+            first_at = time.perf_counter()
+            step = 40
+            for i in range(0, len(reply_text), step):
+                yield "delta", {"text": reply_text[i : i + step]}
+        else:
+            payload = _to_openai_messages(
+                get_messages_snapshot(session_id=session_id),
+                novel_id=novel_id,
+                session_id=session_id,
             )
-            reply_text = (reply or "").strip()
-        except Exception:
-            _logger.exception("百度智能搜索调用异常")
-            reply_text = ""
-
-        if not reply_text:
-            reply_text = "我没能生成有效回复，你可以换个问法再试一次。"
-
-        step = 40
-        for i in range(0, len(reply_text), step):
-            yield reply_text[i : i + step]
-
-        with _lock:
-            _messages.append(ChatMessage(role="assistant", content=reply_text))
-            if len(_messages) > 60:
-                _messages[:] = _messages[-60:]
+            llm = client or get_shared_router()
+            upstream = iter(llm.chat_messages_stream(payload, stats=stats, profile="chat"))
+            try:
+                for part in upstream:
+                    if cancel is not None and cancel.is_set():
+                        truncated = True
+                        break
+                    if first_at is None:
+                        first_at = time.perf_counter()
+                    buf_parts.append(part)
+                    yield "delta", {"text": part}
+            except Exception:
+                _logger.exception("Qwen流式聊天失败")
+                stats.setdefault("error", "upstream_exception")
+            finally:
+                close = getattr(upstream, "close", None)
+                if close is not None:
+                    close()
+            if stats.pop("truncated", False):
+                failure = "upstream_interrupted"
+            if stats.pop("error", None):
+                failure = failure or "upstream_failed"
+            truncated = truncated or bool(failure)
+
+            reply_text = "".join(buf_parts).strip()
+            if not reply_text and not truncated:
+                reply_text = _EMPTY_REPLY
+                yield "delta", {"text": reply_text}
+    except GeneratorExit:
+        # 消费方直接关掉了生成器：同样记为截断
+        _save_reply(
+            session_id, content, "".join(buf_parts).strip(), truncated=route != "search"
+        )
+        raise
+
+    _save_reply(session_id, content, reply_text, truncated=truncated)
+    if stats:
+        yield "usage", stats
+    if failure:
+        inc("chat_stream_errors_total", reason=failure)
+        yield "error", {
+            "code": failure,
+            "message": _FAILURE_MESSAGES[failure],
+            "route": route,
+            "chars": len(reply_text),
+        }
         return
-
-    payload = _to_openai_messages(get_messages_snapshot())
-    llm = client or QwenClient()
-    buf_parts: list[str] = []
-    try:
-        for part in llm.chat_messages_stream(payload):
-            buf_parts.append(part)
-            yield part
-    except Exception:
-        _logger.exception("Qwen流式聊天失败")
-
-    reply_text = "".join(buf_parts).strip()
-    if not reply_text:
-        reply_text = "我没能生成有效回复，你可以换个问法再试一次。"
-        yield reply_text
-
-    with _lock:
-        _messages.append(ChatMessage(role="assistant", content=reply_text))
-        if len(_messages) > 60:
-            _messages[:] = _messages[-60:]
+    ended = time.perf_counter()
+    yield "done", {
+        "route": route,
+        "chars": len(reply_text),
+        "truncated": truncated,
+        "elapsed_s": round(ended - started, 3),
+        "ttft_s": round(first_at - started, 3) if first_at is not None else None,
+    }
+
+
+def _save_reply(session_id: str, user: str, reply_text: str, *, truncated: bool) -> None:
+    if truncated:
+        inc("chat_replies_truncated_total")
+        _logger.info("聊天回复被中断，保存已生成部分 (chars=%s)", len(reply_text))
+        if not reply_text:
+            return
+    _append(session_id, "assistant", reply_text, truncated=truncated)
+    if reply_text != _EMPTY_REPLY:
+        index_chat_turn(session_id, user, reply_text)
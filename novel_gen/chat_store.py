@@ -0,0 +1,550 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from config.loader import get_server_config, subscribe
+from config.log import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境：只有进程内锁
+    fcntl = None  # type: ignore[assignment]
+
+_logger = get_logger(__name__)
+
+# 聊天记录放在进程外，多 worker / 多节点看到的是同一份会话。
+# 地址格式：memory（仅单进程）、sqlite:///绝对路径、sqlite:相对项目根的路径、redis://host:port/db、
+# log:///绝对目录、log:相对项目根的目录（本机追加日志 + 快照，同机多 worker 共用）
+
+DEFAULT_SESSION = "default"
+HISTORY_LIMIT = 60  # 每轮带给模型、以及不分页的历史接口返回的最近消息数
+RETAIN_LIMIT = 500  # 每个会话保留多少条，分页往上翻能翻到的范围
+SESSION_TTL_S = 7 * 24 * 3600
+
+_shared_lock = threading.Lock()
+_shared_store: Optional["ChatStore"] = None
+_shared_subscribed = False
+
+
+@dataclass
+class ChatMessage:
+    role: str
+    content: str
+    truncated: bool = False  # 生成中途被取消（客户端断开）或上游中断，只保存了部分回复
+    seq: int = 0  # 会话内单调递增的序号，由存储在写入时分配；裁剪、重启都不变，用作分页游标
+
+
+class ChatStore:
+    url = ""
+    shared = True  # 是否能在多个进程间共享
+
+    def append(self, session_id: str, message: ChatMessage, *, limit: int = RETAIN_LIMIT) -> None:
+        raise NotImplementedError
+
+    def history(self, session_id: str, *, limit: int = HISTORY_LIMIT) -> list[ChatMessage]:
+        raise NotImplementedError
+
+    def clear(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def page(
+        self, session_id: str, *, limit: int, before: Optional[int] = None
+    ) -> tuple[list[ChatMessage], bool, int]:
+        # 分页取历史：返回 (消息, 是否还有更早的, 保留的总条数)；
+        # before 是上一页第一条的 seq，只取比它早的，不传取最新一页
+        return _slice(self.history(session_id, limit=RETAIN_LIMIT), limit=limit, before=before)
+
+    def close(self) -> None:
+        pass
+
+
+def _slice(
+    items: list[ChatMessage], *, limit: int, before: Optional[int]
+) -> tuple[list[ChatMessage], bool, int]:
+    end = len(items) if before is None else bisect_left(items, before, key=lambda m: m.seq)
+    start = max(0, end - max(0, limit))
+    return items[start:end], start > 0, len(items)
+
+
+class MemoryChatStore(ChatStore):
+    shared = False
+
+    def __init__(self) -> None:
+        self.url = "memory"
+        self._lock = threading.Lock()
+        self._sessions: dict[str, list[ChatMessage]] = {}
+        self._seqs: dict[str, int] = {}  # 清空会话后序号接着涨，旧游标不会指到新消息上
+
+    def append(self, session_id: str, message: ChatMessage, *, limit: int = RETAIN_LIMIT) -> None:
+        with self._lock:
+            seq = self._seqs.get(session_id, 0) + 1
+            self._seqs[session_id] = seq
+            items = self._sessions.setdefault(session_id, [])
+            items.append(replace(message, seq=seq))
+            if len(items) > limit:
+                items[:] = items[-limit:]
+
+    def history(self, session_id: str, *, limit: int = HISTORY_LIMIT) -> list[ChatMessage]:
+        with self._lock:
+            return self._sessions.get(session_id, [])[-limit:]
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def page(
+        self, session_id: str, *, limit: int, before: Optional[int] = None
+    ) -> tuple[list[ChatMessage], bool, int]:
+        with self._lock:
+            return _slice(self._sessions.get(session_id, []), limit=limit, before=before)
+
+
+class SqliteChatStore(ChatStore):
+    # WAL 模式：读写互不阻塞，同机多个 worker 进程共用一个文件即可
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.url = f"sqlite:///{self.path}"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conns: list[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chat_messages_session
+                ON chat_messages(session_id, id);
+            """
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_messages)")}
+        if "truncated" not in columns:
+            # 旧库补列；多个 worker 同时启动时可能撞上，列已存在就忽略
+            try:
+                conn.execute(
+                    "ALTER TABLE chat_messages ADD COLUMN truncated INTEGER NOT NULL DEFAULT 0"
+                )
+            except sqlite3.OperationalError:
+                pass
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=10000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    # 自增主键 id 全局单调，直接当作 seq
+    def append(self, session_id: str, message: ChatMessage, *, limit: int = RETAIN_LIMIT) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO chat_messages(session_id, role, content, truncated, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, message.role, message.content, int(message.truncated), time.time()),
+            )
+            conn.execute(
+                "DELETE FROM chat_messages WHERE session_id = ? AND id <= ("
+                "SELECT id FROM chat_messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (session_id, session_id, limit),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def history(self, session_id: str, *, limit: int = HISTORY_LIMIT) -> list[ChatMessage]:
+        rows = self._conn().execute(
+            "SELECT id, role, content, truncated FROM chat_messages WHERE session_id = ? "
+            "ORDER BY id DESC LIMIT ?",
+            (session_id, limit),
+        ).fetchall()
+        return _rows_to_messages(rows[::-1])
+
+    def clear(self, session_id: str) -> None:
+        self._conn().execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+
+    def page(
+        self, session_id: str, *, limit: int, before: Optional[int] = None
+    ) -> tuple[list[ChatMessage], bool, int]:
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            total = conn.execute(
+                "SELECT COUNT(*) FROM chat_messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            # 多取一条判断前面还有没有
+            rows = conn.execute(
+                "SELECT id, role, content, truncated FROM chat_messages "
+                "WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (session_id, before if before is not None else 2**63 - 1, max(0, limit) + 1),
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        has_more = len(rows) > limit
+        return _rows_to_messages(rows[:limit][::-1]), has_more, total
+
+    def close(self) -> None:
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+class RedisChatStore(ChatStore):
+    # 任何说 RESP 协议的服务都可以（Redis / Valkey / KeyDB 等），跨节点共享
+    def __init__(self, url: str, *, key_prefix: str = "novelai:chat:") -> None:
+        try:
+            import redis
+        except Exception as exc:
+            raise RuntimeError("缺少依赖：redis。请先安装：pip install redis") from exc
+
+        self.url = url
+        self.key_prefix = key_prefix
+        self._client: Any = redis.Redis.from_url(url, socket_timeout=5, health_check_interval=30)
+        self._append = self._client.register_script(self._APPEND_SCRIPT)
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}"
+
+    # 序号计数器和追加在同一段脚本里完成，并发追加时列表顺序和 seq 顺序一致；清空会话不重置计数器
+    _APPEND_SCRIPT = """
+    local seq = redis.call('INCR', KEYS[2])
+    redis.call('RPUSH', KEYS[1], '{"seq":' .. seq .. ',' .. string.sub(ARGV[1], 2))
+    redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return seq
+    """
+
+    def append(self, session_id: str, message: ChatMessage, *, limit: int = RETAIN_LIMIT) -> None:
+        key = self._key(session_id)
+        item = json.dumps(_message_dict(replace(message, seq=0)), ensure_ascii=False)
+        self._append(keys=[key, f"{key}:seq"], args=[item, limit, SESSION_TTL_S])
+
+    def history(self, session_id: str, *, limit: int = HISTORY_LIMIT) -> list[ChatMessage]:
+        return _decode_items(self._client.lrange(self._key(session_id), -limit, -1))
+
+    def clear(self, session_id: str) -> None:
+        self._client.delete(self._key(session_id))
+
+    def close(self) -> None:
+        try:
+            self._client.close()
+        except Exception:
+            pass
+
+
+class LogChatStore(ChatStore):
+    # 每个会话一个只追加的日志段：记录 = 4 字节长度 + 4 字节 CRC32 + JSON。
+    # 每写满 SNAPSHOT_EVERY 条记录，把当前保留的消息写成快照并换新日志段，旧段删掉；
+    # 重启恢复只需读一份快照加不超过 SNAPSHOT_EVERY 条记录，与会话总长度无关。
+    # 写入在文件锁里进行（同机多 worker 共用）；读取不加锁，读到写了一半的末尾记录就停在那里。
+    SNAPSHOT_EVERY = 200
+    _HEADER = struct.Struct(">II")
+    _MAX_CACHED = 1024
+
+    def __init__(self, root: str | Path) -> None:
+        self.root = Path(root)
+        self.url = f"log:///{self.root}"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._states: OrderedDict[str, _LogState] = OrderedDict()
+
+    # ---- 文件布局 ----
+
+    def _name(self, session_id: str) -> str:
+        return _SESSION_FILE_RE.sub("_", session_id)[:64] or "_"
+
+    def _snapshot_path(self, session_id: str) -> Path:
+        return self.root / f"{self._name(session_id)}.snap"
+
+    def _segment_path(self, session_id: str, segment: int) -> Path:
+        return self.root / f"{self._name(session_id)}.{segment:08d}.log"
+
+    @contextmanager
+    def _file_lock(self, session_id: str) -> Iterator[None]:
+        with open(self.root / f"{self._name(session_id)}.lock", "a") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    # ---- 编解码 ----
+
+    @classmethod
+    def _encode(cls, record: dict[str, Any]) -> bytes:
+        payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return cls._HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    @classmethod
+    def _decode(cls, buf: bytes) -> tuple[list[dict[str, Any]], int]:
+        # 返回 (完整记录, 用掉的字节数)；末尾不完整或校验不过的记录留给下次（或由写入方截掉）
+        records: list[dict[str, Any]] = []
+        pos = 0
+        size = cls._HEADER.size
+        while pos + size <= len(buf):
+            length, crc = cls._HEADER.unpack_from(buf, pos)
+            end = pos + size + length
+            if end > len(buf):
+                break
+            payload = buf[pos + size : end]
+            if zlib.crc32(payload) != crc:
+                _logger.warning("聊天日志记录校验失败，忽略其后的内容 (offset=%s)", pos)
+                break
+            records.append(json.loads(payload))
+            pos = end
+        return records, pos
+
+    # ---- 状态同步 ----
+
+    @staticmethod
+    def _stamp(path: Path) -> Optional[tuple[int, int]]:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _sync(self, session_id: str) -> "_LogState":
+        # 调用方持有 self._lock。快照变了（别的进程做了快照或清空）就整体重载，否则只读新增的尾部
+        snap_path = self._snapshot_path(session_id)
+        stamp = self._stamp(snap_path)
+        state = self._states.get(session_id)
+        if state is None or state.snap_stamp != stamp:
+            state = _LogState(snap_stamp=stamp)
+            if stamp is not None:
+                data = json.loads(snap_path.read_text(encoding="utf-8"))
+                state.segment = int(data.get("segment") or 0)
+                for item in data.get("messages") or []:
+                    state.add(_message_from_dict(item))
+                state.next_seq = max(state.next_seq, int(data.get("next_seq") or 0))
+            self._states[session_id] = state
+        self._states.move_to_end(session_id)
+        while len(self._states) > self._MAX_CACHED:
+            self._states.popitem(last=False)
+
+        seg_path = self._segment_path(session_id, state.segment)
+        try:
+            with open(seg_path, "rb") as fh:
+                fh.seek(state.offset)
+                buf = fh.read()
+        except FileNotFoundError:
+            return state
+        records, used = self._decode(buf)
+        for record in records:
+            state.apply(record)
+        state.offset += used
+        state.records += len(records)
+        return state
+
+    def _snapshot(self, session_id: str, state: "_LogState") -> None:
+        # 调用方持有文件锁。先落快照（指向新日志段），再删旧段
+        snap_path = self._snapshot_path(session_id)
+        tmp = snap_path.with_name(f"{snap_path.name}.tmp-{os.getpid()}")
+        data = {
+            "segment": state.segment + 1,
+            "next_seq": state.next_seq,
+            "messages": [_message_dict(m) for m in state.messages],
+            "created_at": time.time(),
+        }
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, snap_path)
+        for segment in range(state.segment, -1, -1):
+            old = self._segment_path(session_id, segment)
+            if not old.exists():
+                break
+            old.unlink()
+        state.segment += 1
+        state.offset = 0
+        state.records = 0
+        state.snap_stamp = self._stamp(snap_path)
+
+    # ---- 接口 ----
+
+    def append(self, session_id: str, message: ChatMessage, *, limit: int = RETAIN_LIMIT) -> None:
+        with self._lock, self._file_lock(session_id):
+            state = self._sync(session_id)
+            # 同步到最新之后在文件锁里分配序号，多个 worker 不会分到同一个
+            message = replace(message, seq=state.next_seq)
+            record = {"op": "append", "limit": limit, **_message_dict(message)}
+            data = self._encode(record)
+            seg_path = self._segment_path(session_id, state.segment)
+            with open(seg_path, "ab") as fh:
+                if os.fstat(fh.fileno()).st_size != state.offset:
+                    # 有进程写到一半崩了：截掉残缺的尾部，后面的记录才能接着读
+                    fh.truncate(state.offset)
+                fh.write(data)
+                fh.flush()
+                os.fsync(fh.fileno())
+            state.apply(record)
+            state.offset += len(data)
+            state.records += 1
+            if state.records >= self.SNAPSHOT_EVERY:
+                self._snapshot(session_id, state)
+
+    def history(self, session_id: str, *, limit: int = HISTORY_LIMIT) -> list[ChatMessage]:
+        with self._lock:
+            return self._sync(session_id).messages[-limit:]
+
+    def page(
+        self, session_id: str, *, limit: int, before: Optional[int] = None
+    ) -> tuple[list[ChatMessage], bool, int]:
+        with self._lock:
+            return _slice(self._sync(session_id).messages, limit=limit, before=before)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock, self._file_lock(session_id):
+            state = self._sync(session_id)
+            state.messages = []
+            self._snapshot(session_id, state)
+
+
+_SESSION_FILE_RE = re.compile(r"[^0-9A-Za-z_-]")
+
+
+def _message_dict(message: ChatMessage) -> dict[str, Any]:
+    data: dict[str, Any] = {"role": message.role, "content": message.content}
+    if message.truncated:
+        data["truncated"] = True
+    if message.seq:
+        data["seq"] = message.seq
+    return data
+
+
+def _rows_to_messages(rows: list[Any]) -> list[ChatMessage]:
+    return [ChatMessage(role=r, content=c, truncated=bool(t), seq=i) for i, r, c, t in rows]
+
+
+@dataclass
+class _LogState:
+    snap_stamp: Optional[tuple[int, int]]
+    segment: int = 0
+    offset: int = 0  # 当前日志段里已经读过的字节数
+    records: int = 0  # 当前日志段里的记录数
+    messages: list[ChatMessage] = field(default_factory=list)
+    next_seq: int = 1
+
+    def add(self, message: ChatMessage) -> None:
+        # 旧格式的记录没有 seq，按顺序补上
+        if not message.seq:
+            message = replace(message, seq=self.next_seq)
+        self.messages.append(message)
+        self.next_seq = max(self.next_seq, message.seq + 1)
+
+    def apply(self, record: dict[str, Any]) -> None:
+        if record.get("op") != "append":
+            return
+        self.add(_message_from_dict(record))
+        limit = int(record.get("limit") or RETAIN_LIMIT)
+        if len(self.messages) > limit:
+            del self.messages[:-limit]
+
+
+def _message_from_dict(data: dict[str, Any]) -> ChatMessage:
+    return ChatMessage(
+        role=str(data.get("role") or "user"),
+        content=str(data.get("content") or ""),
+        truncated=bool(data.get("truncated")),
+        seq=int(data.get("seq") or 0),
+    )
+
+
+def _decode_items(raws: list[Any]) -> list[ChatMessage]:
+    result: list[ChatMessage] = []
+    for raw in raws:
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            continue
+        result.append(_message_from_dict(data))
+    return result
+
+
+def _store_path(value: str, scheme: str) -> Path:
+    raw = value[len(scheme):]
+    if not raw.strip("/"):
+        raise ValueError(f"聊天存储地址缺少文件路径：{value}")
+    if raw.startswith("///"):
+        return Path(raw[2:])
+    path = Path(raw.lstrip("/"))
+    if not path.is_absolute():
+        path = Path(__file__).resolve().parents[1] / path
+    return path
+
+
+def open_chat_store(url: str) -> ChatStore:
+    value = (url or "log:data/chat").strip()
+    if value == "memory":
+        return MemoryChatStore()
+    if value.startswith("sqlite:"):
+        return SqliteChatStore(_store_path(value, "sqlite:"))
+    if value.startswith("log:"):
+        return LogChatStore(_store_path(value, "log:"))
+    if value.startswith(("redis://", "rediss://", "unix://")):
+        return RedisChatStore(value)
+    raise ValueError(f"不支持的聊天存储地址：{value}")
+
+
+def _drop_shared_store(new: Any, old: Any) -> None:
+    global _shared_store
+    if old is not None and new.server.chat_store == old.server.chat_store:
+        return
+    with _shared_lock:
+        store, _shared_store = _shared_store, None
+    if store is not None:
+        store.close()
+    _logger.info("聊天存储配置已变更，将在下次使用时重建")
+
+
+def get_chat_store() -> ChatStore:
+    global _shared_store, _shared_subscribed
+    url = get_server_config().chat_store
+    with _shared_lock:
+        if not _shared_subscribed:
+            subscribe(_drop_shared_store)
+            _shared_subscribed = True
+        if _shared_store is None:
+            _shared_store = open_chat_store(url)
+        return _shared_store
+
+
+def close_chat_store() -> None:
+    global _shared_store
+    with _shared_lock:
+        store, _shared_store = _shared_store, None
+    if store is not None:
+        store.close()
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+from config.log import get_logger
+
+_logger = get_logger(__name__)
+
+# 小说设定（story.json / advanced.json）读成固定顺序、固定格式的一段文本，
+# 同一本书每次拼出来逐字相同，才能作为可缓存的提示词前缀。
+
+_FIELD_LABELS = (
+    ("background", "故事背景"),
+    ("mainline", "主线"),
+    ("darkline", "暗线"),
+    ("style", "小说风格"),
+    ("core_design", "核诡设计"),
+    ("reversal", "反转设计"),
+    ("highlights", "小说亮点"),
+)
+
+_CACHE_TTL_S = 30.0
+# 两份进程内缓存都按最近使用淘汰：书越来越多、设定反复修改（每改一次就是新的 digest）时不会一直涨
+_CACHE_SIZE = 1024
+_SUMMARY_CACHE_SIZE = 256
+# 设定全文不超过这个长度就原样注入，更长的用摘要（摘要还没生成好时先用截断版）
+_SUMMARY_MIN_CHARS = 1500
+_TRUNCATE_CHARS_PER_FIELD = 300
+
+_SUMMARY_SYSTEM = (
+    "你是小说设定整理助手。\n"
+    "把用户给出的小说设定压缩成供写作助手参考的要点摘要，800字以内。\n"
+    "保留世界观规则、主要人物及关系、主线与暗线的关键节点、风格要求、核心诡计与反转。\n"
+    "按原设定的分类用【】小标题分段，只输出摘要本身。\n"
+)
+
+_cache_lock = threading.Lock()
+_cache: OrderedDict[str, tuple[float, "NovelContext"]] = OrderedDict()
+_summaries: OrderedDict[str, str] = OrderedDict()  # digest -> 摘要，内容不变摘要就不变
+_summary_pending: set[str] = set()
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="novel-summary")
+
+
+@dataclass(frozen=True)
+class NovelContext:
+    novel_id: str
+    fields: tuple[tuple[str, str], ...]
+    digest: str
+
+    def is_empty(self) -> bool:
+        return not any(value.strip() for _, value in self.fields)
+
+    def get(self, name: str) -> str:
+        return dict(self.fields).get(name, "")
+
+
+def _digest(fields: tuple[tuple[str, str], ...]) -> str:
+    raw = json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def make_context(novel_id: str, values: dict[str, str]) -> NovelContext:
+    fields = tuple((name, (values.get(name) or "").strip()) for name, _ in _FIELD_LABELS)
+    return NovelContext(novel_id=novel_id, fields=fields, digest=_digest(fields))
+
+
+def field_label(name: str) -> str:
+    return dict(_FIELD_LABELS).get(name, name)
+
+
+def is_abridged(ctx: NovelContext) -> bool:
+    # 设定全文超长时提示词里只有摘要或截断版，这时才需要按问题检索原文片段
+    return len(render_context(ctx)) > _SUMMARY_MIN_CHARS
+
+
+def render_context(ctx: NovelContext, *, max_chars_per_field: int = 0) -> str:
+    labels = dict(_FIELD_LABELS)
+    blocks: list[str] = []
+    for name, value in ctx.fields:
+        if not value:
+            continue
+        if max_chars_per_field and len(value) > max_chars_per_field:
+            value = value[:max_chars_per_field] + "……"
+        blocks.append(f"【{labels[name]}】\n{value}")
+    if not blocks:
+        return ""
+    return "以下是当前小说的设定，回答时保持一致：\n" + "\n\n".join(blocks)
+
+
+def load_novel_context(novel_id: str) -> Optional[NovelContext]:
+    novel_id = (novel_id or "").strip()
+    if not novel_id:
+        return None
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(novel_id)
+        if hit is not None:
+            _cache.move_to_end(novel_id)
+    if hit is not None and now - hit[0] < _CACHE_TTL_S:
+        return hit[1]
+
+    from storage.novels import read_advanced, read_story
+    from storage.oss_storage import get_shared_storage
+
+    try:
+        oss = get_shared_storage()
+        values = {**read_story(oss, novel_id), **read_advanced(oss, novel_id)}
+    except Exception:
+        _logger.exception("读取小说设定失败 (novel_id=%s)", novel_id)
+        return hit[1] if hit is not None else None
+    ctx = make_context(novel_id, values)
+    with _cache_lock:
+        _cache[novel_id] = (now, ctx)
+        _cache.move_to_end(novel_id)
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return ctx
+
+
+def invalidate_novel_context(novel_id: str) -> None:
+    with _cache_lock:
+        _cache.pop(novel_id, None)
+
+
+def _remember_summary(digest: str, summary: str) -> None:
+    with _cache_lock:
+        _summaries[digest] = summary
+        _summaries.move_to_end(digest)
+        while len(_summaries) > _SUMMARY_CACHE_SIZE:
+            _summaries.popitem(last=False)
+
+
+def _stored_summary(ctx: NovelContext) -> Optional[str]:
+    with _cache_lock:
+        summary = _summaries.get(ctx.digest)
+        if summary is not None:
+            _summaries.move_to_end(ctx.digest)
+            return summary
+
+    from storage.novels import summary_key
+    from storage.oss_storage import get_shared_storage
+
+    try:
+        data = get_shared_storage().get_json(summary_key(ctx.novel_id))
+    except Exception:
+        _logger.exception("读取小说摘要失败 (novel_id=%s)", ctx.novel_id)
+        return None
+    if isinstance(data, dict) and data.get("digest") == ctx.digest and data.get("summary"):
+        summary = str(data["summary"])
+        _remember_summary(ctx.digest, summary)
+        return summary
+    return None
+
+
+def _generate_summary(ctx: NovelContext) -> None:
+    from llm.router import get_shared_router
+    from novel_gen.prompt import build_messages
+    from storage.novels import summary_key
+    from storage.oss_storage import get_shared_storage
+
+    try:
+        text = get_shared_router().chat_messages(
+            build_messages(system=_SUMMARY_SYSTEM, user=render_context(ctx)), profile="summary"
+        )
+        summary = (text or "").strip()
+        if not summary:
+            _logger.warning("小说摘要为空 (novel_id=%s)", ctx.novel_id)
+            return
+        now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        get_shared_storage().put_json(
+            summary_key(ctx.novel_id),
+            {"digest": ctx.digest, "summary": summary, "created_at": now},
+        )
+        _remember_summary(ctx.digest, summary)
+        _logger.info("小说摘要已生成 (novel_id=%s, chars=%s)", ctx.novel_id, len(summary))
+    except Exception:
+        _logger.exception("生成小说摘要失败 (novel_id=%s)", ctx.novel_id)
+    finally:
+        with _cache_lock:
+            _summary_pending.discard(ctx.digest)
+
+
+def _schedule_summary(ctx: NovelContext) -> None:
+    # 同一份内容只生成一次；生成期间的请求先用截断版
+    with _cache_lock:
+        if ctx.digest in _summary_pending or ctx.digest in _summaries:
+            return
+        _summary_pending.add(ctx.digest)
+    _summary_pool.submit(_generate_summary, ctx)
+
+
+def _refresh_summary(novel_id: str) -> None:
+    ctx = load_novel_context(novel_id)
+    if ctx is None or len(render_context(ctx)) <= _SUMMARY_MIN_CHARS:
+        return
+    if _stored_summary(ctx) is None:
+        _schedule_summary(ctx)
+
+
+def refresh_summary(novel_id: str) -> None:
+    # 保存设定后调用：丢掉旧的设定缓存，后台按新内容哈希检查摘要，变了才重新生成
+    invalidate_novel_context(novel_id)
+    _summary_pool.submit(_refresh_summary, novel_id)
+
+
+def context_for_prompt(novel_id: str) -> str:
+    ctx = load_novel_context(novel_id)
+    if ctx is None or ctx.is_empty():
+        return ""
+    full = render_context(ctx)
+    if len(full) <= _SUMMARY_MIN_CHARS:
+        return full
+    summary = None if ctx.digest in _summary_pending else _stored_summary(ctx)
+    if summary:
+        return f"以下是当前小说的设定摘要，回答时保持一致：\n{summary}"
+    _schedule_summary(ctx)
+    return render_context(ctx, max_chars_per_field=_TRUNCATE_CHARS_PER_FIELD)
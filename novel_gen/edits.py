@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import difflib
+import re
+from dataclasses import dataclass
+from typing import Any
+
+# 增量修改：长文本优化时模型不再重写全文，只输出锚定在原文片段上的修改操作，
+# 本地校验后应用到原文。锚点（find）必须从原文逐字复制且只出现一次，
+# 任何一条对不上就整体放弃，由调用方改走全文重写。
+
+EDIT_OPS = ("replace", "insert_before", "insert_after", "delete")
+MAX_EDITS = 50
+
+_CLAUSE_RE = re.compile(r"[^。！？!?；;，,\n]*[。！？!?；;，,\n]?")
+
+
+class EditError(ValueError):
+    def __init__(self, reason: str, message: str) -> None:
+        super().__init__(message)
+        self.reason = reason  # 用作指标标签：parse / invalid / not_found / ambiguous / overlap
+
+
+@dataclass(frozen=True)
+class Edit:
+    op: str
+    find: str
+    text: str
+
+
+@dataclass(frozen=True)
+class _Span:
+    start: int  # 原文中被替换/删除区间的起止；纯插入时 start == end
+    end: int
+    text: str
+
+
+def parse_edits(data: Any) -> list[Edit]:
+    items = data.get("edits") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        raise EditError("parse", "模型没有返回可解析的修改列表")
+    if len(items) > MAX_EDITS:
+        raise EditError("invalid", f"修改条数过多：{len(items)}")
+    edits: list[Edit] = []
+    for i, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            raise EditError("invalid", f"第{i}条修改格式不对")
+        op = str(item.get("op") or "replace").strip()
+        find = str(item.get("find") or "")
+        text = str(item.get("text") or "")
+        if op not in EDIT_OPS:
+            raise EditError("invalid", f"第{i}条修改的操作不支持：{op}")
+        if not find.strip():
+            raise EditError("invalid", f"第{i}条修改缺少锚点")
+        if op.startswith("insert") and not text:
+            raise EditError("invalid", f"第{i}条插入内容为空")
+        edits.append(Edit(op=op, find=find, text=text))
+    return edits
+
+
+def _locate(original: str, find: str, index: int) -> tuple[int, int]:
+    pos = original.find(find)
+    if pos < 0:
+        # 模型常在锚点首尾多带或少带空白，去掉再找一次
+        find = find.strip()
+        pos = original.find(find)
+    if pos < 0:
+        raise EditError("not_found", f"第{index}条修改的锚点在原文中找不到")
+    if original.find(find, pos + 1) >= 0:
+        raise EditError("ambiguous", f"第{index}条修改的锚点在原文中出现多次")
+    return pos, pos + len(find)
+
+
+def _spans(original: str, edits: list[Edit]) -> list[_Span]:
+    spans: list[_Span] = []
+    for i, edit in enumerate(edits, 1):
+        start, end = _locate(original, edit.find, i)
+        if edit.op == "insert_before":
+            spans.append(_Span(start, start, edit.text))
+        elif edit.op == "insert_after":
+            spans.append(_Span(end, end, edit.text))
+        elif edit.op == "delete":
+            spans.append(_Span(start, end, ""))
+        else:
+            spans.append(_Span(start, end, edit.text))
+    spans.sort(key=lambda s: (s.start, s.end))
+    for prev, cur in zip(spans, spans[1:]):
+        if cur.start < prev.end:
+            raise EditError("overlap", "修改之间有重叠")
+    return spans
+
+
+def apply_edits(original: str, edits: list[Edit]) -> tuple[str, list[dict[str, str]]]:
+    # 返回 (修改后的全文, 差异片段)；equal+insert 拼起来是新文本，equal+delete 拼起来是原文
+    spans = _spans(original, edits)
+    parts: list[str] = []
+    diff: list[dict[str, str]] = []
+    cursor = 0
+    for span in spans:
+        if span.start > cursor:
+            parts.append(original[cursor : span.start])
+            diff.append({"op": "equal", "text": original[cursor : span.start]})
+        if span.end > span.start:
+            diff.append({"op": "delete", "text": original[span.start : span.end]})
+        if span.text:
+            parts.append(span.text)
+            diff.append({"op": "insert", "text": span.text})
+        cursor = span.end
+    if cursor < len(original):
+        parts.append(original[cursor:])
+        diff.append({"op": "equal", "text": original[cursor:]})
+    return "".join(parts), diff
+
+
+def diff_segments(original: str, revised: str) -> list[dict[str, str]]:
+    # 全文重写时用：按分句比对（逐字比对长文本太慢，也不好读），格式同 apply_edits
+    a = [c for c in _CLAUSE_RE.findall(original) if c]
+    b = [c for c in _CLAUSE_RE.findall(revised) if c]
+    diff: list[dict[str, str]] = []
+
+    def add(op: str, text: str) -> None:
+        if not text:
+            return
+        if diff and diff[-1]["op"] == op:
+            diff[-1]["text"] += text
+        else:
+            diff.append({"op": op, "text": text})
+
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            add("equal", "".join(a[i1:i2]))
+            continue
+        add("delete", "".join(a[i1:i2]))
+        add("insert", "".join(b[j1:j2]))
+    return diff
@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from config.loader import JobsConfig, get_jobs_config, subscribe
+from config.log import get_logger
+from config.metrics import inc, observe, register_collector
+
+_logger = get_logger(__name__)
+
+# 耗时的生成任务（优化、批量取名、章节生成……）不在 HTTP 请求里同步跑：
+# 提交后立即返回任务 id，由进程内有界线程池执行；
+# 进度以事件序列记录，SSE 断线重连时按 Last-Event-ID 补发。
+# 任务状态和结果落到 OSS 的 jobs/{id}.json，连接断了、换了 worker、进程重启都能查到结果。
+
+JOB_STATES = ("queued", "running", "succeeded", "failed", "cancelled")
+TERMINAL_STATES = frozenset(("succeeded", "failed", "cancelled"))
+
+_MAX_EVENTS = 200
+_PERSIST_INTERVAL_S = 2.0
+
+JobFunc = Callable[["Job", dict[str, Any]], Any]
+
+_kinds: dict[str, JobFunc] = {}
+_jobs: dict[str, "Job"] = {}
+_jobs_lock = threading.Lock()
+
+_pool_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_cfg: Optional[JobsConfig] = None
+_subscribed = False
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueueFull(Exception):
+    def __init__(self, *, retry_after: int) -> None:
+        super().__init__(f"任务队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+class UnknownJobKind(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class JobEvent:
+    seq: int
+    type: str
+    data: dict[str, Any]
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def job_key(job_id: str) -> str:
+    return f"jobs/{job_id}.json"
+
+
+class Job:
+    def __init__(self, kind: str, params: dict[str, Any], *, owner: str = "") -> None:
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.owner = owner
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = ""
+        self.result: Any = None
+        self.error = ""
+        self.created_at = _now_iso()
+        self.updated_at = self.created_at
+        self.seq = 0
+        self.terminal_seq = 0  # 终态事件的序号，SSE 续传时据此判断是否已经推送完
+        self.events: deque[JobEvent] = deque(maxlen=_MAX_EVENTS)
+        self.finished_at: Optional[float] = None
+        self.future: Optional[Future[None]] = None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._persisted_at = 0.0
+
+    # ---- 给任务函数用的接口 ----
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self) -> None:
+        # 任务函数在每个步骤之间调用；正在进行的单次模型调用无法中断，只能在步骤边界停下
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def report(self, progress: Optional[float] = None, message: str = "", **data: Any) -> None:
+        with self._lock:
+            if progress is not None:
+                self.progress = min(1.0, max(0.0, float(progress)))
+            if message:
+                self.message = message
+            payload = {"progress": self.progress, "message": self.message, **data}
+        self.emit("progress", payload)
+        if time.monotonic() - self._persisted_at >= _PERSIST_INTERVAL_S:
+            _persist(self)
+
+    def emit(self, type: str, data: dict[str, Any]) -> JobEvent:
+        with self._lock:
+            self.seq += 1
+            self.updated_at = _now_iso()
+            event = JobEvent(self.seq, type, data)
+            self.events.append(event)
+            if type == "status" and data.get("status") in TERMINAL_STATES:
+                self.terminal_seq = self.seq
+        return event
+
+    # ---- 状态读取 ----
+
+    def events_after(self, seq: int) -> tuple[list[JobEvent], bool]:
+        # 返回 (事件, 是否有缺口)：断线太久、早期事件已被挤出缓冲区时调用方先补一条状态快照
+        with self._lock:
+            events = [e for e in self.events if e.seq > seq]
+            gap = bool(self.events) and seq < self.events[0].seq - 1
+        return events, gap
+
+    def to_dict(self, *, include_result: bool = True) -> dict[str, Any]:
+        with self._lock:
+            data = {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "progress": self.progress,
+                "message": self.message,
+                "error": self.error,
+                "seq": self.seq,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+            }
+            if include_result:
+                data["result"] = self.result
+        return data
+
+    def status_event(self) -> dict[str, Any]:
+        data = self.to_dict(include_result=self.status == "succeeded")
+        keys = ("status", "progress", "message", "error", "result")
+        return {k: data[k] for k in keys if k in data}
+
+    def _set_status(self, status: str) -> None:
+        with self._lock:
+            self.status = status
+            if status in TERMINAL_STATES:
+                self.finished_at = time.monotonic()
+                if status == "succeeded":
+                    self.progress = 1.0
+        self.emit("status", self.status_event())
+        _persist(self)
+
+
+def register_job_kind(kind: str, func: JobFunc) -> None:
+    _kinds[kind] = func
+
+
+def _persist(job: Job) -> None:
+    from storage.oss_storage import get_shared_storage
+
+    job._persisted_at = time.monotonic()
+    try:
+        get_shared_storage().put_json(job_key(job.id), {**job.to_dict(), "owner": job.owner})
+    except Exception:
+        _logger.exception("任务状态写入失败 (job_id=%s)", job.id)
+
+
+def _drop_pool(new: Any, old: Any) -> None:
+    global _pool
+    if old is not None and new.jobs == old.jobs:
+        return
+    with _pool_lock:
+        stale, _pool = _pool, None
+    if stale is not None:
+        # 旧池里排队和在跑的任务照常跑完，新任务进新池
+        stale.shutdown(wait=False)
+    _logger.info("任务配置已变更，任务线程池将在下次提交时重建")
+
+
+def _get_pool() -> tuple[ThreadPoolExecutor, JobsConfig]:
+    global _pool, _pool_cfg, _subscribed
+    cfg = get_jobs_config()
+    with _pool_lock:
+        if not _subscribed:
+            subscribe(_drop_pool)
+            register_collector(_collect)
+            _subscribed = True
+        if _pool is None or _pool_cfg != cfg:
+            _pool = ThreadPoolExecutor(max_workers=cfg.workers, thread_name_prefix="novel-job")
+            _pool_cfg = cfg
+        return _pool, cfg
+
+
+def _prune(cfg: JobsConfig) -> None:
+    now = time.monotonic()
+    with _jobs_lock:
+        expired = [
+            job_id
+            for job_id, job in _jobs.items()
+            if job.finished_at is not None and now - job.finished_at > cfg.retention_s
+        ]
+        for job_id in expired:
+            del _jobs[job_id]
+
+
+def _run(job: Job) -> None:
+    func = _kinds[job.kind]
+    if job.cancelled:
+        # 取消请求和出队撞在一起：future 已经拿不回来，由这里收尾
+        job._set_status("cancelled")
+        inc("jobs_total", kind=job.kind, status="cancelled")
+        return
+    started = time.perf_counter()
+    job._set_status("running")
+    outcome: Future[Any] = Future()
+    try:
+        result = func(job, job.params)
+    except Exception as exc:
+        outcome.set_exception(exc)
+    else:
+        if isinstance(result, Future):
+            # 等外部结果的任务（Batch 等）返回 Future 交出工作线程，结果到了再收尾；
+            # 取消由产生结果的一方检查 job.cancelled 后以 JobCancelled 结束
+            result.add_done_callback(lambda f: _finish(job, f, started))
+            return
+        outcome.set_result(result)
+    _finish(job, outcome, started)
+
+
+def _finish(job: Job, outcome: Future[Any], started: float) -> None:
+    try:
+        job.result = outcome.result()
+        job.check_cancelled()
+        status = "succeeded"
+    except JobCancelled:
+        status = "cancelled"
+    except Exception as exc:
+        _logger.exception("任务执行失败 (job_id=%s, kind=%s)", job.id, job.kind)
+        job.error = str(exc) or type(exc).__name__
+        status = "failed"
+    job._set_status(status)
+    inc("jobs_total", kind=job.kind, status=status)
+    observe("jobs_duration_seconds", time.perf_counter() - started, kind=job.kind)
+
+
+def submit_job(kind: str, params: Optional[dict[str, Any]] = None, *, owner: str = "") -> Job:
+    if kind not in _kinds:
+        raise UnknownJobKind(f"未知的任务类型：{kind}")
+    pool, cfg = _get_pool()
+    _prune(cfg)
+    with _jobs_lock:
+        queued = sum(1 for job in _jobs.values() if job.status == "queued")
+        if queued >= cfg.max_queue:
+            inc("jobs_rejected_total", kind=kind)
+            raise JobQueueFull(retry_after=max(1, queued // cfg.workers))
+        job = Job(kind, dict(params or {}), owner=owner)
+        _jobs[job.id] = job
+    job.emit("status", job.status_event())
+    _persist(job)
+    job.future = pool.submit(_run, job)
+    return job
+
+
+def get_job(job_id: str, *, owner: Optional[str] = None) -> Optional[Job]:
+    # 传了 owner 时只返回该会话提交的任务，别人的任务一律当作不存在
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None or (owner is not None and job.owner != owner):
+        return None
+    return job
+
+
+def load_job(job_id: str, *, owner: Optional[str] = None) -> Optional[dict[str, Any]]:
+    # 本进程的任务直接读内存；其他 worker 提交的或已过保留期的读 OSS 上的记录
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        return job.to_dict() if owner is None or job.owner == owner else None
+
+    from storage.oss_storage import get_shared_storage
+
+    try:
+        data = get_shared_storage().get_json(job_key(job_id))
+    except Exception:
+        _logger.exception("任务记录读取失败 (job_id=%s)", job_id)
+        return None
+    if not isinstance(data, dict):
+        return None
+    if owner is not None and data.get("owner", "") != owner:
+        return None
+    data.pop("owner", None)
+    return data
+
+
+def cancel_job(job_id: str, *, owner: Optional[str] = None) -> Optional[Job]:
+    job = get_job(job_id, owner=owner)
+    if job is None:
+        return None
+    if job.status in TERMINAL_STATES:
+        return job
+    job._cancel.set()
+    if job.future is not None and job.future.cancel():
+        # 还没开始跑的直接出队
+        job._set_status("cancelled")
+        inc("jobs_total", kind=job.kind, status="cancelled")
+    return job
+
+
+def _collect() -> list[tuple[str, str, tuple[tuple[str, str], ...], float]]:
+    counts = {state: 0 for state in ("queued", "running")}
+    with _jobs_lock:
+        for job in _jobs.values():
+            if job.status in counts:
+                counts[job.status] += 1
+    return [("jobs_in_progress", "gauge", (("status", s),), float(n)) for s, n in counts.items()]
+
+
+# ---- 内置任务类型 ----
+
+
+def _optimize_job(job: Job, params: dict[str, Any]) -> dict[str, Any]:
+    from novel_gen import optimize_detailed
+
+    job.report(0.0, "正在优化")
+    return optimize_detailed(
+        original=str(params.get("original") or ""),
+        instruction=str(params.get("instruction") or ""),
+        field=str(params.get("field") or ""),
+        novel_id=str(params.get("novel_id") or ""),
+        mode=str(params.get("mode") or "auto"),
+    )
+
+
+def _naming_job(job: Job, params: dict[str, Any]) -> dict[str, Any]:
+    from novel_gen.naming import generate_name
+
+    count = min(20, max(1, int(params.get("count") or 1)))
+    names: list[str] = []
+    for i in range(count):
+        job.check_cancelled()
+        name = generate_name(
+            gender=str(params.get("gender") or "男"),
+            style=str(params.get("style") or "仙侠"),
+            description=str(params.get("description") or ""),
+        )
+        if name and name not in names:
+            names.append(name)
+        job.report((i + 1) / count, f"已生成 {i + 1}/{count}", name=name or "")
+    return {"names": names}
+
+
+def _chapters_job(job: Job, params: dict[str, Any]) -> dict[str, Any]:
+    from novel_gen.chapters import generate_chapters
+
+    novel_id = str(params.get("novel_id") or "").strip()
+    if not novel_id:
+        raise ValueError("缺少 novel_id")
+    return generate_chapters(
+        novel_id,
+        chapters=int(params.get("chapters") or 10),
+        concurrency=int(params.get("concurrency") or 3),
+        chapter_chars=int(params.get("chapter_chars") or 2000),
+        restart=bool(params.get("restart")),
+        job=job,
+    )
+
+
+def _batch_job(job: Job, params: dict[str, Any]) -> Future[dict[str, Any]]:
+    # 工作线程里只做整理和提交；等结果交给 novel_gen.batch 的轮询线程，不占任务线程池
+    from novel_gen.batch import start_batch, watch_batch
+
+    record_id = str(params.get("record_id") or "").strip()
+    if record_id:
+        return watch_batch(record_id, job=job)
+    return start_batch(params, job=job)
+
+
+register_job_kind("optimize", _optimize_job)
+register_job_kind("naming", _naming_job)
+register_job_kind("chapters", _chapters_job)
+register_job_kind("batch", _batch_job)
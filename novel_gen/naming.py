@@ -1,39 +1,38 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import Any, Optional
 
 from config.log import get_logger
 from llm.qwen_client import QwenClient, extract_json_from_text
+from llm.router import get_shared_router
+from novel_gen.prompt import build_messages, labeled
 
 _logger = get_logger(__name__)
 
+_NAMING_SYSTEM = (
+    "你是中文小说取名助手。\n"
+    "根据用户给出的小说风格、性别和名字说明生成1个名字，要求：\n"
+    "1) 更像人名，可带少量姓氏，不要生僻到难读\n"
+    "2) 贴合风格与说明（如果有说明）\n"
+    "3) 只输出JSON，不要输出任何多余文本\n"
+    'JSON格式：{"name":"..."}\n'
+)
 
-def generate_name(
-    *,
-    gender: str = "男",
-    style: str = "仙侠",
-    description: str = "",
-    client: Optional[QwenClient] = None,
-) -> Optional[str]:
-    resolved_description = (description or "").strip()
-    resolved_gender = (gender or "男").strip()
-    resolved_style = (style or "仙侠").strip()
-
-    prompt = (
-        "你是中文小说取名助手。\n"
-        f"小说风格：{resolved_style}\n"
-        f"性别：{resolved_gender}\n"
-        f"名字说明：{resolved_description if resolved_description else '无'}\n"
-        "\n"
-        "请生成1个名字，要求：\n"
-        "1) 更像人名，可带少量姓氏，不要生僻到难读\n"
-        "2) 贴合风格与说明（如果有说明）\n"
-        "3) 只输出JSON，不要输出任何多余文本\n"
-        'JSON格式：{"name":"..."}\n'
+
+def naming_messages(
+    *, gender: str = "男", style: str = "仙侠", description: str = ""
+) -> list[dict[str, Any]]:
+    return build_messages(
+        system=_NAMING_SYSTEM,
+        user=labeled(
+            ("小说风格", (style or "仙侠").strip()),
+            ("性别", (gender or "男").strip()),
+            ("名字说明", (description or "").strip()),
+        ),
     )
 
-    llm = client or QwenClient()
-    text = llm.chat(prompt)
+
+def parse_name(text: Optional[str]) -> Optional[str]:
     data = extract_json_from_text(text)
     if not data:
         _logger.warning("取名结果无法解析为JSON: %s", text)
@@ -46,6 +45,18 @@ def generate_name(
     return name.strip()
 
 
+def generate_name(
+    *,
+    gender: str = "男",
+    style: str = "仙侠",
+    description: str = "",
+    client: Optional[QwenClient] = None,
+) -> Optional[str]:
+    messages = naming_messages(gender=gender, style=style, description=description)
+    llm = client or get_shared_router()
+    return parse_name(llm.chat_messages(messages, profile="naming"))
+
+
 if __name__ == "__main__":
     name = generate_name(
         gender="男",
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from typing import Any, Iterable
+
+from llm.qwen_client import cache_hint
+
+# 提示词统一按“稳定在前、易变在后”组装，才能命中服务端的前缀缓存：
+#   系统提示（固定）→ 小说设定（同一本书不变）→ 历史对话（只追加）→ 本轮输入
+# 任何随请求变化的内容（字段名、原文、用户要求）都只出现在最后一条 user 消息里。
+
+
+def build_messages(
+    *,
+    system: str,
+    user: str,
+    context: str = "",
+    history: Iterable[dict[str, Any]] = (),
+) -> list[dict[str, Any]]:
+    prefix = system.rstrip("\n")
+    if context:
+        prefix = f"{prefix}\n\n{context}"
+    messages: list[dict[str, Any]] = [{"role": "system", "content": [cache_hint(prefix)]}]
+
+    past = [
+        {"role": m["role"] if m.get("role") in ("user", "assistant") else "user",
+         "content": str(m.get("content") or "")}
+        for m in history
+    ]
+    if past:
+        # 历史只会在末尾追加，最后一条历史也是下一轮的前缀边界
+        last = past[-1]
+        past[-1] = {"role": last["role"], "content": [cache_hint(last["content"])]}
+    messages.extend(past)
+    messages.append({"role": "user", "content": user})
+    return messages
+
+
+def labeled(*items: tuple[str, str], empty: str = "无") -> str:
+    # 易变内容统一渲染成“标签：\n内容”，空值显示占位，格式稳定便于模型理解
+    return "\n".join(f"{label}：\n{(value or '').strip() or empty}" for label, value in items)
@@ -0,0 +1,542 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from config.loader import RetrievalConfig, get_retrieval_config, subscribe
+from config.log import get_logger
+from config.metrics import inc, observe
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境：只有进程内锁
+    fcntl = None  # type: ignore[assignment]
+
+_logger = get_logger(__name__)
+
+# 检索式上下文：小说设定和历史对话切成小段、算向量后存成本地文件，
+# 每轮聊天只把与问题最相关的几段放进提示词，而不是把设定全文和全部历史都塞进去。
+# 每个范围（一本书的一版设定 / 一个会话）一对文件：{范围}.f32 是按行排列的 float32 向量，
+# {范围}.jsonl 是逐行对应的原文；检索时用 numpy memmap 分块做余弦 top-k。
+# 没装 numpy 就整体关闭检索（逐行逐维的纯 Python 点积每轮要几百毫秒，不能放在聊天路径上）。
+# 向量都是单位长度，余弦相似度就是点积。
+
+CHUNK_CHARS = 300
+CHAT_TEXT_CHARS = 400  # 对话片段存多少字进提示词
+CHAT_EMBED_REPLY_CHARS = 200  # 算向量时回复只取开头，长回复会把问题本身的信号冲淡
+MAX_CHAT_ROWS = 2000  # 单个会话最多保留多少段，超出后丢掉较早的一半
+_BLOCK_ROWS = 65536  # 分块计算，内存占用与向量总数无关
+_CACHE_SCOPES = 64
+
+_TOKEN_RE = re.compile("[㐀-䶿一-鿿豈-﫿]+|[0-9A-Za-z]+")
+_SENTENCE_RE = re.compile(r"(?<=[。！？!?；;])")
+_SCOPE_RE = re.compile(r"[^0-9A-Za-z_-]")
+
+_shared_lock = threading.Lock()
+_shared: Optional[tuple[RetrievalConfig, "Embedder", "VectorStore"]] = None
+_shared_subscribed = False
+_numpy_warned = False
+
+_index_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="novel-retrieval")
+_pending_lock = threading.Lock()
+_pending: set[str] = set()
+
+
+def _numpy() -> Any:
+    global _numpy_warned
+    try:
+        import numpy
+    except Exception:
+        if not _numpy_warned:
+            _numpy_warned = True
+            _logger.warning("缺少依赖：numpy，检索式上下文已关闭。请先安装：pip install numpy")
+        return None
+    return numpy
+
+
+@dataclass(frozen=True)
+class Hit:
+    source: str  # novel / chat
+    label: str
+    text: str
+    score: float
+    meta: dict[str, Any]
+
+
+def _normalize(vec: list[float]) -> list[float]:
+    norm = math.sqrt(sum(v * v for v in vec))
+    if norm == 0:
+        return vec
+    return [v / norm for v in vec]
+
+
+# ---- 向量化 ----
+
+
+class Embedder:
+    name = ""
+    dim = 0
+    local = True  # 本地计算（便宜，可以同步调用）还是远程接口
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    # 离线兜底：汉字单字和二元组、英文数字按词，哈希到固定维度（带符号，减轻冲突），
+    # 词频取对数后归一化。不懂语义，但对设定里的人名、地名、专有名词召回很准
+    def __init__(self, dim: int) -> None:
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed_one(text) for text in texts]
+
+    def _embed_one(self, text: str) -> list[float]:
+        counts: dict[str, float] = {}
+        for run in _TOKEN_RE.findall(text or ""):
+            if run.isascii():
+                word = run.lower()
+                counts[word] = counts.get(word, 0.0) + 1.0
+                continue
+            for i, char in enumerate(run):
+                counts[char] = counts.get(char, 0.0) + 0.3
+                if i + 1 < len(run):
+                    gram = run[i : i + 2]
+                    counts[gram] = counts.get(gram, 0.0) + 1.0
+        vec = [0.0] * self.dim
+        for feature, tf in counts.items():
+            h = zlib.crc32(feature.encode("utf-8"))
+            sign = -1.0 if h & 0x80000000 else 1.0
+            weight = 1.0 + math.log(tf) if tf >= 1 else tf
+            vec[h % self.dim] += sign * weight
+        return _normalize(vec)
+
+
+class OpenAIEmbedder(Embedder):
+    local = False
+    _BATCH = 10  # DashScope text-embedding-v3 单次最多 10 条
+
+    def __init__(self, model: str, dim: int) -> None:
+        from config.loader import get_base_config
+
+        try:
+            from openai import OpenAI
+        except Exception as exc:
+            raise RuntimeError("缺少依赖：openai。请先安装：pip install openai") from exc
+
+        cfg = get_base_config()
+        self.model = model
+        self.dim = dim
+        self.name = f"openai-{model}-{dim}"
+        self.client = OpenAI(api_key=cfg.api_key, base_url=cfg.base_url, max_retries=2)
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        result: list[list[float]] = []
+        for i in range(0, len(texts), self._BATCH):
+            started = time.perf_counter()
+            resp = self.client.embeddings.create(
+                model=self.model, input=texts[i : i + self._BATCH], dimensions=self.dim
+            )
+            observe("embedding_request_seconds", time.perf_counter() - started)
+            items = sorted(resp.data, key=lambda d: d.index)
+            result.extend(_normalize([float(v) for v in d.embedding]) for d in items)
+        return result
+
+
+EmbedderFactory = Callable[[RetrievalConfig], Embedder]
+
+_embedders: dict[str, EmbedderFactory] = {
+    "hashing": lambda cfg: HashingEmbedder(cfg.dim),
+    "openai": lambda cfg: OpenAIEmbedder(cfg.model, cfg.dim),
+}
+
+
+def register_embedder(name: str, factory: EmbedderFactory) -> None:
+    _embedders[name] = factory
+
+
+# ---- 向量文件 ----
+
+
+@dataclass
+class _Loaded:
+    stamp: tuple[int, int]  # (文件大小, 修改时间)，变了就重新加载
+    rows: int
+    metas: list[dict[str, Any]]
+    matrix: Any  # numpy.memmap
+
+
+def _split_rows(raw: bytes, row_bytes: int) -> list[list[float]]:
+    return [list(array("f", raw[i : i + row_bytes])) for i in range(0, len(raw), row_bytes)]
+
+
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    # 同机多个 worker 往同一个会话文件追加时互斥
+    with open(path.with_name(path.name + ".lock"), "a") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class VectorStore:
+    def __init__(self, root: str | Path, *, dim: int) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[str, _Loaded] = OrderedDict()
+
+    def _paths(self, scope: str) -> tuple[Path, Path]:
+        return self.root / f"{scope}.f32", self.root / f"{scope}.jsonl"
+
+    def exists(self, scope: str) -> bool:
+        return self._paths(scope)[1].exists()
+
+    def write(self, scope: str, vectors: list[list[float]], metas: list[dict[str, Any]]) -> None:
+        # 整体写入：先写临时文件再替换，原文最后落盘，读到原文文件就说明向量已经完整
+        vec_path, meta_path = self._paths(scope)
+        tmp = f".tmp-{os.getpid()}-{threading.get_ident()}"
+        vec_tmp = vec_path.with_name(vec_path.name + tmp)
+        meta_tmp = meta_path.with_name(meta_path.name + tmp)
+        vec_tmp.write_bytes(b"".join(array("f", v).tobytes() for v in vectors))
+        meta_tmp.write_text(
+            "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in metas), encoding="utf-8"
+        )
+        os.replace(vec_tmp, vec_path)
+        os.replace(meta_tmp, meta_path)
+
+    def append(
+        self, scope: str, vectors: list[list[float]], metas: list[dict[str, Any]]
+    ) -> None:
+        vec_path, meta_path = self._paths(scope)
+        row_bytes = self.dim * 4
+        with self._lock, _file_lock(meta_path):
+            old_metas = self._read_metas(meta_path)
+            if len(old_metas) + len(metas) > MAX_CHAT_ROWS:
+                dropped = len(old_metas) // 2
+                raw = vec_path.read_bytes()[dropped * row_bytes : len(old_metas) * row_bytes]
+                kept = _split_rows(raw, row_bytes)
+                self.write(scope, kept + vectors, old_metas[dropped:] + metas)
+                return
+            with open(vec_path, "ab") as fh:
+                # 上次写了向量没写原文（进程崩溃）时先截掉多出来的行，保持逐行对应
+                fh.truncate(len(old_metas) * row_bytes)
+                fh.write(b"".join(array("f", v).tobytes() for v in vectors))
+            with open(meta_path, "a", encoding="utf-8") as fh:
+                fh.write("".join(json.dumps(m, ensure_ascii=False) + "\n" for m in metas))
+
+    def delete(self, scope: str) -> None:
+        vec_path, meta_path = self._paths(scope)
+        for path in (vec_path, meta_path, meta_path.with_name(meta_path.name + ".lock")):
+            path.unlink(missing_ok=True)
+        with self._lock:
+            self._cache.pop(scope, None)
+
+    def delete_prefix(self, prefix: str, *, keep: str = "") -> None:
+        for path in self.root.glob(f"{prefix}*.jsonl"):
+            scope = path.name[: -len(".jsonl")]
+            if scope != keep:
+                self.delete(scope)
+
+    @staticmethod
+    def _read_metas(path: Path) -> list[dict[str, Any]]:
+        try:
+            lines = path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return []
+        metas: list[dict[str, Any]] = []
+        for line in lines:
+            try:
+                metas.append(json.loads(line))
+            except ValueError:
+                break  # 写了一半的最后一行
+        return metas
+
+    def _load(self, scope: str) -> Optional[_Loaded]:
+        vec_path, meta_path = self._paths(scope)
+        try:
+            stat = vec_path.stat()
+        except FileNotFoundError:
+            return None
+        size = stat.st_size
+        stamp = (size, stat.st_mtime_ns)
+        with self._lock:
+            loaded = self._cache.get(scope)
+            if loaded is not None and loaded.stamp == stamp:
+                self._cache.move_to_end(scope)
+                return loaded
+        metas = self._read_metas(meta_path)
+        rows = min(size // (self.dim * 4), len(metas))
+        if rows == 0:
+            return None
+        np = _numpy()
+        if np is None:
+            return None
+        matrix = np.memmap(vec_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        loaded = _Loaded(stamp=stamp, rows=rows, metas=metas[:rows], matrix=matrix)
+        with self._lock:
+            self._cache[scope] = loaded
+            self._cache.move_to_end(scope)
+            while len(self._cache) > _CACHE_SCOPES:
+                self._cache.popitem(last=False)
+        return loaded
+
+    def search(
+        self, scope: str, query: list[float], *, k: int, min_score: float
+    ) -> list[tuple[float, dict[str, Any]]]:
+        loaded = self._load(scope)
+        if loaded is None or k <= 0:
+            return []
+        ranked = _top_k(loaded, query, k=k)
+        return [(score, loaded.metas[i]) for i, score in ranked if score >= min_score]
+
+
+def _top_k(loaded: _Loaded, query: list[float], *, k: int) -> list[tuple[int, float]]:
+    np = _numpy()
+    k = min(k, loaded.rows)
+    q = np.asarray(query, dtype=np.float32)
+    best_idx: list[Any] = []
+    best_scores: list[Any] = []
+    for start in range(0, loaded.rows, _BLOCK_ROWS):
+        scores = loaded.matrix[start : start + _BLOCK_ROWS] @ q
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        best_idx.append(top + start)
+        best_scores.append(scores[top])
+    idx = np.concatenate(best_idx)
+    scores = np.concatenate(best_scores)
+    order = np.argsort(-scores)[:k]
+    return [(int(idx[i]), float(scores[i])) for i in order]
+
+
+# ---- 共享实例 ----
+
+
+def _drop_shared(new: Any, old: Any) -> None:
+    global _shared
+    if old is not None and new.retrieval == old.retrieval:
+        return
+    with _shared_lock:
+        _shared = None
+    _logger.info("检索配置已变更，将在下次使用时重建")
+
+
+def _get_shared() -> Optional[tuple[RetrievalConfig, Embedder, VectorStore]]:
+    global _shared, _shared_subscribed
+    if not retrieval_enabled():
+        return None
+    cfg = get_retrieval_config()
+    with _shared_lock:
+        if not _shared_subscribed:
+            subscribe(_drop_shared)
+            _shared_subscribed = True
+        if _shared is None or _shared[0] != cfg:
+            factory = _embedders.get(cfg.embedder)
+            if factory is None:
+                raise ValueError(f"不支持的向量化方式：{cfg.embedder}")
+            embedder = factory(cfg)
+            root = Path(cfg.dir)
+            if not root.is_absolute():
+                root = Path(__file__).resolve().parents[1] / root
+            # 换了向量化方式或维度，向量不能混用，各用各的目录
+            _shared = (cfg, embedder, VectorStore(root / embedder.name, dim=embedder.dim))
+        return _shared
+
+
+def retrieval_enabled() -> bool:
+    cfg = get_retrieval_config()
+    return cfg.enabled and cfg.top_k > 0 and _numpy() is not None
+
+
+# ---- 切片与索引 ----
+
+
+def chunk_text(text: str, *, size: int = CHUNK_CHARS) -> list[str]:
+    # 按段落切，段落过长再按句末标点切，然后拼到接近 size；单句超长的硬切。
+    # 同一段里的句子直接相连，跨段落用换行
+    pieces: list[tuple[str, str]] = []  # (连接符, 片段)
+    for para in (text or "").splitlines():
+        para = para.strip()
+        if not para:
+            continue
+        joiner = "\n"
+        for sentence in _SENTENCE_RE.split(para) if len(para) > size else [para]:
+            for i in range(0, len(sentence), size):
+                pieces.append((joiner, sentence[i : i + size]))
+                joiner = ""
+    chunks: list[str] = []
+    current = ""
+    for joiner, piece in pieces:
+        if current and len(current) + len(joiner) + len(piece) > size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}{joiner}{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _safe(value: str) -> str:
+    return _SCOPE_RE.sub("_", value)[:64]
+
+
+def _novel_scope(novel_id: str, digest: str) -> str:
+    # 范围名带上设定内容的哈希：设定一改就是新文件，不用原地改写正在被读的文件
+    return f"novel-{_safe(novel_id)}-{digest[:16]}"
+
+
+def _chat_scope(session_id: str) -> str:
+    return f"chat-{_safe(session_id)}"
+
+
+def _build_novel_index(ctx: Any, store: VectorStore, embedder: Embedder) -> None:
+    from novel_gen.context import field_label
+
+    scope = _novel_scope(ctx.novel_id, ctx.digest)
+    texts: list[str] = []
+    metas: list[dict[str, Any]] = []
+    for name, value in ctx.fields:
+        for chunk in chunk_text(value):
+            texts.append(chunk)
+            metas.append({"field": name, "label": field_label(name), "text": chunk})
+    started = time.perf_counter()
+    vectors = embedder.embed(texts) if texts else []
+    store.write(scope, vectors, metas)
+    store.delete_prefix(f"novel-{_safe(ctx.novel_id)}-", keep=scope)
+    _logger.info(
+        "小说设定向量已更新 (novel_id=%s, chunks=%s, elapsed=%.3fs)",
+        ctx.novel_id,
+        len(texts),
+        time.perf_counter() - started,
+    )
+
+
+def _build_novel_index_async(ctx: Any, store: VectorStore, embedder: Embedder) -> None:
+    try:
+        _build_novel_index(ctx, store, embedder)
+    except Exception:
+        _logger.exception("小说设定向量化失败 (novel_id=%s)", ctx.novel_id)
+    finally:
+        with _pending_lock:
+            _pending.discard(ctx.digest)
+
+
+def _ensure_novel_index(ctx: Any, store: VectorStore, embedder: Embedder) -> bool:
+    # 本地向量化直接同步建；远程接口放后台，建好之前这本书先不参与检索
+    if store.exists(_novel_scope(ctx.novel_id, ctx.digest)):
+        return True
+    if embedder.local:
+        _build_novel_index(ctx, store, embedder)
+        return True
+    with _pending_lock:
+        if ctx.digest in _pending:
+            return False
+        _pending.add(ctx.digest)
+    _index_pool.submit(_build_novel_index_async, ctx, store, embedder)
+    return False
+
+
+def _index_chat_turn(session_id: str, user: str, reply: str) -> None:
+    try:
+        shared = _get_shared()
+        if shared is None:
+            return
+        _, embedder, store = shared
+        vectors = embedder.embed([f"{user}\n{reply[:CHAT_EMBED_REPLY_CHARS]}"])
+        text = f"用户：{user}\n助手：{reply}"
+        if len(text) > CHAT_TEXT_CHARS:
+            text = text[:CHAT_TEXT_CHARS] + "……"
+        store.append(_chat_scope(session_id), vectors, [{"user": user, "text": text}])
+    except Exception:
+        _logger.exception("对话向量化失败 (session_id=%s)", session_id)
+
+
+def index_chat_turn(session_id: str, user: str, reply: str) -> None:
+    # 每轮对话结束后在后台入库，不占聊天请求的时间
+    if retrieval_enabled() and user and reply:
+        _index_pool.submit(_index_chat_turn, session_id, user, reply)
+
+
+def forget_session(session_id: str) -> None:
+    try:
+        shared = _get_shared()
+        if shared is not None:
+            shared[2].delete(_chat_scope(session_id))
+    except Exception:
+        _logger.exception("删除对话向量失败 (session_id=%s)", session_id)
+
+
+# ---- 检索 ----
+
+
+def retrieve(
+    query: str,
+    *,
+    novel_id: str = "",
+    session_id: str = "",
+    exclude_users: frozenset[str] = frozenset(),
+) -> list[Hit]:
+    # 设定部分只在提示词里放不下全文（用的是摘要或截断版）时才检索；
+    # exclude_users 是还在历史窗口里的用户消息，对应的对话片段不重复召回
+    query = (query or "").strip()
+    try:
+        shared = _get_shared()
+    except Exception:
+        _logger.exception("检索初始化失败")
+        return []
+    if shared is None or not query:
+        return []
+    cfg, embedder, store = shared
+    started = time.perf_counter()
+    candidates: list[Hit] = []
+    try:
+        qvec = embedder.embed([query])[0]
+        if novel_id:
+            from novel_gen.context import is_abridged, load_novel_context
+
+            ctx = load_novel_context(novel_id)
+            if ctx is not None and is_abridged(ctx) and _ensure_novel_index(ctx, store, embedder):
+                scope = _novel_scope(ctx.novel_id, ctx.digest)
+                for score, meta in store.search(
+                    scope, qvec, k=cfg.top_k, min_score=cfg.min_score
+                ):
+                    candidates.append(Hit("novel", meta["label"], meta["text"], score, meta))
+        if session_id:
+            for score, meta in store.search(
+                _chat_scope(session_id),
+                qvec,
+                k=cfg.top_k + len(exclude_users),
+                min_score=cfg.min_score,
+            ):
+                if meta.get("user") in exclude_users:
+                    continue
+                candidates.append(Hit("chat", "此前对话", meta["text"], score, meta))
+    except Exception:
+        _logger.exception("检索失败 (novel_id=%s, session_id=%s)", novel_id, session_id)
+        return []
+    hits = sorted(candidates, key=lambda h: -h.score)[: cfg.top_k]
+    observe("retrieval_seconds", time.perf_counter() - started)
+    for hit in hits:
+        inc("retrieval_hits_total", source=hit.source)
+    return hits
+
+
+def render_hits(hits: list[Hit]) -> str:
+    return "\n\n".join(f"【{hit.label}】\n{hit.text}" for hit in hits)
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, TypeVar
+
+from config.metrics import inc
+
+T = TypeVar("T")
+
+# 相同参数的请求同时在飞时只真正执行一次，后到的等同一个结果（连点两下“生成优化”只花一份 token）。
+# 只合并“正在进行”的调用，结束即移除，不是缓存。
+
+
+def flight_key(*parts: Any) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future[Any]] = {}
+
+    def do(self, key: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if fut is None:
+                fut = Future()
+                self._calls[key] = fut
+        if not leader:
+            inc("singleflight_shared_total", flight=self.name)
+            return fut.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            fut.set_exception(exc)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
@@ -1 +1,20 @@
+from __future__ import annotations
 
+from typing import Any
+
+_LAZY_EXPORTS = {
+    "OssStorage": "storage.oss_storage",
+    "get_shared_storage": "storage.oss_storage",
+}
+
+
+def __getattr__(name: str) -> Any:
+    # 按需导入，避免 `import storage.xxx` 时连带加载整条 OSS 依赖链
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
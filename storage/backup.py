@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import argparse
+import base64
+import gzip
+import hashlib
+import io
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Any, Callable, Iterable, Iterator, Optional
+
+from config.log import get_logger
+from storage.oss_storage import ObjectInfo, OssStorage
+
+_logger = get_logger(__name__)
+
+ARCHIVE_FORMAT = "novelai-backup"
+# v2：每条记录带上对象的响应头，导入时原样写回
+ARCHIVE_VERSION = 2
+DEFAULT_PREFIX = "novels/"
+DEFAULT_WORKERS = 16
+
+# 导入时需要恢复的对象头：内容类型/编码等标准头，以及 x-oss-meta-*（含文档编码标记）
+_KEPT_HEADERS = {
+    "cache-control",
+    "content-disposition",
+    "content-encoding",
+    "content-language",
+    "content-type",
+}
+
+
+def _open_archive(path: Path, mode: str) -> IO[str]:
+    # .gz 后缀自动走 gzip 流式压缩，其他按纯 JSONL 处理
+    if path.suffix == ".gz":
+        return io.TextIOWrapper(gzip.open(path, mode + "b"), encoding="utf-8", newline="\n")
+    return path.open(mode, encoding="utf-8", newline="\n")
+
+
+def _md5_hex(data: bytes) -> str:
+    return hashlib.md5(data).hexdigest().upper()
+
+
+def _kept_headers(headers: dict[str, str]) -> dict[str, str]:
+    kept: dict[str, str] = {}
+    for name, value in headers.items():
+        lower = name.lower()
+        if lower in _KEPT_HEADERS or lower.startswith("x-oss-meta-"):
+            kept[lower] = value
+    return kept
+
+
+def _encode_record(info: ObjectInfo, data: bytes, headers: dict[str, str]) -> dict[str, Any]:
+    record: dict[str, Any] = {"key": info.key, "size": len(data), "md5": _md5_hex(data)}
+    kept = _kept_headers(headers)
+    if kept:
+        record["headers"] = kept
+    try:
+        record["text"] = data.decode("utf-8")
+    except UnicodeDecodeError:
+        record["b64"] = base64.b64encode(data).decode("ascii")
+    return record
+
+
+def _decode_record(record: dict[str, Any]) -> bytes:
+    if "text" in record:
+        return str(record["text"]).encode("utf-8")
+    return base64.b64decode(str(record.get("b64") or ""))
+
+
+def _bounded_map(
+    fn: Callable[[Any], Any], items: Iterable[Any], *, workers: int
+) -> Iterator[Any]:
+    # 最多同时挂起 workers*2 个任务，按提交顺序产出结果，内存占用与对象总数无关
+    window: deque[Future[Any]] = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for item in items:
+            window.append(pool.submit(fn, item))
+            if len(window) >= workers * 2:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+def export_prefix(
+    archive: str | Path,
+    *,
+    prefix: str = DEFAULT_PREFIX,
+    workers: int = DEFAULT_WORKERS,
+    oss: Optional[OssStorage] = None,
+) -> dict[str, Any]:
+    storage = oss or OssStorage()
+    path = Path(archive)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+
+    def fetch(info: ObjectInfo) -> Optional[dict[str, Any]]:
+        found = storage.get_with_headers(info.key)
+        if found is None:
+            _logger.warning("导出时对象已不存在，跳过: %s", info.key)
+            return None
+        data, headers = found
+        return _encode_record(info, data, headers)
+
+    count = 0
+    total_bytes = 0
+    with _open_archive(path, "w") as fp:
+        header = {"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION, "prefix": prefix}
+        fp.write(json.dumps(header, ensure_ascii=False) + "\n")
+        for record in _bounded_map(fetch, storage.iter_objects(prefix), workers=workers):
+            if record is None:
+                continue
+            fp.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            count += 1
+            total_bytes += int(record["size"])
+
+    elapsed = time.perf_counter() - started
+    _logger.info(
+        "导出完成 (prefix=%s, objects=%s, bytes=%s, seconds=%.2f, archive=%s)",
+        prefix,
+        count,
+        total_bytes,
+        elapsed,
+        path,
+    )
+    return {"objects": count, "bytes": total_bytes, "seconds": round(elapsed, 3)}
+
+
+def _read_header(fp: IO[str], path: Path) -> dict[str, Any]:
+    first = fp.readline()
+    header = json.loads(first) if first.strip() else {}
+    if not isinstance(header, dict) or header.get("format") != ARCHIVE_FORMAT:
+        raise ValueError(f"不是有效的备份文件：{path}")
+    if int(header.get("version") or 0) > ARCHIVE_VERSION:
+        raise ValueError(f"备份文件版本过新：{header.get('version')}")
+    return header
+
+
+def read_archive_header(archive: str | Path) -> dict[str, Any]:
+    path = Path(archive)
+    with _open_archive(path, "r") as fp:
+        return _read_header(fp, path)
+
+
+def _iter_archive(path: Path) -> Iterator[dict[str, Any]]:
+    with _open_archive(path, "r") as fp:
+        _read_header(fp, path)
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+def import_archive(
+    archive: str | Path,
+    *,
+    workers: int = DEFAULT_WORKERS,
+    prefix: Optional[str] = None,
+    oss: Optional[OssStorage] = None,
+) -> dict[str, Any]:
+    path = Path(archive)
+    # 以归档头里记录的前缀为准；调用方另传前缀时只做核对，不一致直接拒绝
+    archive_prefix = str(read_archive_header(path).get("prefix") or "")
+    if prefix is not None and prefix != archive_prefix:
+        raise ValueError(f"归档前缀为 {archive_prefix!r}，与指定的 {prefix!r} 不一致")
+    storage = oss or OssStorage()
+    started = time.perf_counter()
+
+    # 先分页列出目标前缀，用 ETag(简单上传即内容 MD5) 判断对象是否需要重传
+    remote_etags = {
+        info.key: info.etag.upper() for info in storage.iter_objects(archive_prefix)
+    }
+
+    def upload(record: dict[str, Any]) -> str:
+        key = str(record.get("key") or "")
+        if not key or not key.startswith(archive_prefix):
+            _logger.warning("备份记录的 key 不在归档前缀下，跳过: %s", key)
+            return "invalid"
+        data = _decode_record(record)
+        digest = _md5_hex(data)
+        if record.get("md5") and str(record["md5"]).upper() != digest:
+            _logger.warning("备份记录校验失败，跳过: %s", key)
+            return "invalid"
+        if remote_etags.get(key) == digest:
+            return "skipped"
+        headers = record.get("headers")
+        storage.put_bytes(key, data, headers=dict(headers) if isinstance(headers, dict) else None)
+        return "uploaded"
+
+    stats = {"uploaded": 0, "skipped": 0, "invalid": 0}
+    for outcome in _bounded_map(upload, _iter_archive(path), workers=workers):
+        stats[outcome] += 1
+
+    elapsed = time.perf_counter() - started
+    _logger.info(
+        "导入完成 (archive=%s, uploaded=%s, skipped=%s, invalid=%s, seconds=%.2f)",
+        path,
+        stats["uploaded"],
+        stats["skipped"],
+        stats["invalid"],
+        elapsed,
+    )
+    return {**stats, "seconds": round(elapsed, 3)}
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m storage.backup", description="批量导出/导入 OSS 上的小说数据"
+    )
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_export = sub.add_parser("export", help="导出前缀下所有对象到 JSONL(.gz) 归档")
+    p_export.add_argument("archive")
+    p_export.add_argument("--prefix", default=DEFAULT_PREFIX)
+    p_export.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+
+    p_import = sub.add_parser("import", help="从归档并发导入，内容未变化的对象会跳过")
+    p_import.add_argument("archive")
+    p_import.add_argument("--prefix", default=None, help="可选，用来核对归档里记录的前缀")
+    p_import.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+
+    args = parser.parse_args(argv)
+    workers = max(1, int(args.workers))
+    if args.cmd == "export":
+        result = export_prefix(args.archive, prefix=args.prefix, workers=workers)
+    else:
+        result = import_archive(args.archive, prefix=args.prefix, workers=workers)
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
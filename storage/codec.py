@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import gzip
+import json
+from typing import Any, Mapping, Optional
+
+CODEC_META_HEADER = "x-oss-meta-novelai-codec"
+CODEC_JSON = "json/1"
+CODEC_JSON_GZIP = "json+gzip/1"
+CODEC_JSON_ZSTD = "json+zstd/1"
+
+# 小于阈值的文档压缩收益很小，直接存最小化 JSON
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _zstd() -> Any:
+    try:
+        import zstandard
+    except Exception:
+        return None
+    return zstandard
+
+
+def encode_document(
+    obj: Any,
+    *,
+    compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+    prefer_zstd: bool = False,
+) -> tuple[bytes, dict[str, str]]:
+    # zstd 需显式开启（oss.document_codec: zstd）：没装 zstandard 的 worker 读不了 zstd 文档
+    raw = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(raw) < compress_threshold:
+        return raw, {
+            "Content-Type": "application/json; charset=utf-8",
+            CODEC_META_HEADER: CODEC_JSON,
+        }
+
+    zstd = _zstd() if prefer_zstd else None
+    if zstd is not None:
+        data = zstd.ZstdCompressor(level=6).compress(raw)
+        codec = CODEC_JSON_ZSTD
+    else:
+        # mtime=0 保证相同内容编码结果一致，ETag 可用于判断内容是否变化
+        data = gzip.compress(raw, compresslevel=6, mtime=0)
+        codec = CODEC_JSON_GZIP
+    return data, {"Content-Type": "application/octet-stream", CODEC_META_HEADER: codec}
+
+
+def decode_document(data: bytes, *, codec: Optional[str] = None) -> Any:
+    resolved = (codec or "").strip().lower()
+    if resolved == CODEC_JSON_GZIP or (not resolved and data[:2] == _GZIP_MAGIC):
+        data = gzip.decompress(data)
+    elif resolved == CODEC_JSON_ZSTD or (not resolved and data[:4] == _ZSTD_MAGIC):
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError("缺少依赖：zstandard。请先安装：pip install zstandard")
+        data = zstd.ZstdDecompressor().decompress(data)
+    # 旧格式（indent=2 的明文 JSON）与 json/1 走同一条解析路径
+    return json.loads(data.decode("utf-8"))
+
+
+def codec_from_headers(headers: Optional[Mapping[str, str]]) -> Optional[str]:
+    if not headers:
+        return None
+    for name, value in headers.items():
+        if name.lower() == CODEC_META_HEADER:
+            return value
+    return None
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from storage.oss_storage import OssStorage
+
+# 小说相关对象的键布局与读取，web 接口和生成侧（上下文注入）共用一份
+
+STORY_FIELDS = ("background", "mainline", "darkline")
+ADVANCED_FIELDS = ("style", "core_design", "reversal", "highlights")
+
+# 小说列表：每本小说一份 novels/index/{id}.json，新建只写自己那一份，多 worker 并发创建互不覆盖。
+# 列表靠列前缀拼出来，记录按 etag 缓存在进程内，只有新增或改过的记录才会再 GET。
+# 老版本把整个列表存在 novels/index.json，只读兼容：读到还没有单独记录的条目时顺手补写一份
+_RECORD_CACHE_SIZE = 4096
+_record_lock = threading.Lock()
+_records: OrderedDict[str, tuple[str, dict[str, Any]]] = OrderedDict()
+
+
+def novels_index_key() -> str:
+    return "novels/index.json"
+
+
+def novels_records_prefix() -> str:
+    return "novels/index/"
+
+
+def novel_record_key(novel_id: str) -> str:
+    return f"{novels_records_prefix()}{novel_id}.json"
+
+
+def novel_prefix(novel_id: str) -> str:
+    return f"novels/{novel_id}"
+
+
+def story_key(novel_id: str) -> str:
+    return f"{novel_prefix(novel_id)}/story.json"
+
+
+def advanced_key(novel_id: str) -> str:
+    return f"{novel_prefix(novel_id)}/advanced.json"
+
+
+def summary_key(novel_id: str) -> str:
+    return f"{novel_prefix(novel_id)}/summary.json"
+
+
+def chapters_prefix(novel_id: str) -> str:
+    return f"{novel_prefix(novel_id)}/chapters"
+
+
+def outline_key(novel_id: str) -> str:
+    return f"{chapters_prefix(novel_id)}/outline.json"
+
+
+def checkpoint_key(novel_id: str) -> str:
+    return f"{chapters_prefix(novel_id)}/checkpoint.json"
+
+
+def chapter_key(novel_id: str, index: int) -> str:
+    return f"{chapters_prefix(novel_id)}/{index:03d}.txt"
+
+
+def manuscripts_prefix(novel_id: str) -> str:
+    return f"{novel_prefix(novel_id)}/manuscripts"
+
+
+def file_record_key(novel_id: str, key: str) -> str:
+    # 每个稿件单独一份登记，上传/删除互不覆盖，不用对共享列表做读改写
+    return f"{novel_prefix(novel_id)}/files/{key.rsplit('/', 1)[-1]}.json"
+
+
+def _read_records(oss: OssStorage, prefix: str) -> list[dict[str, Any]]:
+    # 列一次前缀；etag 没变的记录直接用缓存。读失败直接抛出，不把“读不到”当成“没有”
+    items: list[dict[str, Any]] = []
+    for info in oss.iter_objects(prefix):
+        if not info.key.endswith(".json"):
+            continue
+        with _record_lock:
+            cached = _records.get(info.key)
+            if cached is not None and cached[0] == info.etag:
+                _records.move_to_end(info.key)
+                items.append(dict(cached[1]))
+                continue
+        data = oss.get_json(info.key)
+        if not isinstance(data, dict):
+            continue
+        with _record_lock:
+            _records[info.key] = (info.etag, data)
+            _records.move_to_end(info.key)
+            while len(_records) > _RECORD_CACHE_SIZE:
+                _records.popitem(last=False)
+        items.append(dict(data))
+    return items
+
+
+def _legacy_index(oss: OssStorage) -> list[dict[str, Any]]:
+    data = oss.get_json(novels_index_key())
+    if not isinstance(data, list):
+        return []
+    return [item for item in data if isinstance(item, dict) and item.get("id")]
+
+
+def load_index(oss: OssStorage) -> list[dict[str, Any]]:
+    items = _read_records(oss, novels_records_prefix())
+    known = {item.get("id") for item in items}
+    for item in _legacy_index(oss):
+        if item["id"] not in known:
+            save_novel(oss, item)
+            items.append(item)
+    return sorted(items, key=lambda item: str(item.get("created_at") or ""))
+
+
+def read_novel(oss: OssStorage, novel_id: str) -> dict[str, Any] | None:
+    data = oss.get_json(novel_record_key(novel_id))
+    if isinstance(data, dict):
+        return data
+    item = find_novel(_legacy_index(oss), novel_id)
+    if item is not None:
+        save_novel(oss, item)
+    return item
+
+
+def save_novel(oss: OssStorage, item: dict[str, Any]) -> None:
+    oss.put_json(novel_record_key(str(item["id"])), item)
+
+
+def _read_fields(oss: OssStorage, key: str, fields: tuple[str, ...]) -> dict[str, str]:
+    result = {name: "" for name in fields}
+    try:
+        data = oss.get_json(key)
+    except Exception:
+        return result
+    if isinstance(data, dict):
+        result.update({name: str(data.get(name, "")) for name in fields})
+    return result
+
+
+def read_story(oss: OssStorage, novel_id: str) -> dict[str, str]:
+    return _read_fields(oss, story_key(novel_id), STORY_FIELDS)
+
+
+def read_advanced(oss: OssStorage, novel_id: str) -> dict[str, str]:
+    return _read_fields(oss, advanced_key(novel_id), ADVANCED_FIELDS)
+
+
+def read_file_record(oss: OssStorage, novel_id: str, key: str) -> dict[str, Any] | None:
+    try:
+        data = oss.get_json(file_record_key(novel_id, key))
+    except Exception:
+        return None
+    return data if isinstance(data, dict) and data.get("key") == key else None
+
+
+def read_files(oss: OssStorage, novel_id: str) -> list[dict[str, Any]]:
+    # 登记记录和书目记录一样走 etag 缓存，列表页不再每个稿件 GET 一次
+    files = [f for f in _read_records(oss, f"{novel_prefix(novel_id)}/files/") if f.get("key")]
+    return sorted(files, key=lambda f: str(f.get("uploaded_at") or ""))
+
+
+def find_novel(index: list[dict[str, Any]], novel_id: str) -> dict[str, Any] | None:
+    for item in index:
+        if item.get("id") == novel_id:
+            return item
+    return None
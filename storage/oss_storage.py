@@ -1,13 +1,21 @@
 from __future__ import annotations
 
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from threading import Lock
+from typing import Any, Iterator, Optional
 
-from config.loader import OssConfig, get_oss_config
+from config.loader import OssConfig, get_oss_config, subscribe
 from config.log import get_logger
+from config.metrics import span, timed
+from storage.codec import codec_from_headers, decode_document, encode_document
 
 _logger = get_logger(__name__)
 
+_shared_lock = Lock()
+_shared_storage: Optional["OssStorage"] = None
+_shared_subscribed = False
+
 
 def _normalize_endpoint(endpoint: str) -> str:
     ep = (endpoint or "").strip()
@@ -39,6 +47,13 @@ def _is_not_found_error(exc: Exception) -> bool:
     return False
 
 
+@dataclass(frozen=True)
+class ObjectInfo:
+    key: str
+    size: int
+    etag: str
+
+
 class OssStorage:
     def __init__(self, cfg: Optional[OssConfig] = None) -> None:
         self.cfg = cfg or get_oss_config()
@@ -54,9 +69,26 @@ class OssStorage:
         except Exception as exc:
             raise RuntimeError("缺少依赖：oss2。请先安装：poetry install 或 pip install oss2") from exc
 
+        if self.cfg.document_codec == "zstd":
+            # 开了 zstd 的 worker 一定要能读写 zstd，缺依赖时直接报错，不悄悄退回 gzip
+            try:
+                import zstandard  # noqa: F401
+            except Exception as exc:
+                raise RuntimeError(
+                    "缺少依赖：zstandard（oss.document_codec=zstd）。"
+                    "请先安装：pip install zstandard"
+                ) from exc
+
         auth = oss2.Auth(self.cfg.access_key_id, self.cfg.access_key_secret)
         self.bucket = oss2.Bucket(auth, _normalize_endpoint(self.cfg.endpoint), self.cfg.bucket)
+        # 配了绑定到 bucket 的自定义域名（通常接了 CDN）时，下载链接签在这个域名上
+        self.download_bucket = (
+            oss2.Bucket(auth, _normalize_endpoint(self.cfg.domain), self.cfg.bucket, is_cname=True)
+            if self.cfg.domain
+            else self.bucket
+        )
 
+    @timed("oss_request_seconds", op="put_text")
     def put_text(self, key: str, text: str, *, encoding: str = "utf-8") -> None:
         k = _normalize_key(key)
         try:
@@ -75,6 +107,7 @@ class OssStorage:
             _logger.exception("OSS put_text failed (bucket=%s, key=%s)", self.cfg.bucket, k)
             raise
 
+    @timed("oss_request_seconds", op="get_text")
     def get_text(self, key: str, *, encoding: str = "utf-8") -> str:
         k = _normalize_key(key)
         try:
@@ -89,6 +122,147 @@ class OssStorage:
             _logger.exception("OSS get_text failed (bucket=%s, key=%s)", self.cfg.bucket, k)
             raise
 
+    @timed("oss_request_seconds", op="put_bytes")
+    def put_bytes(
+        self, key: str, data: bytes, *, headers: Optional[dict[str, str]] = None
+    ) -> str:
+        k = _normalize_key(key)
+        try:
+            result = self.bucket.put_object(k, data, headers=headers)
+            _logger.info(
+                "OSS put_bytes ok (bucket=%s, key=%s, size=%s, status=%s)",
+                self.cfg.bucket,
+                k,
+                len(data),
+                result.status,
+            )
+            return str(getattr(result, "etag", "") or "")
+        except Exception:
+            _logger.exception("OSS put_bytes failed (bucket=%s, key=%s)", self.cfg.bucket, k)
+            raise
+
+    @timed("oss_request_seconds", op="get_bytes")
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        k = _normalize_key(key)
+        try:
+            obj = self.bucket.get_object(k)
+            data = obj.read()
+            _logger.info("OSS get_bytes ok (bucket=%s, key=%s)", self.cfg.bucket, k)
+            return data
+        except Exception as exc:
+            if _is_not_found_error(exc):
+                _logger.info("OSS get_bytes miss (bucket=%s, key=%s)", self.cfg.bucket, k)
+                return None
+            _logger.exception("OSS get_bytes failed (bucket=%s, key=%s)", self.cfg.bucket, k)
+            raise
+
+    @timed("oss_request_seconds", op="get_bytes")
+    def get_with_headers(self, key: str) -> Optional[tuple[bytes, dict[str, str]]]:
+        # 连同响应头一起返回（Content-Type、x-oss-meta-* 等），备份导出要原样带走
+        k = _normalize_key(key)
+        try:
+            obj = self.bucket.get_object(k)
+            data = obj.read()
+            _logger.info("OSS get_with_headers ok (bucket=%s, key=%s)", self.cfg.bucket, k)
+        except Exception as exc:
+            if _is_not_found_error(exc):
+                _logger.info("OSS get_with_headers miss (bucket=%s, key=%s)", self.cfg.bucket, k)
+                return None
+            _logger.exception(
+                "OSS get_with_headers failed (bucket=%s, key=%s)", self.cfg.bucket, k
+            )
+            raise
+        return data, {str(name): str(value) for name, value in (obj.headers or {}).items()}
+
+    @timed("oss_request_seconds", op="append_bytes")
+    def append_bytes(
+        self, key: str, data: bytes, *, position: int, headers: Optional[dict[str, str]] = None
+    ) -> int:
+        # 追加写（Appendable Object）：position 必须等于对象当前长度，返回下一次追加的位置
+        k = _normalize_key(key)
+        try:
+            result = self.bucket.append_object(k, position, data, headers=headers)
+            _logger.debug(
+                "OSS append_bytes ok (bucket=%s, key=%s, position=%s, size=%s)",
+                self.cfg.bucket,
+                k,
+                position,
+                len(data),
+            )
+            return int(result.next_position)
+        except Exception:
+            _logger.exception(
+                "OSS append_bytes failed (bucket=%s, key=%s, position=%s)",
+                self.cfg.bucket,
+                k,
+                position,
+            )
+            raise
+
+    @timed("oss_request_seconds", op="delete")
+    def delete(self, key: str) -> None:
+        k = _normalize_key(key)
+        try:
+            self.bucket.delete_object(k)
+            _logger.info("OSS delete ok (bucket=%s, key=%s)", self.cfg.bucket, k)
+        except Exception:
+            _logger.exception("OSS delete failed (bucket=%s, key=%s)", self.cfg.bucket, k)
+            raise
+
+    def put_json(self, key: str, obj: Any) -> str:
+        with span("storage_encode_seconds"):
+            data, headers = encode_document(
+                obj, prefer_zstd=self.cfg.document_codec == "zstd"
+            )
+        return self.put_bytes(key, data, headers=headers)
+
+    def get_json(self, key: str) -> Any:
+        k = _normalize_key(key)
+        try:
+            with span("oss_request_seconds", op="get_json"):
+                obj = self.bucket.get_object(k)
+                data = obj.read()
+            codec = codec_from_headers(getattr(obj, "headers", None))
+            _logger.info("OSS get_json ok (bucket=%s, key=%s, codec=%s)", self.cfg.bucket, k, codec)
+        except Exception as exc:
+            if _is_not_found_error(exc):
+                _logger.info("OSS get_json miss (bucket=%s, key=%s)", self.cfg.bucket, k)
+                return None
+            _logger.exception("OSS get_json failed (bucket=%s, key=%s)", self.cfg.bucket, k)
+            raise
+        if not data:
+            return None
+        with span("storage_decode_seconds", codec=codec or "sniff"):
+            return decode_document(data, codec=codec)
+
+    def iter_objects(self, prefix: str, *, page_size: int = 1000) -> Iterator[ObjectInfo]:
+        p = _normalize_key(prefix)
+        token = ""
+        pages = 0
+        while True:
+            try:
+                result = self.bucket.list_objects_v2(
+                    prefix=p, continuation_token=token, max_keys=max(1, min(page_size, 1000))
+                )
+            except Exception:
+                _logger.exception(
+                    "OSS list_objects failed (bucket=%s, prefix=%s, page=%s)",
+                    self.cfg.bucket,
+                    p,
+                    pages,
+                )
+                raise
+            pages += 1
+            for info in result.object_list:
+                yield ObjectInfo(
+                    key=info.key, size=int(info.size or 0), etag=(info.etag or "").strip('"')
+                )
+            if not result.is_truncated or not result.next_continuation_token:
+                break
+            token = result.next_continuation_token
+        _logger.info("OSS list_objects ok (bucket=%s, prefix=%s, pages=%s)", self.cfg.bucket, p, pages)
+
+    @timed("oss_request_seconds", op="put_file")
     def put_file(self, key: str, file_path: str | Path) -> None:
         k = _normalize_key(key)
         p = Path(file_path)
@@ -106,6 +280,7 @@ class OssStorage:
             )
             raise
 
+    @timed("oss_request_seconds", op="get_file")
     def get_file(self, key: str, file_path: str | Path) -> None:
         k = _normalize_key(key)
         p = Path(file_path)
@@ -119,14 +294,68 @@ class OssStorage:
             )
             raise
 
-    def sign_url(self, key: str, *, expires: int = 3600, method: str = "GET") -> str:
+    @timed("oss_request_seconds", op="head")
+    def head(self, key: str) -> Optional[ObjectInfo]:
         k = _normalize_key(key)
         try:
-            url = self.bucket.sign_url(method, k, expires)
+            meta = self.bucket.head_object(k)
+        except Exception as exc:
+            if _is_not_found_error(exc) or getattr(exc, "status", None) == 404:
+                return None
+            _logger.exception("OSS head failed (bucket=%s, key=%s)", self.cfg.bucket, k)
+            raise
+        return ObjectInfo(
+            key=k,
+            size=int(getattr(meta, "content_length", 0) or 0),
+            etag=(getattr(meta, "etag", "") or "").strip('"'),
+        )
+
+    @timed("oss_request_seconds", op="sign_url")
+    def sign_url(
+        self,
+        key: str,
+        *,
+        expires: int = 3600,
+        method: str = "GET",
+        headers: Optional[dict[str, str]] = None,
+        params: Optional[dict[str, str]] = None,
+    ) -> str:
+        # headers 里的 Content-Type 等会参与签名，客户端上传时必须原样带上
+        k = _normalize_key(key)
+        bucket = self.download_bucket if method == "GET" else self.bucket
+        try:
+            url = bucket.sign_url(method, k, expires, headers=headers, params=params)
             _logger.info(
-                "OSS sign_url ok (bucket=%s, key=%s, expires=%s)", self.cfg.bucket, k, expires
+                "OSS sign_url ok (bucket=%s, key=%s, method=%s, expires=%s)",
+                self.cfg.bucket,
+                k,
+                method,
+                expires,
             )
             return url
         except Exception:
             _logger.exception("OSS sign_url failed (bucket=%s, key=%s)", self.cfg.bucket, k)
             raise
+
+
+def _drop_shared_storage(new: Any, old: Any) -> None:
+    global _shared_storage
+    if old is not None and new.oss == old.oss:
+        return
+    with _shared_lock:
+        _shared_storage = None
+    _logger.info("OSS配置已变更，共享 OssStorage 将在下次使用时重建")
+
+
+def get_shared_storage() -> OssStorage:
+    # 复用同一个 Bucket（及其 HTTP 连接池），配置变更时自动重建
+    global _shared_storage, _shared_subscribed
+    # 先取配置（可能触发热加载并回调 _drop_shared_storage），再加锁，避免回调里重入同一把锁
+    cfg = get_oss_config()
+    with _shared_lock:
+        if not _shared_subscribed:
+            subscribe(_drop_shared_storage)
+            _shared_subscribed = True
+        if _shared_storage is None or _shared_storage.cfg != cfg:
+            _shared_storage = OssStorage(cfg)
+        return _shared_storage
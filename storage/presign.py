@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, Optional
+from urllib.parse import quote
+
+from config.loader import PresignConfig, get_presign_config, subscribe
+from config.log import get_logger
+from config.metrics import inc
+from storage.oss_storage import OssStorage, get_shared_storage
+
+_logger = get_logger(__name__)
+
+# 预签名直传：浏览器拿短时有效的签名 URL 直接与 OSS/CDN 收发文件，字节不经过应用进程。
+# 下载链接的过期时间对齐到 get_ttl_s/2 的整数倍，剩余有效期不少于一半时复用缓存里的同一个链接；
+# 同一窗口内各 worker 签出的链接也一模一样，浏览器和 CDN 的缓存都能命中。
+# 上传链接每次现签，不缓存。
+
+CacheKey = tuple[str, tuple[tuple[str, str], ...]]
+
+_cache_lock = Lock()
+_cache: Optional["SignedUrlCache"] = None
+_cache_cfg: Optional[PresignConfig] = None
+_subscribed = False
+
+
+@dataclass(frozen=True)
+class SignedUrl:
+    url: str
+    method: str
+    expires_at: int
+    headers: dict[str, str] = field(default_factory=dict)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "url": self.url,
+            "method": self.method,
+            "headers": self.headers,
+            "expires_at": self.expires_at,
+        }
+
+
+class SignedUrlCache:
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._items: OrderedDict[CacheKey, SignedUrl] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: CacheKey, *, min_remaining_s: float) -> Optional[SignedUrl]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item.expires_at - time.time() < min_remaining_s:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item
+
+    def put(self, key: CacheKey, value: SignedUrl) -> None:
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+def _drop_cache(new: Any, old: Any) -> None:
+    global _cache
+    if old is not None and new.presign == old.presign and new.oss == old.oss:
+        return
+    with _cache_lock:
+        _cache = None
+    _logger.info("签名配置已变更，签名链接缓存已清空")
+
+
+def _get_cache() -> tuple[SignedUrlCache, PresignConfig]:
+    global _cache, _cache_cfg, _subscribed
+    cfg = get_presign_config()
+    with _cache_lock:
+        if not _subscribed:
+            subscribe(_drop_cache)
+            _subscribed = True
+        if _cache is None or _cache_cfg != cfg:
+            _cache = SignedUrlCache(cfg.cache_size)
+            _cache_cfg = cfg
+        return _cache, cfg
+
+
+def aligned_expiry(now: float, ttl_s: int) -> int:
+    # 落在 (now + ttl/2, now + ttl] 之间、且是 ttl/2 整数倍的时间点
+    step = max(1, ttl_s // 2)
+    return (int(now) // step + 2) * step
+
+
+def presign_get(
+    key: str,
+    *,
+    filename: str = "",
+    content_type: str = "",
+    oss: Optional[OssStorage] = None,
+) -> SignedUrl:
+    params: dict[str, str] = {}
+    if content_type:
+        params["response-content-type"] = content_type
+    if filename:
+        params["response-content-disposition"] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    cache, cfg = _get_cache()
+    cache_key: CacheKey = (key, tuple(sorted(params.items())))
+    hit = cache.get(cache_key, min_remaining_s=cfg.get_ttl_s // 2)
+    if hit is not None:
+        inc("oss_presign_total", method="GET", outcome="hit")
+        return hit
+
+    now = time.time()
+    expires_at = aligned_expiry(now, cfg.get_ttl_s)
+    url = (oss or get_shared_storage()).sign_url(
+        key, expires=expires_at - int(now), method="GET", params=params or None
+    )
+    signed = SignedUrl(url=url, method="GET", expires_at=expires_at)
+    cache.put(cache_key, signed)
+    inc("oss_presign_total", method="GET", outcome="miss")
+    return signed
+
+
+def presign_put(
+    key: str, *, content_type: str, oss: Optional[OssStorage] = None
+) -> SignedUrl:
+    cfg = get_presign_config()
+    headers = {"Content-Type": content_type}
+    url = (oss or get_shared_storage()).sign_url(
+        key, expires=cfg.put_ttl_s, method="PUT", headers=headers
+    )
+    inc("oss_presign_total", method="PUT", outcome="miss")
+    return SignedUrl(
+        url=url, method="PUT", expires_at=int(time.time()) + cfg.put_ttl_s, headers=headers
+    )
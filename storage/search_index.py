@@ -0,0 +1,406 @@
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from config.loader import get_server_config, subscribe
+from config.log import get_logger
+from config.metrics import inc, observe
+from storage.novels import (
+    ADVANCED_FIELDS,
+    STORY_FIELDS,
+    load_index,
+    read_advanced,
+    read_story,
+)
+from storage.oss_storage import OssStorage
+
+_logger = get_logger(__name__)
+
+# 全部小说标题和设定的全文检索，SQLite FTS5 落在本地文件里（WAL，同机多 worker 共用）。
+# 中文不分词：每段连续汉字切成重叠的二元组，再补上末字，写入前在 Python 里切好、
+# 以空格拼接交给 FTS5 的 unicode61 分词器；字母数字按小写单词。
+# 查询按同样规则切分：多字词查相邻二元组组成的短语，单字查以它开头的词元（前缀查询）。
+# 原文另存一份，命中后在原文上截取摘要片段，不用 FTS5 自带的 snippet（那只能看到二元组）。
+
+SEARCH_FIELDS = ("title",) + STORY_FIELDS + ADVANCED_FIELDS
+TITLE_WEIGHT = 5.0
+MAX_LIMIT = 50
+SNIPPET_CHARS = 40  # 命中词前后各保留多少字
+MAX_SNIPPETS = 2
+REBUILD_WORKERS = 16
+
+_CJK = "㐀-䶿一-鿿豈-﫿"
+_TOKEN_RE = re.compile(f"[{_CJK}]+|[0-9A-Za-z]+")
+_CJK_RE = re.compile(f"[{_CJK}]")
+
+_shared_lock = threading.Lock()
+_shared_index: Optional["SearchIndex"] = None
+_shared_subscribed = False
+_bootstrap_started = False
+
+
+def _is_cjk(run: str) -> bool:
+    return bool(_CJK_RE.match(run))
+
+
+def tokenize(text: str) -> list[str]:
+    tokens: list[str] = []
+    for run in _TOKEN_RE.findall(text or ""):
+        if not _is_cjk(run):
+            tokens.append(run.lower())
+            continue
+        tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+        # 末字单独成词：单字查询用前缀匹配，句末的字也要能查到
+        tokens.append(run[-1])
+    return tokens
+
+
+def _query_terms(query: str) -> list[str]:
+    return [t if _is_cjk(t) else t.lower() for t in _TOKEN_RE.findall(query or "")]
+
+
+def _columns(fields: dict[str, str]) -> tuple[str, str]:
+    title = " ".join(tokenize(fields.get("title") or ""))
+    body = " ".join(tokenize("\n".join(fields.get(name) or "" for name in SEARCH_FIELDS[1:])))
+    return title, body
+
+
+def _match_expression(terms: list[str]) -> str:
+    parts: list[str] = []
+    for term in terms:
+        if _is_cjk(term) and len(term) > 1:
+            bigrams = " ".join(term[i : i + 2] for i in range(len(term) - 1))
+            parts.append(f'"{bigrams}"')
+        else:
+            parts.append(f'"{term}"*')
+    return " AND ".join(parts)
+
+
+def _snippets(fields: dict[str, str], terms: list[str]) -> list[dict[str, Any]]:
+    # 每个字段取第一处命中，前后各截 SNIPPET_CHARS 字；highlights 是片段内所有命中的 [起, 止)
+    result: list[dict[str, Any]] = []
+    for name in SEARCH_FIELDS:
+        text = fields.get(name) or ""
+        lowered = text.lower()
+        first = min(
+            (pos for pos in (lowered.find(t) for t in terms) if pos >= 0), default=-1
+        )
+        if first < 0:
+            continue
+        start = max(0, first - SNIPPET_CHARS)
+        end = min(len(text), first + max(map(len, terms)) + SNIPPET_CHARS)
+        window = lowered[start:end]
+        highlights: list[list[int]] = []
+        for term in terms:
+            pos = window.find(term)
+            while pos >= 0:
+                highlights.append([pos, pos + len(term)])
+                pos = window.find(term, pos + len(term))
+        highlights.sort()
+        result.append(
+            {
+                "field": name,
+                "text": text[start:end],
+                "highlights": highlights,
+                "prefix": start > 0,
+                "suffix": end < len(text),
+            }
+        )
+        if len(result) >= MAX_SNIPPETS:
+            break
+    return result
+
+
+class SearchIndex:
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conns: list[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS search_docs (
+                rowid INTEGER PRIMARY KEY AUTOINCREMENT,
+                novel_id TEXT NOT NULL UNIQUE,
+                fields TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+                title, body, content='', prefix='1'
+            );
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA busy_timeout=10000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _upsert(self, conn: sqlite3.Connection, novel_id: str, fields: dict[str, str]) -> None:
+        row = conn.execute(
+            "SELECT rowid, fields FROM search_docs WHERE novel_id = ?", (novel_id,)
+        ).fetchone()
+        merged = {name: "" for name in SEARCH_FIELDS}
+        if row is not None:
+            merged.update(json.loads(row[1]))
+        # 只传了部分字段（比如只保存了故事设定）时，其余字段沿用索引里已有的
+        merged.update({k: str(v or "") for k, v in fields.items() if k in merged})
+        payload = json.dumps(merged, ensure_ascii=False)
+        if row is None:
+            cur = conn.execute(
+                "INSERT INTO search_docs (novel_id, fields, updated_at) VALUES (?, ?, ?)",
+                (novel_id, payload, time.time()),
+            )
+            rowid = cur.lastrowid
+        else:
+            rowid = row[0]
+            self._delete_fts(conn, rowid, json.loads(row[1]))
+            conn.execute(
+                "UPDATE search_docs SET fields = ?, updated_at = ? WHERE rowid = ?",
+                (payload, time.time(), rowid),
+            )
+        conn.execute(
+            "INSERT INTO search_fts (rowid, title, body) VALUES (?, ?, ?)",
+            (rowid, *_columns(merged)),
+        )
+
+    def _delete_fts(self, conn: sqlite3.Connection, rowid: int, fields: dict[str, str]) -> None:
+        # 无内容表删除时要交回当初写入的词元，原文在 search_docs 里，重新切一遍即可
+        conn.execute(
+            "INSERT INTO search_fts (search_fts, rowid, title, body) VALUES ('delete', ?, ?, ?)",
+            (rowid, *_columns(fields)),
+        )
+
+    def index_novel(self, novel_id: str, fields: dict[str, str]) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._upsert(conn, novel_id, fields)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        inc("search_index_updates_total")
+
+    def bulk_index(self, docs: Iterable[tuple[str, dict[str, str]]], *, replace: bool) -> int:
+        # 整批一个事务；replace=True 时先清空，索引里只留这一批
+        conn = self._conn()
+        count = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if replace:
+                conn.execute("DELETE FROM search_docs")
+                conn.execute("INSERT INTO search_fts (search_fts) VALUES ('delete-all')")
+            for novel_id, fields in docs:
+                self._upsert(conn, novel_id, fields)
+                count += 1
+            if replace:
+                conn.execute("INSERT INTO search_fts (search_fts) VALUES ('optimize')")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+    def remove(self, novel_id: str) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT rowid, fields FROM search_docs WHERE novel_id = ?", (novel_id,)
+            ).fetchone()
+            if row is not None:
+                self._delete_fts(conn, row[0], json.loads(row[1]))
+                conn.execute("DELETE FROM search_docs WHERE rowid = ?", (row[0],))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def count(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM search_docs").fetchone()[0])
+
+    def search(self, query: str, *, limit: int = 20) -> dict[str, Any]:
+        started = time.perf_counter()
+        terms = _query_terms(query)
+        hits: list[dict[str, Any]] = []
+        if terms:
+            limit = min(MAX_LIMIT, max(1, int(limit)))
+            rows = self._conn().execute(
+                """
+                SELECT d.novel_id, d.fields, bm25(search_fts, ?, 1.0) AS rank
+                FROM search_fts JOIN search_docs d ON d.rowid = search_fts.rowid
+                WHERE search_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+                """,
+                (TITLE_WEIGHT, _match_expression(terms), limit),
+            ).fetchall()
+            for novel_id, raw, rank in rows:
+                fields = json.loads(raw)
+                hits.append(
+                    {
+                        "novel_id": novel_id,
+                        "title": fields.get("title", ""),
+                        "score": round(-float(rank), 4),
+                        "snippets": _snippets(fields, terms),
+                    }
+                )
+        elapsed = time.perf_counter() - started
+        observe("search_query_seconds", elapsed)
+        return {"query": query, "hits": hits, "took_ms": round(elapsed * 1000, 2)}
+
+    def close(self) -> None:
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def open_search_index(url: str) -> SearchIndex:
+    # 地址格式同聊天存储的 sqlite 部分：sqlite:///绝对路径、sqlite:相对项目根的路径
+    value = (url or "").strip()
+    if not value.startswith("sqlite:"):
+        raise ValueError(f"不支持的检索索引地址：{value}")
+    raw = value[len("sqlite:"):]
+    if not raw.strip("/"):
+        raise ValueError(f"检索索引地址缺少文件路径：{value}")
+    if raw.startswith("///"):
+        path = Path(raw[2:])
+    else:
+        path = Path(raw.lstrip("/"))
+        if not path.is_absolute():
+            path = Path(__file__).resolve().parents[1] / path
+    return SearchIndex(path)
+
+
+def _drop_shared_index(new: Any, old: Any) -> None:
+    global _shared_index
+    if old is not None and new.server.search_index == old.server.search_index:
+        return
+    with _shared_lock:
+        index, _shared_index = _shared_index, None
+    if index is not None:
+        index.close()
+    _logger.info("检索索引配置已变更，将在下次使用时重建")
+
+
+def get_search_index() -> SearchIndex:
+    global _shared_index, _shared_subscribed
+    url = get_server_config().search_index
+    with _shared_lock:
+        if not _shared_subscribed:
+            subscribe(_drop_shared_index)
+            _shared_subscribed = True
+        if _shared_index is None:
+            _shared_index = open_search_index(url)
+        return _shared_index
+
+
+def close_search_index() -> None:
+    global _shared_index
+    with _shared_lock:
+        index, _shared_index = _shared_index, None
+    if index is not None:
+        index.close()
+
+
+def index_novel(novel_id: str, fields: dict[str, str]) -> None:
+    # 保存接口里调用：索引写失败只记日志，不影响保存本身，之后可以整体重建
+    try:
+        get_search_index().index_novel(novel_id, fields)
+    except Exception:
+        _logger.exception("检索索引更新失败 (novel_id=%s)", novel_id)
+
+
+def search(query: str, *, limit: int = 20) -> dict[str, Any]:
+    # 新部署（或换了索引文件）时索引是空的：第一次查询触发一次后台全量重建，本次先返回空结果
+    global _bootstrap_started
+    index = get_search_index()
+    if not _bootstrap_started:
+        _bootstrap_started = True
+        if index.count() == 0:
+            _logger.info("检索索引为空，后台从 OSS 重建")
+            threading.Thread(target=_bootstrap, name="search-rebuild", daemon=True).start()
+    return index.search(query, limit=limit)
+
+
+def _bootstrap() -> None:
+    try:
+        rebuild_from_oss()
+    except Exception:
+        _logger.exception("检索索引重建失败")
+
+
+def rebuild_from_oss(
+    *, oss: Optional[OssStorage] = None, workers: int = REBUILD_WORKERS
+) -> dict[str, Any]:
+    from storage.oss_storage import get_shared_storage
+
+    storage = oss or get_shared_storage()
+    started = time.perf_counter()
+    items = [item for item in load_index(storage) if item.get("id")]
+
+    def fetch(item: dict[str, Any]) -> tuple[str, dict[str, str]]:
+        novel_id = str(item["id"])
+        return novel_id, {
+            "title": str(item.get("title") or ""),
+            **read_story(storage, novel_id),
+            **read_advanced(storage, novel_id),
+        }
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        docs = list(pool.map(fetch, items))
+    count = get_search_index().bulk_index(docs, replace=True)
+    elapsed = time.perf_counter() - started
+    _logger.info("检索索引重建完成 (novels=%s, elapsed=%.2fs)", count, elapsed)
+    return {"novels": count, "elapsed_s": round(elapsed, 3)}
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m storage.search_index", description="小说标题与设定的全文检索索引"
+    )
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_rebuild = sub.add_parser("rebuild", help="从 OSS 全量重建索引")
+    p_rebuild.add_argument("--workers", type=int, default=REBUILD_WORKERS)
+
+    p_search = sub.add_parser("search", help="在本地索引里查询")
+    p_search.add_argument("query")
+    p_search.add_argument("--limit", type=int, default=10)
+
+    args = parser.parse_args(argv)
+    if args.cmd == "rebuild":
+        result = rebuild_from_oss(workers=max(1, int(args.workers)))
+    else:
+        result = get_search_index().search(args.query, limit=args.limit)
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,6 @@ import sys
 from pathlib import Path
 
 from config.log import get_logger
-from storage.oss_storage import OssStorage
 
 _logger = get_logger(__name__)
 
@@ -20,6 +19,8 @@ def push_config() -> None:
         _logger.error("本地配置文件不存在: %s", local_path)
         return
 
+    from storage.oss_storage import OssStorage
+
     oss = OssStorage()
     # 既然是同步配置，且 base.yaml 包含敏感信息，我们还是传到私有 Bucket 的 config/base.yaml
     oss.put_file("config/base.yaml", local_path)
@@ -27,6 +28,9 @@ def push_config() -> None:
 
 
 def pull_config() -> None:
+    from config.loader import reload_config
+    from storage.oss_storage import OssStorage
+
     local_path = _get_local_config_path()
     oss = OssStorage()
     
@@ -36,6 +40,7 @@ def pull_config() -> None:
     try:
         oss.get_file("config/base.yaml", local_path)
         _logger.info("配置已拉取到本地: %s", local_path)
+        reload_config(force=True)
     except Exception:
         _logger.error("从 OSS 拉取配置失败，请确认云端是否存在 config/base.yaml")
         raise
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+
+from config.loader import ProviderLimit, get_provider_limit, subscribe
+from config.log import get_logger
+from config.metrics import inc, observe, set_gauge
+
+_logger = get_logger(__name__)
+
+# 调用大模型的接口先在这里排队拿“名额”：每个上游一个并发上限 + 可选令牌桶限速。
+# 排队按会话轮转（同一会话连发多条不会饿死别人），队列满或等太久直接 429 + Retry-After。
+# 所有状态只在事件循环线程里读写，不需要加锁。
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, provider: str, *, retry_after: int, reason: str) -> None:
+        super().__init__(f"{provider} 繁忙（{reason}），请 {retry_after} 秒后重试")
+        self.provider = provider
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    def __init__(self, provider: str, limit: ProviderLimit) -> None:
+        self.provider = provider
+        self.limit = limit
+        self.in_flight = 0
+        # 每个排队项是 (future, 需要的名额数)
+        self._queues: "OrderedDict[str, deque[tuple[asyncio.Future[None], int]]]" = OrderedDict()
+        self._queued = 0
+        self._tokens = float(limit.burst)
+        self._refilled_at = time.monotonic()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._service_ewma_s = 1.0
+        try:
+            self.loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
+
+    def configure(self, limit: ProviderLimit) -> None:
+        self.limit = limit
+        self._tokens = min(self._tokens, float(limit.burst))
+        self._dispatch()
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def retry_after(self) -> int:
+        # 粗略估计：排在前面的请求 × 平均服务时间 / 并发数
+        waiting = (self._queued + 1) * self._service_ewma_s / self.limit.max_concurrent
+        if self.limit.rate_per_s > 0:
+            waiting = max(waiting, (self._queued + 1) / self.limit.rate_per_s)
+        return max(1, math.ceil(waiting))
+
+    @asynccontextmanager
+    async def slot(self, session_id: str = "") -> AsyncIterator[None]:
+        await self.acquire(session_id)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    async def acquire(self, session_id: str = "", *, slots: int = 1) -> int:
+        # slots 是一次要占的名额数（内部会并发调用上游的任务按并发数占），不超过并发上限；
+        # 返回实际占到的名额数，release 时原样还回
+        slots = min(max(1, slots), self.limit.max_concurrent)
+        started = time.perf_counter()
+        if not self._queued and self._try_admit(slots):
+            observe("llm_admission_wait_seconds", 0.0, provider=self.provider, outcome="admitted")
+            return slots
+        if self._queued >= self.limit.max_queue:
+            self._reject("queue_full", started)
+
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(session_id, deque()).append((fut, slots))
+        self._queued += 1
+        self._publish()
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout=self.limit.max_wait_s or None)
+        except asyncio.TimeoutError:
+            if not fut.done():
+                self._forget(session_id, fut)
+                self._reject("timeout", started)
+        except asyncio.CancelledError:
+            # 客户端断开：已分到的名额要还回去，还在排队的直接出队
+            if fut.done() and not fut.cancelled():
+                self.release(0.0, slots=slots)
+            else:
+                self._forget(session_id, fut)
+            raise
+        observe(
+            "llm_admission_wait_seconds", time.perf_counter() - started,
+            provider=self.provider, outcome="admitted",
+        )
+        return slots
+
+    def release(self, service_s: float, *, slots: int = 1) -> None:
+        self.in_flight = max(0, self.in_flight - slots)
+        if service_s > 0:
+            self._service_ewma_s = 0.8 * self._service_ewma_s + 0.2 * service_s
+        self._dispatch()
+        self._publish()
+
+    def _reject(self, reason: str, started: float) -> None:
+        observe(
+            "llm_admission_wait_seconds", time.perf_counter() - started,
+            provider=self.provider, outcome=reason,
+        )
+        inc("llm_admission_rejected_total", provider=self.provider, reason=reason)
+        raise AdmissionRejected(self.provider, retry_after=self.retry_after(), reason=reason)
+
+    def _refill(self) -> None:
+        if self.limit.rate_per_s <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.limit.burst), self._tokens + (now - self._refilled_at) * self.limit.rate_per_s
+        )
+        self._refilled_at = now
+
+    def _try_admit(self, slots: int = 1) -> bool:
+        # 并发上限在排队期间被调小时，大块请求最多占满上限，不会永远排不上
+        slots = min(slots, self.limit.max_concurrent)
+        if self.in_flight + slots > self.limit.max_concurrent:
+            return False
+        if self.limit.rate_per_s > 0:
+            self._refill()
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+        self.in_flight += slots
+        self._publish()
+        return True
+
+    def _dispatch(self) -> None:
+        while self._queued:
+            session_id, queue = next(iter(self._queues.items()))
+            if not self._try_admit(queue[0][1]):
+                break
+            fut, _ = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            self._queued -= 1
+            fut.set_result(None)
+        if self._queued and self._timer is None and self._head_fits():
+            # 并发够但卡在令牌桶上：等攒够一个令牌再派发
+            delay = (1.0 - self._tokens) / self.limit.rate_per_s if self.limit.rate_per_s > 0 else 0.0
+            self._timer = asyncio.get_running_loop().call_later(max(delay, 0.001), self._on_timer)
+        self._publish()
+
+    def _head_fits(self) -> bool:
+        slots = next(iter(self._queues.values()))[0][1]
+        return self.in_flight + min(slots, self.limit.max_concurrent) <= self.limit.max_concurrent
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def _forget(self, session_id: str, fut: "asyncio.Future[None]") -> None:
+        queue = self._queues.get(session_id)
+        entry = next((e for e in queue if e[0] is fut), None) if queue is not None else None
+        if queue is not None and entry is not None:
+            queue.remove(entry)
+            self._queued -= 1
+            if not queue:
+                del self._queues[session_id]
+        fut.cancel()
+        self._publish()
+
+    def _publish(self) -> None:
+        set_gauge("llm_admission_queue_depth", self._queued, provider=self.provider)
+        set_gauge("llm_admission_in_flight", self.in_flight, provider=self.provider)
+
+
+_controllers: dict[str, AdmissionController] = {}
+_subscribed = False
+
+
+def _reconfigure(new: Any, old: Any) -> None:
+    if old is not None and new.limits == old.limits:
+        return
+    # 回调可能在任意线程触发，交回事件循环再改状态
+    for provider, ctrl in list(_controllers.items()):
+        limit = new.limits.get(provider) or new.limits["default"]
+        if ctrl.loop is not None and not ctrl.loop.is_closed():
+            ctrl.loop.call_soon_threadsafe(ctrl.configure, limit)
+    _logger.info("LLM 并发/排队限制已更新")
+
+
+def get_controller(provider: str) -> AdmissionController:
+    global _subscribed
+    ctrl = _controllers.get(provider)
+    if ctrl is None:
+        if not _subscribed:
+            subscribe(_reconfigure)
+            _subscribed = True
+        ctrl = AdmissionController(provider, get_provider_limit(provider))
+        _controllers[provider] = ctrl
+    return ctrl
@@ -1,28 +1,121 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import html
 import json
+import re
+import threading
+import time
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
-
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse
-from fastapi.staticfiles import StaticFiles
+from typing import Any, AsyncIterator
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from pydantic import BaseModel, Field
 
+from config.loader import get_presign_config, install_sighup_reload
 from config.log import get_logger
-from storage.oss_storage import OssStorage
+from config.metrics import render_prometheus, set_gauge
+from novel_gen.chapters import MAX_CONCURRENCY as MAX_CHAPTER_CONCURRENCY
+from novel_gen.context import refresh_summary
+from novel_gen.jobs import (
+    TERMINAL_STATES,
+    JobQueueFull,
+    UnknownJobKind,
+    cancel_job,
+    get_job,
+    load_job,
+    submit_job,
+)
+from storage.novels import (
+    advanced_key,
+    chapter_key,
+    file_record_key,
+    load_index,
+    manuscripts_prefix,
+    novel_prefix,
+    read_advanced,
+    read_file_record,
+    read_files,
+    read_novel,
+    read_story,
+    save_novel,
+    story_key,
+)
+from storage.oss_storage import OssStorage, get_shared_storage
+from storage.presign import presign_get, presign_put
+from storage.search_index import index_novel, search
+from web.assets import (
+    IMMUTABLE_CACHE_CONTROL,
+    REVALIDATE_CACHE_CONTROL,
+    StaticAssets,
+    TemplateCache,
+)
+from web.admission import AdmissionRejected, get_controller
+from web.chat_stream import get_stream, parse_last_event_id, start_stream
+from web.middleware import MetricsMiddleware
 
 _logger = get_logger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    yield
+    # 优雅退出：在途请求处理完后再释放共享资源
+    from novel_gen.chat_store import close_chat_store
+    from storage.search_index import close_search_index
+
+    close_chat_store()
+    close_search_index()
+
+
+app = FastAPI(lifespan=_lifespan)
+app.add_middleware(MetricsMiddleware)
 
 BASE_DIR = Path(__file__).resolve().parent
 TEMPLATE_DIR = BASE_DIR / "templates"
 STATIC_DIR = BASE_DIR / "static"
 
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+# kill -HUP <pid> 即可热加载 base.yaml，无需重启 worker
+install_sighup_reload()
+
+@app.exception_handler(AdmissionRejected)
+async def _admission_rejected(request: Request, exc: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(
+        {"detail": "busy", "provider": exc.provider, "retry_after": exc.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(JobQueueFull)
+async def _job_queue_full(request: Request, exc: JobQueueFull) -> JSONResponse:
+    return JSONResponse(
+        {"detail": "busy", "retry_after": exc.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+assets = StaticAssets(STATIC_DIR)
+templates = TemplateCache(TEMPLATE_DIR, assets)
+
+SESSION_COOKIE = "novelai_sid"
+SESSION_MAX_AGE_S = 7 * 24 * 3600
+_SESSION_RE = re.compile(r"[0-9a-f]{32}")
 
 
 class NovelCreateRequest(BaseModel):
@@ -46,131 +139,134 @@ class OptimizeRequest(BaseModel):
     original: str = ""
     instruction: str = ""
     field: str = ""
+    novel_id: str = ""
+    mode: str = "auto"  # auto / edit（只返回修改处）/ rewrite（整篇重写）
+
+
+class UploadRequest(BaseModel):
+    filename: str = Field(min_length=1, max_length=200)
+    content_type: str = Field(default="application/octet-stream", max_length=100)
+    size: int = Field(default=0, ge=0)
+
+
+class UploadCompleteRequest(BaseModel):
+    key: str = Field(min_length=1, max_length=400)
+    filename: str = Field(default="", max_length=200)
+    content_type: str = Field(default="", max_length=100)
 
 
 class ChatSendRequest(BaseModel):
     message: str = ""
     use_search: bool = False
+    novel_id: str = ""
 
 
-def _oss() -> OssStorage:
-    return OssStorage()
-
-
-def _novels_index_key() -> str:
-    return "novels/index.json"
+class JobSubmitRequest(BaseModel):
+    kind: str = Field(min_length=1, max_length=32)
+    params: dict[str, Any] = Field(default_factory=dict)
 
 
-def _novel_prefix(novel_id: str) -> str:
-    return f"novels/{novel_id}"
+def _oss() -> OssStorage:
+    return get_shared_storage()
 
 
-def _story_key(novel_id: str) -> str:
-    return f"{_novel_prefix(novel_id)}/story.json"
+def _session_id(request: Request) -> tuple[str, bool]:
+    # 会话 id 放在 cookie 里（脚本调用也可以用 X-Session-Id 头），返回 (id, 是否新建)
+    sid = request.cookies.get(SESSION_COOKIE) or request.headers.get("x-session-id") or ""
+    if _SESSION_RE.fullmatch(sid):
+        return sid, False
+    return uuid.uuid4().hex, True
 
 
-def _advanced_key(novel_id: str) -> str:
-    return f"{_novel_prefix(novel_id)}/advanced.json"
+def _chat_provider(use_search: bool) -> str:
+    # 自动路由时意图识别本身也走 DashScope，所以只有显式联网才算千帆的名额
+    return "qianfan" if use_search else "dashscope"
 
 
-def _load_index(oss: OssStorage) -> list[dict[str, Any]]:
-    try:
-        raw = oss.get_text(_novels_index_key())
-        data = json.loads(raw)
-        if isinstance(data, list):
-            return data
-        return []
-    except Exception:
-        return []
+def _remember_session(response: Response, sid: str, created: bool) -> None:
+    if created:
+        response.set_cookie(
+            SESSION_COOKIE, sid, max_age=SESSION_MAX_AGE_S, httponly=True, samesite="lax"
+        )
 
 
-def _save_index(oss: OssStorage, items: list[dict[str, Any]]) -> None:
-    payload = json.dumps(items, ensure_ascii=False, indent=2)
-    oss.put_text(_novels_index_key(), payload)
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match") or ""
+    return any(tag.strip() in (etag, f"W/{etag}", "*") for tag in header.split(","))
 
 
-def _find_novel(index: list[dict[str, Any]], novel_id: str) -> dict[str, Any] | None:
-    for item in index:
-        if item.get("id") == novel_id:
-            return item
-    return None
+def _html_response(request: Request, body: str) -> Response:
+    # 页面很小，按内容算 ETag；重复访问直接 304
+    etag = f'"{hashlib.sha1(body.encode("utf-8")).hexdigest()[:16]}"'
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
 
 
 @app.get("/", response_class=HTMLResponse)
-def home() -> str:
-    return (TEMPLATE_DIR / "index.html").read_text(encoding="utf-8")
+def home(request: Request) -> Response:
+    return _html_response(request, templates.parts("index.html")[0])
 
 
 @app.get("/novel/{novel_id}", response_class=HTMLResponse)
-def novel_page(novel_id: str) -> str:
-    html = (TEMPLATE_DIR / "novel.html").read_text(encoding="utf-8")
-    return html.replace("{{NOVEL_ID}}", novel_id)
+def novel_page(request: Request, novel_id: str) -> Response:
+    parts = templates.parts("novel.html", "{{NOVEL_ID}}")
+    return _html_response(request, html.escape(novel_id).join(parts))
+
+
+@app.get("/static/{path:path}")
+def static_file(request: Request, path: str) -> Response:
+    asset, fingerprinted = assets.lookup(path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="not_found")
+    headers = {
+        "ETag": asset.etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if fingerprinted else REVALIDATE_CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if _etag_matches(request, asset.etag):
+        return Response(status_code=304, headers=headers)
+    body, encoding = asset.select(request.headers.get("accept-encoding") or "")
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset.media_type, headers=headers)
 
 
 @app.get("/api/novels")
 def list_novels() -> list[dict[str, Any]]:
     oss = _oss()
-    return _load_index(oss)
+    return load_index(oss)
 
 
 @app.post("/api/novels")
 def create_novel(payload: NovelCreateRequest) -> dict[str, Any]:
     oss = _oss()
-    index = _load_index(oss)
     novel_id = uuid.uuid4().hex
     now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
     item = {"id": novel_id, "title": payload.title.strip(), "created_at": now}
-    index.append(item)
-    _save_index(oss, index)
-    placeholder_key = f"{_novel_prefix(novel_id)}/.keep"
+    save_novel(oss, item)
+    placeholder_key = f"{novel_prefix(novel_id)}/.keep"
     oss.put_text(placeholder_key, "placeholder")
+    index_novel(novel_id, {"title": item["title"]})
     return item
 
 
 @app.get("/api/novels/{novel_id}")
 def get_novel(novel_id: str) -> dict[str, Any]:
     oss = _oss()
-    index = _load_index(oss)
-    item = _find_novel(index, novel_id)
+    item = read_novel(oss, novel_id)
     if item is None:
         raise HTTPException(status_code=404, detail="novel_not_found")
-    story = {"background": "", "mainline": "", "darkline": ""}
-    advanced = {"style": "", "core_design": "", "reversal": "", "highlights": ""}
-    try:
-        raw = oss.get_text(_story_key(novel_id))
-        data = json.loads(raw)
-        if isinstance(data, dict):
-            story.update(
-                {
-                    "background": str(data.get("background", "")),
-                    "mainline": str(data.get("mainline", "")),
-                    "darkline": str(data.get("darkline", "")),
-                }
-            )
-    except Exception:
-        pass
-    try:
-        raw = oss.get_text(_advanced_key(novel_id))
-        data = json.loads(raw)
-        if isinstance(data, dict):
-            advanced.update(
-                {
-                    "style": str(data.get("style", "")),
-                    "core_design": str(data.get("core_design", "")),
-                    "reversal": str(data.get("reversal", "")),
-                    "highlights": str(data.get("highlights", "")),
-                }
-            )
-    except Exception:
-        pass
+    story = read_story(oss, novel_id)
+    advanced = read_advanced(oss, novel_id)
     return {"novel": item, "story": story, "advanced": advanced}
 
 
 @app.post("/api/novels/{novel_id}/story")
 def save_story(novel_id: str, payload: StoryPayload) -> dict[str, Any]:
     oss = _oss()
-    index = _load_index(oss)
-    item = _find_novel(index, novel_id)
+    item = read_novel(oss, novel_id)
     if item is None:
         raise HTTPException(status_code=404, detail="novel_not_found")
     data = {
@@ -178,15 +274,16 @@ def save_story(novel_id: str, payload: StoryPayload) -> dict[str, Any]:
         "mainline": payload.mainline,
         "darkline": payload.darkline,
     }
-    oss.put_text(_story_key(novel_id), json.dumps(data, ensure_ascii=False, indent=2))
+    oss.put_json(story_key(novel_id), data)
+    refresh_summary(novel_id)
+    index_novel(novel_id, {"title": str(item.get("title") or ""), **data})
     return {"ok": True}
 
 
 @app.post("/api/novels/{novel_id}/advanced")
 def save_advanced(novel_id: str, payload: AdvancedPayload) -> dict[str, Any]:
     oss = _oss()
-    index = _load_index(oss)
-    item = _find_novel(index, novel_id)
+    item = read_novel(oss, novel_id)
     if item is None:
         raise HTTPException(status_code=404, detail="novel_not_found")
     data = {
@@ -195,62 +292,491 @@ def save_advanced(novel_id: str, payload: AdvancedPayload) -> dict[str, Any]:
         "reversal": payload.reversal,
         "highlights": payload.highlights,
     }
-    oss.put_text(_advanced_key(novel_id), json.dumps(data, ensure_ascii=False, indent=2))
+    oss.put_json(advanced_key(novel_id), data)
+    refresh_summary(novel_id)
+    index_novel(novel_id, {"title": str(item.get("title") or ""), **data})
     return {"ok": True}
 
 
-@app.post("/api/optimize")
-def optimize(payload: OptimizeRequest) -> dict[str, Any]:
-    from novel_gen import optimize_text
+@app.get("/api/search")
+def search_novels(q: str = "", limit: int = 20) -> dict[str, Any]:
+    if len(q) > 100:
+        raise HTTPException(status_code=400, detail="query_too_long")
+    return search(q, limit=limit)
+
+
+@app.get("/api/novels/{novel_id}/chapters")
+def get_chapters(novel_id: str) -> dict[str, Any]:
+    from novel_gen.chapters import chapter_status
+
+    oss = _oss()
+    if read_novel(oss, novel_id) is None:
+        raise HTTPException(status_code=404, detail="not_found")
+    return chapter_status(novel_id)
+
+
+@app.get("/api/novels/{novel_id}/chapters/{index}", response_class=PlainTextResponse)
+def get_chapter_text(novel_id: str, index: int) -> PlainTextResponse:
+    # 生成中的章节也能读到已经追加写入的部分
+    data = _oss().get_bytes(chapter_key(novel_id, index))
+    if data is None:
+        raise HTTPException(status_code=404, detail="not_found")
+    return PlainTextResponse(data.decode("utf-8", errors="replace"))
 
-    text = optimize_text(
-        original=payload.original,
-        instruction=payload.instruction,
-        field=payload.field,
+
+@app.get("/api/novels/{novel_id}/chapters/{index}/download")
+def download_chapter(novel_id: str, index: int) -> RedirectResponse:
+    # 大文本直接让浏览器去 OSS/CDN 取，应用进程只签个名；书或章节不存在时先 404，不签空链接
+    oss = _oss()
+    if read_novel(oss, novel_id) is None or oss.head(chapter_key(novel_id, index)) is None:
+        raise HTTPException(status_code=404, detail="not_found")
+    signed = presign_get(
+        chapter_key(novel_id, index),
+        filename=f"第{index}章.txt",
+        content_type="text/plain; charset=utf-8",
     )
-    return {"text": text}
+    return RedirectResponse(signed.url, status_code=307)
+
+
+# ---- 稿件等大文件：浏览器拿预签名 URL 直传 OSS，传完回调登记 ----
+
+_UNSAFE_NAME_RE = re.compile(r"[^\w.\-]+")
+
+
+def _manuscript_key(novel_id: str, filename: str) -> str:
+    name = _UNSAFE_NAME_RE.sub("_", Path(filename).name).strip("._") or "file"
+    return f"{manuscripts_prefix(novel_id)}/{uuid.uuid4().hex[:12]}-{name[-80:]}"
+
+
+def _check_file_key(novel_id: str, key: str) -> str:
+    if not key.startswith(f"{manuscripts_prefix(novel_id)}/") or ".." in key:
+        raise HTTPException(status_code=400, detail="invalid_key")
+    return key
+
+
+@app.post("/api/novels/{novel_id}/uploads")
+def create_upload(novel_id: str, payload: UploadRequest) -> dict[str, Any]:
+    if read_novel(_oss(), novel_id) is None:
+        raise HTTPException(status_code=404, detail="novel_not_found")
+    max_bytes = int(get_presign_config().max_upload_mb * 1024 * 1024)
+    if payload.size > max_bytes:
+        raise HTTPException(status_code=413, detail="upload_too_large")
+    key = _manuscript_key(novel_id, payload.filename)
+    signed = presign_put(key, content_type=payload.content_type or "application/octet-stream")
+    return {"key": key, **signed.to_dict()}
+
+
+@app.post("/api/novels/{novel_id}/uploads/complete")
+def complete_upload(novel_id: str, payload: UploadCompleteRequest) -> dict[str, Any]:
+    # 签名 PUT 限制不了大小，这里按 OSS 上的实际对象核对，超限的直接删掉
+    key = _check_file_key(novel_id, payload.key)
+    oss = _oss()
+    if read_novel(oss, novel_id) is None:
+        raise HTTPException(status_code=404, detail="novel_not_found")
+    info = oss.head(key)
+    if info is None:
+        raise HTTPException(status_code=404, detail="upload_not_found")
+    if info.size > get_presign_config().max_upload_mb * 1024 * 1024:
+        oss.delete(key)
+        raise HTTPException(status_code=413, detail="upload_too_large")
+
+    now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    record = {
+        "key": key,
+        "name": payload.filename or key.rsplit("/", 1)[-1],
+        "size": info.size,
+        "etag": info.etag,
+        "content_type": payload.content_type,
+        "uploaded_at": now,
+    }
+    # 登记只写本稿件自己的记录，不碰全局 index.json，并发上传之间不会互相丢更新
+    oss.put_json(file_record_key(novel_id, key), record)
+    return record
+
+
+@app.get("/api/novels/{novel_id}/files")
+def list_files(novel_id: str) -> dict[str, Any]:
+    # 只返回登记记录；下载链接在点击时由 /files/download 现签，列表不再逐个签名
+    return {"files": read_files(_oss(), novel_id)}
+
+
+@app.get("/api/novels/{novel_id}/files/download")
+def download_file(novel_id: str, key: str) -> RedirectResponse:
+    key = _check_file_key(novel_id, key)
+    record = read_file_record(_oss(), novel_id, key)
+    if record is None:
+        raise HTTPException(status_code=404, detail="not_found")
+    signed = presign_get(key, filename=str(record.get("name") or ""))
+    return RedirectResponse(signed.url, status_code=307)
+
+
+@app.delete("/api/novels/{novel_id}/files")
+def delete_file(novel_id: str, key: str) -> dict[str, Any]:
+    key = _check_file_key(novel_id, key)
+    oss = _oss()
+    if read_file_record(oss, novel_id, key) is None:
+        raise HTTPException(status_code=404, detail="not_found")
+    oss.delete(file_record_key(novel_id, key))
+    oss.delete(key)
+    return {"ok": True}
+
+
+@app.post("/api/optimize")
+async def optimize(payload: OptimizeRequest, request: Request) -> dict[str, Any]:
+    from novel_gen import OPTIMIZE_MODES, OptimizeTruncated, optimize_detailed
+
+    if payload.mode not in OPTIMIZE_MODES:
+        raise HTTPException(status_code=400, detail="invalid_mode")
+    sid, _ = _session_id(request)
+    async with get_controller("dashscope").slot(sid):
+        try:
+            return await run_in_threadpool(
+                optimize_detailed,
+                original=payload.original,
+                instruction=payload.instruction,
+                field=payload.field,
+                novel_id=payload.novel_id,
+                mode=payload.mode,
+            )
+        except OptimizeTruncated as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
 
 
 @app.get("/api/chat/history")
-def chat_history() -> dict[str, Any]:
-    from novel_gen.chat import get_history
+def chat_history(
+    request: Request, response: Response, limit: int = 0, before: int | None = None
+) -> dict[str, Any]:
+    from novel_gen.chat import get_history, get_history_page
 
-    return {"messages": get_history()}
+    sid, created = _session_id(request)
+    _remember_session(response, sid, created)
+    if limit > 0:
+        # 分页：limit 条一页，before 为上一页第一条消息的 seq
+        return get_history_page(session_id=sid, limit=min(limit, 200), before=before)
+    return {"messages": get_history(session_id=sid)}
 
 
 @app.post("/api/chat/send")
-def chat_send(payload: ChatSendRequest) -> dict[str, Any]:
+async def chat_send(payload: ChatSendRequest, request: Request, response: Response) -> dict[str, Any]:
     from novel_gen.chat import send_message
 
-    assistant = send_message(message=payload.message, use_search=payload.use_search)
+    sid, created = _session_id(request)
+    _remember_session(response, sid, created)
+    async with get_controller(_chat_provider(payload.use_search)).slot(sid):
+        assistant = await run_in_threadpool(
+            send_message,
+            message=payload.message,
+            use_search=payload.use_search,
+            session_id=sid,
+            novel_id=payload.novel_id,
+        )
     return {"assistant": assistant}
 
 
+def _close_quietly(gen: Any) -> None:
+    try:
+        gen.close()
+    except ValueError:
+        # 生成器正在另一个线程里执行，它会在下一个 token 处看到 cancel 标记自行退出
+        pass
+
+
 @app.post("/api/chat/send_stream")
-def chat_send_stream(payload: ChatSendRequest) -> StreamingResponse:
+async def chat_send_stream(payload: ChatSendRequest, request: Request) -> StreamingResponse:
     from novel_gen.chat import send_message_stream
 
-    def gen():
-        for part in send_message_stream(message=payload.message, use_search=payload.use_search):
-            if part:
-                yield part
-
-    return StreamingResponse(
+    sid, created = _session_id(request)
+    controller = get_controller(_chat_provider(payload.use_search))
+    # 先拿到名额再返回响应头，排不上队能立刻给 429；名额一直占到流结束
+    await controller.acquire(sid)
+    started = time.perf_counter()
+    released = False
+
+    def release() -> None:
+        nonlocal released
+        if not released:
+            released = True
+            controller.release(time.perf_counter() - started)
+
+    cancel = threading.Event()
+
+    async def gen() -> AsyncIterator[str]:
+        parts = send_message_stream(
+            message=payload.message,
+            use_search=payload.use_search,
+            session_id=sid,
+            novel_id=payload.novel_id,
+            cancel=cancel,
+        )
+        try:
+            async for part in iterate_in_threadpool(parts):
+                if part:
+                    yield part
+        finally:
+            release()
+            # 客户端断开：生成器停在 yield 上不会再被推进，放到线程里关掉它，
+            # 上游 HTTP 流随之关闭，已生成的部分记为截断；正在等下一个 token 时由 cancel 标记兜底
+            cancel.set()
+            asyncio.get_running_loop().run_in_executor(None, _close_quietly, parts)
+
+    # 生成器还没开始就断开时 finally 不会执行，后台任务兜底归还名额
+    response = StreamingResponse(
         gen(),
         media_type="text/plain; charset=utf-8",
         headers={"Cache-Control": "no-cache"},
+        background=BackgroundTask(release),
+    )
+    _remember_session(response, sid, created)
+    return response
+
+
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@app.post("/api/chat/events")
+async def chat_events(payload: ChatSendRequest, request: Request) -> StreamingResponse:
+    # SSE 版聊天流：route / delta / usage / done / error 事件，增量按小窗口合并后再发
+    from novel_gen.chat import stream_chat_events
+
+    sid, created = _session_id(request)
+    controller = get_controller(_chat_provider(payload.use_search))
+    await controller.acquire(sid)
+    started = time.perf_counter()
+
+    def source(cancel: threading.Event) -> Any:
+        return stream_chat_events(
+            message=payload.message,
+            use_search=payload.use_search,
+            session_id=sid,
+            novel_id=payload.novel_id,
+            cancel=cancel,
+        )
+
+    # 名额跟着生成走而不是跟着连接走：断线重连期间生成继续，结束时归还
+    try:
+        stream = start_stream(
+            source, owner=sid, on_done=lambda: controller.release(time.perf_counter() - started)
+        )
+    except BaseException:
+        # 流没建起来就不会有 on_done，名额在这里还回去
+        controller.release(0.0)
+        raise
+    response = StreamingResponse(
+        stream.follow(), media_type="text/event-stream", headers=_SSE_HEADERS
+    )
+    _remember_session(response, sid, created)
+    return response
+
+
+@app.get("/api/chat/events")
+async def chat_events_resume(request: Request) -> StreamingResponse:
+    # 断线续传：Last-Event-ID（或 ?last_event_id=）形如 “<流 id>-<序号>”，从该序号之后继续推送
+    raw = request.headers.get("last-event-id") or request.query_params.get("last_event_id") or ""
+    stream_id, after = parse_last_event_id(raw)
+    stream = get_stream(stream_id, owner=_session_id(request)[0])
+    if stream is None:
+        raise HTTPException(status_code=404, detail="stream_not_found")
+    return StreamingResponse(
+        stream.follow(after), media_type="text/event-stream", headers=_SSE_HEADERS
     )
 
 
 @app.post("/api/chat/clear")
-def chat_clear() -> dict[str, Any]:
+def chat_clear(request: Request, response: Response) -> dict[str, Any]:
     from novel_gen.chat import clear_history
 
-    clear_history()
+    sid, created = _session_id(request)
+    _remember_session(response, sid, created)
+    clear_history(session_id=sid)
     return {"ok": True}
 
 
+JOB_HEARTBEAT_S = 15.0
+_JOB_POLL_S = 0.25
+_JOB_REMOTE_POLL_S = 1.0
+
+
+def _sse(event: str, data: Any, *, event_id: int | None = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _last_event_id(request: Request) -> int:
+    # EventSource 自动重连时带 Last-Event-ID 头；手动续传可以用 ?last_event_id=
+    raw = request.headers.get("last-event-id") or request.query_params.get("last_event_id") or ""
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        return 0
+
+
+# 后台任务和同步接口共用上游的并发名额：提交时排队拿名额，一直占到任务结束。
+# batch 走供应商的 Batch 接口，不占实时调用的名额
+_JOB_PROVIDERS = {"optimize": "dashscope", "naming": "dashscope", "chapters": "dashscope"}
+
+
+def _job_slots(kind: str, params: dict[str, Any]) -> int:
+    # chapters 任务内部按 concurrency 路并发调用上游，按这个数占名额，否则一个任务就能绕过并发上限
+    if kind != "chapters":
+        return 1
+    try:
+        return min(MAX_CHAPTER_CONCURRENCY, max(1, int(params.get("concurrency") or 3)))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="invalid_concurrency")
+
+
+@app.post("/api/jobs", status_code=202)
+async def job_submit(
+    payload: JobSubmitRequest, request: Request, response: Response
+) -> dict[str, Any]:
+    sid, created = _session_id(request)
+    _remember_session(response, sid, created)
+    provider = _JOB_PROVIDERS.get(payload.kind)
+    controller = get_controller(provider) if provider else None
+    params = payload.params
+    slots = 0
+    if controller is not None:
+        slots = await controller.acquire(sid, slots=_job_slots(payload.kind, params))
+        if payload.kind == "chapters":
+            # 并发上限比请求的小时只分到上限那么多，任务按实际占到的名额并发
+            params = {**params, "concurrency": slots}
+    started = time.perf_counter()
+    try:
+        job = await run_in_threadpool(submit_job, payload.kind, params, owner=sid)
+    except BaseException as exc:
+        if controller is not None:
+            controller.release(0.0, slots=slots)
+        if isinstance(exc, UnknownJobKind):
+            raise HTTPException(status_code=400, detail=str(exc))
+        raise
+    if controller is not None and job.future is not None:
+        loop = asyncio.get_running_loop()
+
+        def release(_: Any) -> None:
+            # 任务在线程池里结束，名额要回到事件循环线程里归还
+            elapsed = time.perf_counter() - started
+            loop.call_soon_threadsafe(lambda: controller.release(elapsed, slots=slots))
+
+        job.future.add_done_callback(release)
+    return job.to_dict(include_result=False)
+
+
+@app.get("/api/jobs/{job_id}")
+def job_status(job_id: str, request: Request) -> dict[str, Any]:
+    data = load_job(job_id, owner=_session_id(request)[0])
+    if data is None:
+        raise HTTPException(status_code=404, detail="job_not_found")
+    data.pop("result", None)
+    return data
+
+
+@app.get("/api/jobs/{job_id}/result")
+def job_result(job_id: str, request: Request) -> dict[str, Any]:
+    data = load_job(job_id, owner=_session_id(request)[0])
+    if data is None:
+        raise HTTPException(status_code=404, detail="job_not_found")
+    if data.get("status") != "succeeded":
+        raise HTTPException(status_code=409, detail=data.get("status") or "unknown")
+    return {"id": job_id, "result": data.get("result")}
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+def job_cancel(job_id: str, request: Request) -> dict[str, Any]:
+    sid = _session_id(request)[0]
+    job = cancel_job(job_id, owner=sid)
+    if job is None:
+        # 只能取消本进程里的任务；其他 worker 的任务或已结束的任务按现状返回
+        data = load_job(job_id, owner=sid)
+        if data is None:
+            raise HTTPException(status_code=404, detail="job_not_found")
+        if data.get("status") not in TERMINAL_STATES:
+            raise HTTPException(status_code=409, detail="job_not_local")
+        data.pop("result", None)
+        return data
+    return job.to_dict(include_result=False)
+
+
+async def _local_job_events(job_id: str, last_id: int) -> AsyncIterator[str]:
+    job = get_job(job_id)
+    assert job is not None
+    idle = 0.0
+    while True:
+        events, gap = job.events_after(last_id)
+        if not events and job.terminal_seq and job.terminal_seq <= last_id:
+            return
+        if gap:
+            # 断线太久，缺的事件已被挤出缓冲区：先补一条当前状态
+            yield _sse("status", job.status_event(), event_id=events[0].seq - 1)
+        for event in events:
+            last_id = event.seq
+            yield _sse(event.type, event.data, event_id=event.seq)
+            if event.type == "status" and event.data.get("status") in TERMINAL_STATES:
+                return
+        if events:
+            idle = 0.0
+        elif idle >= JOB_HEARTBEAT_S:
+            idle = 0.0
+            yield ": ping\n\n"
+        await asyncio.sleep(_JOB_POLL_S)
+        idle += _JOB_POLL_S
+
+
+async def _remote_job_events(job_id: str, last_id: int, owner: str) -> AsyncIterator[str]:
+    # 任务在别的 worker（或已过保留期）：轮询 OSS 上的记录，只推状态快照
+    idle = 0.0
+    while True:
+        data = await run_in_threadpool(load_job, job_id, owner=owner)
+        if data is None:
+            yield _sse("status", {"status": "failed", "error": "job_not_found"})
+            return
+        seq = int(data.get("seq") or 0)
+        status = data.get("status")
+        if seq > last_id or status in TERMINAL_STATES:
+            last_id = max(last_id, seq)
+            keys = ("status", "progress", "message", "error")
+            event = {k: data.get(k) for k in keys}
+            if status == "succeeded":
+                event["result"] = data.get("result")
+            yield _sse("status", event, event_id=last_id)
+            if status in TERMINAL_STATES:
+                return
+            idle = 0.0
+        elif idle >= JOB_HEARTBEAT_S:
+            idle = 0.0
+            yield ": ping\n\n"
+        await asyncio.sleep(_JOB_REMOTE_POLL_S)
+        idle += _JOB_REMOTE_POLL_S
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request) -> StreamingResponse:
+    last_id = _last_event_id(request)
+    sid = _session_id(request)[0]
+    if get_job(job_id, owner=sid) is not None:
+        stream = _local_job_events(job_id, last_id)
+    elif await run_in_threadpool(load_job, job_id, owner=sid) is not None:
+        stream = _remote_job_events(job_id, last_id, sid)
+    else:
+        raise HTTPException(status_code=404, detail="job_not_found")
+    return StreamingResponse(stream, media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    # 同步接口跑在 anyio 线程池里，占用数能区分“慢在线程池排队”还是“慢在下游”
+    from anyio import to_thread
+
+    limiter = to_thread.current_default_thread_limiter()
+    set_gauge("threadpool_borrowed_tokens", limiter.borrowed_tokens)
+    set_gauge("threadpool_total_tokens", limiter.total_tokens)
+    set_gauge("threadpool_waiting_tasks", limiter.statistics().tasks_waiting)
+    return PlainTextResponse(
+        render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 if __name__ == "__main__":
+    # 开发模式（热重载）；生产部署用 python -m web.serve
     import uvicorn
 
     uvicorn.run("web.app:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+from config.log import get_logger
+
+_logger = get_logger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# 小于该大小的文件压缩收益不明显
+_COMPRESS_MIN_BYTES = 1024
+_COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+_STATIC_REF_RE = re.compile(r"""(["'])/static/([^"'?#]+)(?:\?[^"']*)?\1""")
+
+
+def dev_mode() -> bool:
+    return (os.getenv("NOVELAI_DEV") or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _brotli():
+    try:
+        import brotli
+    except Exception:
+        return None
+    return brotli
+
+
+@dataclass(frozen=True)
+class StaticAsset:
+    name: str
+    hashed_name: str
+    etag: str
+    media_type: str
+    body: bytes
+    gzip_body: Optional[bytes]
+    br_body: Optional[bytes]
+    mtime_ns: int
+
+    def select(self, accept_encoding: str) -> tuple[bytes, Optional[str]]:
+        accepted = {p.split(";")[0].strip().lower() for p in (accept_encoding or "").split(",")}
+        if self.br_body is not None and "br" in accepted:
+            return self.br_body, "br"
+        if self.gzip_body is not None and "gzip" in accepted:
+            return self.gzip_body, "gzip"
+        return self.body, None
+
+
+def _build_asset(path: Path, name: str) -> StaticAsset:
+    body = path.read_bytes()
+    digest = hashlib.sha256(body).hexdigest()[:12]
+    stem, dot, suffix = name.rpartition(".")
+    hashed_name = f"{stem}.{digest}.{suffix}" if dot else f"{name}.{digest}"
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if media_type.startswith("text/") or media_type == "application/javascript":
+        media_type = f"{media_type}; charset=utf-8"
+
+    gzip_body: Optional[bytes] = None
+    br_body: Optional[bytes] = None
+    if len(body) >= _COMPRESS_MIN_BYTES and media_type.startswith(_COMPRESSIBLE_TYPES):
+        gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+        brotli = _brotli()
+        if brotli is not None:
+            br_body = brotli.compress(body, quality=11)
+    return StaticAsset(
+        name=name,
+        hashed_name=hashed_name,
+        etag=f'"{digest}"',
+        media_type=media_type,
+        body=body,
+        gzip_body=gzip_body,
+        br_body=br_body,
+        mtime_ns=path.stat().st_mtime_ns,
+    )
+
+
+class StaticAssets:
+    def __init__(self, directory: Path, *, url_prefix: str = "/static") -> None:
+        self.directory = directory.resolve()
+        self.url_prefix = url_prefix.rstrip("/")
+        self._lock = Lock()
+        self._by_name: dict[str, StaticAsset] = {}
+        self._by_hashed: dict[str, StaticAsset] = {}
+        self._scan()
+
+    def _scan(self) -> None:
+        by_name: dict[str, StaticAsset] = {}
+        for path in sorted(self.directory.rglob("*")):
+            if not path.is_file():
+                continue
+            name = path.relative_to(self.directory).as_posix()
+            by_name[name] = _build_asset(path, name)
+        with self._lock:
+            self._by_name = by_name
+            self._by_hashed = {a.hashed_name: a for a in by_name.values()}
+        _logger.info("静态资源已加载 (files=%s, dir=%s)", len(by_name), self.directory)
+
+    def _refresh_if_changed(self) -> None:
+        changed = False
+        for asset in list(self._by_name.values()):
+            try:
+                if (self.directory / asset.name).stat().st_mtime_ns != asset.mtime_ns:
+                    changed = True
+                    break
+            except OSError:
+                changed = True
+                break
+        if changed:
+            self._scan()
+
+    def url_for(self, name: str) -> str:
+        if dev_mode():
+            self._refresh_if_changed()
+        asset = self._by_name.get(name)
+        if asset is None:
+            return f"{self.url_prefix}/{name}"
+        return f"{self.url_prefix}/{asset.hashed_name}"
+
+    def rewrite_html(self, html: str) -> str:
+        return _STATIC_REF_RE.sub(
+            lambda m: f"{m.group(1)}{self.url_for(m.group(2))}{m.group(1)}", html
+        )
+
+    def lookup(self, path: str) -> tuple[Optional[StaticAsset], bool]:
+        # 返回 (资源, 是否为带内容哈希的地址)
+        if dev_mode():
+            self._refresh_if_changed()
+        asset = self._by_hashed.get(path)
+        if asset is not None:
+            return asset, True
+        return self._by_name.get(path), False
+
+
+class TemplateCache:
+    def __init__(self, directory: Path, assets: Optional[StaticAssets] = None) -> None:
+        self.directory = directory
+        self.assets = assets
+        self._cache: dict[tuple[str, str], tuple[str, ...]] = {}
+
+    def _load(self, name: str, placeholder: str) -> tuple[str, ...]:
+        text = (self.directory / name).read_text(encoding="utf-8")
+        if self.assets is not None:
+            text = self.assets.rewrite_html(text)
+        return tuple(text.split(placeholder)) if placeholder else (text,)
+
+    def parts(self, name: str, placeholder: str = "") -> tuple[str, ...]:
+        # 模板只读一次；静态资源地址预先替换为带哈希的地址，并按占位符切分，
+        # 渲染时只做字符串拼接。NOVELAI_DEV=1 时每次请求都重新读取。
+        if dev_mode():
+            return self._load(name, placeholder)
+        key = (name, placeholder)
+        cached = self._cache.get(key)
+        if cached is None:
+            cached = self._load(name, placeholder)
+            self._cache[key] = cached
+        return cached
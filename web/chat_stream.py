@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from config.log import get_logger
+from config.metrics import inc
+
+_logger = get_logger(__name__)
+
+# SSE 聊天流：模型增量不再逐 token 写给客户端，而是在一个很小的时间/字数窗口内合并成一次 flush。
+# 每个流在内存里保留完整的事件序列（回放缓冲区），事件 id 形如 “<流 id>-<序号>”，
+# 断线后带 Last-Event-ID 重连即可从断点继续收，生成本身不受连接影响。
+# 所有状态只在事件循环线程里读写；生成在线程池里跑，结果经 call_soon_threadsafe 送回来。
+# 回放缓冲区只在本进程内：多 worker 部署时续传要靠负载均衡按会话 cookie（novelai_sid）
+# 粘到同一个 worker。落到别的 worker 会 404，前端这时改从聊天存储里读这条回复。
+
+COALESCE_S = 0.05
+COALESCE_CHARS = 512
+HEARTBEAT_S = 15.0
+STREAM_TTL_S = 120.0  # 流结束后回放缓冲区再保留多久
+DISCONNECT_GRACE_S = 10.0  # 最后一个连接断开后等这么久还没人重连，就取消上游生成
+
+EventSource = Callable[[threading.Event], Iterator[tuple[str, dict[str, Any]]]]
+
+
+class ChatStream:
+    def __init__(self, owner: str = "") -> None:
+        self.id = uuid.uuid4().hex
+        self.owner = owner  # 发起会话的 novelai_sid，续传只认这个会话
+        self.events: list[tuple[int, str, str]] = []  # (序号, 事件类型, 已编码的 data)
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Future[None]] = None
+        self.cancel = threading.Event()
+        self.readers = 0
+        self._changed = asyncio.Event()
+        self._grace: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def publish(self, event: str, data: dict[str, Any]) -> None:
+        seq = len(self.events) + 1
+        self.events.append((seq, event, json.dumps(data, ensure_ascii=False)))
+        self._wake()
+
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+        if self._grace is not None:
+            self._grace.cancel()
+            self._grace = None
+        self._wake()
+
+    def _attach(self) -> None:
+        self.readers += 1
+        if self._grace is not None:
+            self._grace.cancel()
+            self._grace = None
+
+    def _detach(self) -> None:
+        self.readers -= 1
+        if self.readers == 0 and not self.finished:
+            loop = asyncio.get_running_loop()
+            self._grace = loop.call_later(DISCONNECT_GRACE_S, self._abandon)
+
+    def _abandon(self) -> None:
+        self._grace = None
+        if self.readers == 0 and not self.finished:
+            _logger.info("聊天流无人接收，取消上游生成 (stream=%s)", self.id)
+            inc("chat_streams_abandoned_total")
+            self.cancel.set()
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def frame(self, index: int) -> str:
+        seq, event, data = self.events[index]
+        return f"id: {self.id}-{seq}\nevent: {event}\ndata: {data}\n\n"
+
+    async def follow(self, after: int = 0) -> AsyncIterator[str]:
+        # after 是客户端已经收到的最后一个序号；空闲太久发注释行心跳，防止代理断开慢的搜索路由
+        # 连接断开时生成器被关闭，finally 里登记离开；宽限期内重连可以接着收
+        sent = after
+        self._attach()
+        try:
+            while True:
+                changed = self._changed
+                while sent < len(self.events):
+                    yield self.frame(sent)
+                    sent += 1
+                if self.finished:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            self._detach()
+
+
+_streams: dict[str, ChatStream] = {}
+
+
+def _prune() -> None:
+    now = time.monotonic()
+    expired = [
+        sid
+        for sid, stream in _streams.items()
+        if stream.finished_at is not None and now - stream.finished_at > STREAM_TTL_S
+    ]
+    for sid in expired:
+        del _streams[sid]
+
+
+async def _pump(
+    stream: ChatStream, source: EventSource, on_done: Optional[Callable[[], None]]
+) -> None:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[Optional[tuple[str, dict[str, Any]]]] = asyncio.Queue()
+
+    def drain() -> None:
+        try:
+            for item in source(stream.cancel):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as exc:
+            _logger.exception("聊天流生成失败 (stream=%s)", stream.id)
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", {"message": str(exc)}))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    worker = asyncio.ensure_future(run_in_threadpool(drain))
+    pending: list[str] = []
+    pending_chars = 0
+    deadline: Optional[float] = None
+    flushes = 0
+
+    def flush() -> None:
+        nonlocal pending_chars, deadline, flushes
+        if pending:
+            stream.publish("delta", {"text": "".join(pending)})
+            pending.clear()
+            pending_chars = 0
+            flushes += 1
+        deadline = None
+
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                flush()
+                continue
+            if item is None:
+                break
+            event, data = item
+            if event != "delta":
+                flush()
+                stream.publish(event, data)
+                continue
+            text = data.get("text") or ""
+            if not text:
+                continue
+            pending.append(text)
+            pending_chars += len(text)
+            if deadline is None:
+                deadline = loop.time() + COALESCE_S
+            if pending_chars >= COALESCE_CHARS:
+                flush()
+        flush()
+        await worker
+    finally:
+        stream.finish()
+        inc("chat_stream_flushes_total", flushes)
+        if on_done is not None:
+            on_done()
+
+
+def start_stream(
+    source: EventSource, *, owner: str = "", on_done: Optional[Callable[[], None]] = None
+) -> ChatStream:
+    # 生成跑在后台任务里，跟某一个 HTTP 连接解耦；on_done 在生成结束时调用（用于归还准入名额）
+    _prune()
+    stream = ChatStream(owner)
+    _streams[stream.id] = stream
+    stream.task = asyncio.ensure_future(_pump(stream, source, on_done))
+    inc("chat_streams_total")
+    return stream
+
+
+def parse_last_event_id(value: str) -> tuple[str, int]:
+    stream_id, _, seq = (value or "").strip().rpartition("-")
+    try:
+        return stream_id, max(0, int(seq))
+    except ValueError:
+        return "", 0
+
+
+def get_stream(stream_id: str, *, owner: Optional[str] = None) -> Optional[ChatStream]:
+    # 传了 owner 时只返回该会话发起的流，别人的流一律当作不存在
+    _prune()
+    stream = _streams.get(stream_id)
+    if stream is None or (owner is not None and stream.owner != owner):
+        return None
+    return stream
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import time
+from typing import Any, Awaitable, Callable
+
+from config.metrics import observe
+
+Scope = dict[str, Any]
+Message = dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+class MetricsMiddleware:
+    # 纯 ASGI 中间件：不包装响应体，流式响应也只多一次计时。
+    # 路由按模板（如 /api/novels/{novel_id}）聚合，避免标签基数爆炸。
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500, "first_byte": 0.0}
+
+        async def send_wrapper(message: Message) -> None:
+            if message.get("type") == "http.response.start":
+                status["code"] = int(message.get("status") or 500)
+                status["first_byte"] = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            ended = time.perf_counter()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            labels = {
+                "method": scope.get("method", ""),
+                "route": path,
+                "status": str(status["code"]),
+            }
+            observe("http_request_seconds", ended - started, **labels)
+            if status["first_byte"]:
+                observe("http_time_to_headers_seconds", status["first_byte"] - started, **labels)
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import Optional
+
+from config.loader import get_server_config
+from config.log import get_logger
+
+_logger = get_logger(__name__)
+
+# 生产启动：多 worker、无热重载、SIGTERM 时等在途请求处理完再退出。
+# 会话状态必须放在进程外（server.chat_store），否则同一用户的请求落到不同 worker 会“失忆”。
+# 聊天 SSE 的续传缓冲区仍在进程内，负载均衡要按 novelai_sid 做粘性会话（见 web/chat_stream.py）。
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    cfg = get_server_config()
+    parser = argparse.ArgumentParser(prog="python -m web.serve", description="生产模式启动 web 服务")
+    parser.add_argument("--host", default=cfg.host)
+    parser.add_argument("--port", type=int, default=cfg.port)
+    parser.add_argument("--workers", type=int, default=cfg.workers)
+    parser.add_argument(
+        "--graceful-timeout", type=float, default=cfg.graceful_timeout_s,
+        help="收到 SIGTERM 后等待在途请求的最长秒数",
+    )
+    args = parser.parse_args(argv)
+
+    workers = max(1, args.workers)
+    store = cfg.chat_store
+    if workers > 1 and store == "memory":
+        _logger.error(
+            "多 worker 模式不能使用进程内聊天存储，请配置 server.chat_store "
+            "（如 sqlite:data/chat.db 或 redis://host:6379/0）"
+        )
+        return 2
+
+    import uvicorn
+
+    _logger.info(
+        "生产模式启动 (host=%s, port=%s, workers=%s, chat_store=%s)",
+        args.host, args.port, workers, store.split("://", 1)[0],
+    )
+    # 多 worker 时由 uvicorn 主进程管理：SIGHUP 逐个重启 worker，SIGTERM 优雅退出
+    uvicorn.run(
+        "web.app:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        reload=False,
+        proxy_headers=True,
+        timeout_graceful_shutdown=args.graceful_timeout or None,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
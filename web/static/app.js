@@ -1,3 +1,11 @@
+function requestError(res, fallback) {
+  if (res.status === 429) {
+    const retry = res.headers.get("Retry-After") || "几";
+    return new Error(`服务繁忙，请 ${retry} 秒后重试`);
+  }
+  return new Error(fallback);
+}
+
 const api = {
   async listNovels() {
     const res = await fetch("/api/novels");
@@ -17,6 +25,13 @@ const api = {
     }
     return res.json();
   },
+  async search(query) {
+    const res = await fetch(`/api/search?q=${encodeURIComponent(query)}&limit=20`);
+    if (!res.ok) {
+      throw requestError(res, "搜索失败");
+    }
+    return res.json();
+  },
   async getNovel(id) {
     const res = await fetch(`/api/novels/${id}`);
     if (!res.ok) {
@@ -46,19 +61,106 @@ const api = {
     }
     return res.json();
   },
+  async submitJob(kind, params) {
+    const res = await fetch("/api/jobs", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ kind, params }),
+    });
+    if (!res.ok) {
+      throw requestError(res, "job_failed");
+    }
+    return res.json();
+  },
+  waitJob(id, onProgress) {
+    // EventSource 断线会带 Last-Event-ID 自动重连，服务端从断点补发，生成结果不会丢
+    return new Promise((resolve, reject) => {
+      const source = new EventSource(`/api/jobs/${id}/events`);
+      source.addEventListener("progress", (e) => {
+        if (onProgress) onProgress(JSON.parse(e.data));
+      });
+      source.addEventListener("status", (e) => {
+        const data = JSON.parse(e.data);
+        if (data.status === "succeeded") {
+          source.close();
+          resolve(data.result || {});
+        } else if (data.status === "failed" || data.status === "cancelled") {
+          source.close();
+          reject(new Error(data.error || data.status));
+        }
+      });
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+          reject(new Error("job_failed"));
+        }
+      };
+    });
+  },
   async optimize(payload) {
-    const res = await fetch("/api/optimize", {
+    const job = await api.submitJob("optimize", payload);
+    return api.waitJob(job.id);
+  },
+  async listFiles(id) {
+    const res = await fetch(`/api/novels/${id}/files`);
+    if (!res.ok) {
+      throw new Error("load_failed");
+    }
+    return res.json();
+  },
+  async uploadFile(id, file, onProgress) {
+    // 先要一个签名 PUT 地址，文件直接传到 OSS，传完再通知服务端登记
+    const contentType = file.type || "application/octet-stream";
+    const res = await fetch(`/api/novels/${id}/uploads`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify(payload),
+      body: JSON.stringify({ filename: file.name, content_type: contentType, size: file.size }),
+    });
+    if (res.status === 413) {
+      throw new Error("文件太大");
+    }
+    if (!res.ok) {
+      throw requestError(res, "上传失败");
+    }
+    const signed = await res.json();
+    await new Promise((resolve, reject) => {
+      // fetch 拿不到上传进度，这里用 XHR
+      const xhr = new XMLHttpRequest();
+      xhr.open(signed.method, signed.url);
+      Object.entries(signed.headers || {}).forEach(([name, value]) => {
+        xhr.setRequestHeader(name, value);
+      });
+      xhr.upload.onprogress = (e) => {
+        if (onProgress && e.lengthComputable) onProgress(e.loaded / e.total);
+      };
+      xhr.onload = () => (xhr.status < 300 ? resolve() : reject(new Error("上传失败")));
+      xhr.onerror = () => reject(new Error("上传失败"));
+      xhr.send(file);
+    });
+    const done = await fetch(`/api/novels/${id}/uploads/complete`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ key: signed.key, filename: file.name, content_type: contentType }),
+    });
+    if (done.status === 413) {
+      throw new Error("文件太大");
+    }
+    if (!done.ok) {
+      throw new Error("上传失败");
+    }
+    return done.json();
+  },
+  async deleteFile(id, key) {
+    const res = await fetch(`/api/novels/${id}/files?key=${encodeURIComponent(key)}`, {
+      method: "DELETE",
     });
     if (!res.ok) {
-      throw new Error("optimize_failed");
+      throw new Error("delete_failed");
     }
     return res.json();
   },
-  async getChatHistory() {
-    const res = await fetch("/api/chat/history");
+  async getChatHistory(before) {
+    const query = before === undefined || before === null ? "" : `&before=${before}`;
+    const res = await fetch(`/api/chat/history?limit=${CHAT_PAGE_SIZE}${query}`);
     if (!res.ok) {
       throw new Error("chat_failed");
     }
@@ -71,7 +173,7 @@ const api = {
       body: JSON.stringify({ message }),
     });
     if (!res.ok) {
-      throw new Error("chat_failed");
+      throw requestError(res, "chat_failed");
     }
     return res.json();
   },
@@ -88,11 +190,13 @@ const dom = {
   novelList: document.getElementById("novel-list"),
   createBtn: document.getElementById("create-btn"),
   titleInput: document.getElementById("novel-title"),
+  searchInput: document.getElementById("novel-search"),
   saveBtn: document.getElementById("save-btn"),
   status: document.getElementById("status"),
   optimizeModal: document.getElementById("optimize-modal"),
   optimizePrompt: document.getElementById("optimize-prompt"),
   optimizeResult: document.getElementById("optimize-result"),
+  optimizeDiff: document.getElementById("optimize-diff"),
   optimizeSubmit: document.getElementById("optimize-submit"),
   optimizeApply: document.getElementById("optimize-apply"),
   optimizeRevert: document.getElementById("optimize-revert"),
@@ -120,6 +224,13 @@ function escapeHtml(value) {
     .replaceAll("'", "&#39;");
 }
 
+function formatSize(bytes) {
+  const n = Number(bytes) || 0;
+  if (n < 1024) return `${n} B`;
+  if (n < 1024 * 1024) return `${(n / 1024).toFixed(1)} KB`;
+  return `${(n / 1024 / 1024).toFixed(1)} MB`;
+}
+
 function markdownToHtml(markdown) {
   const escaped = escapeHtml(markdown || "");
   const parts = escaped.split("```");
@@ -213,49 +324,263 @@ async function copyTextToClipboard(text) {
 }
 
 let globalChatMessages = null;
+// 聊天记录按页加载：先取最近一页，滚到顶部再往前翻；chatHistoryBefore 是已加载的第一条的 seq，
+// 服务端没有更早的消息时为 null
+const CHAT_PAGE_SIZE = 20;
+const CHAT_MAX_LOADED = 200;
+let chatHistoryBefore = null;
+let chatHistoryLoading = false;
+let chatKeySeq = 0;
+// 消息 key -> 对应的 DOM 节点；流式输出时只改正在生成的那一个气泡，不重建整段历史
+const chatNodes = new Map();
+
+const THINKING_HTML =
+  '<span class="thinking">正在思考<span class="thinking-dots"><span>.</span><span>.</span><span>.</span></span></span>';
+const COPY_ICON_HTML =
+  '<svg viewBox="0 0 24 24" fill="none" aria-hidden="true"><path d="M9 9h10v11a1 1 0 0 1-1 1H10a1 1 0 0 1-1-1V9Z" stroke="currentColor" stroke-width="1.6" stroke-linejoin="round"/><path d="M6 15H5a1 1 0 0 1-1-1V4a1 1 0 0 1 1-1h10a1 1 0 0 1 1 1v1" stroke="currentColor" stroke-width="1.6" stroke-linecap="round"/></svg>';
+
+function chatKey(m) {
+  if (m.id === undefined || m.id === null) {
+    chatKeySeq += 1;
+    m.id = `m${chatKeySeq}`;
+  }
+  return m.id;
+}
+
+// 只追加的 markdown 渲染：按代码块之外的空行切块，已经结束的块渲染一次后不再动，
+// 每帧只重新解析末尾还没写完的那一块，单帧开销和消息总长度无关
+function createStreamingMarkdown(bubble) {
+  const committedNode = document.createElement("div");
+  const tailNode = document.createElement("div");
+  committedNode.className = "md-stream";
+  tailNode.className = "md-stream";
+  bubble.replaceChildren(committedNode, tailNode);
+  const boundary = /```|\n\n/g;
+  let committed = 0;
+  let scanFrom = 0;
+  let inFence = false;
+  let length = 0;
+  return {
+    update(text) {
+      if (text.length < length) {
+        committedNode.innerHTML = "";
+        committed = 0;
+        scanFrom = 0;
+        inFence = false;
+      }
+      length = text.length;
+      boundary.lastIndex = scanFrom;
+      let chunk = "";
+      let match;
+      while ((match = boundary.exec(text)) !== null) {
+        scanFrom = boundary.lastIndex;
+        if (match[0] === "```") {
+          inFence = !inFence;
+        } else if (!inFence) {
+          chunk += markdownToHtml(text.slice(committed, scanFrom));
+          committed = scanFrom;
+        }
+      }
+      if (chunk) committedNode.insertAdjacentHTML("beforeend", chunk);
+      tailNode.innerHTML = markdownToHtml(text.slice(committed));
+    },
+  };
+}
+
+function createChatNode(m) {
+  const key = chatKey(m);
+  const wrapper = document.createElement("div");
+  wrapper.className = `chat-msg ${m.role === "user" ? "user" : "assistant"}`;
+  const meta = document.createElement("div");
+  meta.className = "chat-meta";
+  meta.textContent = m.role === "user" ? "你" : "AI";
+  const bubble = document.createElement("div");
+  bubble.className = "chat-bubble";
+  const actions = document.createElement("div");
+  actions.className = "chat-actions-row";
+  const copyBtn = document.createElement("button");
+  copyBtn.type = "button";
+  copyBtn.className = "chat-copy";
+  copyBtn.setAttribute("title", "复制");
+  copyBtn.setAttribute("aria-label", "复制");
+  copyBtn.innerHTML = COPY_ICON_HTML;
+  copyBtn.addEventListener("click", async (e) => {
+    e.preventDefault();
+    e.stopPropagation();
+    const node = chatNodes.get(key);
+    const ok = await copyTextToClipboard(node ? node.content : "");
+    showToast(ok ? "已复制" : "复制失败", ok ? "success" : "error");
+  });
+  actions.appendChild(copyBtn);
+  wrapper.appendChild(meta);
+  wrapper.appendChild(bubble);
+  wrapper.appendChild(actions);
+  const node = { wrapper, meta, bubble, copyBtn, content: null, loading: null, truncated: null, stream: null };
+  chatNodes.set(key, node);
+  patchChatNode(node, m);
+  return node;
+}
+
+function patchChatNode(node, m) {
+  const content = String(m.content || "");
+  const loading = Boolean(m.loading);
+  const truncated = Boolean(m.truncated);
+  if (node.content === content && node.loading === loading && node.truncated === truncated) return;
+  if (loading) {
+    node.stream = null;
+    node.bubble.innerHTML = THINKING_HTML;
+  } else if (m.streaming) {
+    if (!node.stream) node.stream = createStreamingMarkdown(node.bubble);
+    node.stream.update(content);
+  } else if (!node.stream || !content.startsWith(node.content || "")) {
+    node.stream = null;
+    node.bubble.innerHTML = markdownToHtml(content);
+  } else {
+    // 流式结束：已有的增量渲染结果就是完整内容，补上最后一段即可
+    node.stream.update(content);
+  }
+  // 生成中途断开、只保存了部分内容的回复
+  node.meta.textContent = `${m.role === "user" ? "你" : "AI"}${truncated ? " · 已中断" : ""}`;
+  node.truncated = truncated;
+  node.content = content;
+  node.loading = loading;
+  node.copyBtn.disabled = loading || content.trim().length === 0;
+}
+
+function chatPinnedToBottom() {
+  const el = dom.chatHistory;
+  return el.scrollHeight - el.scrollTop - el.clientHeight < 48;
+}
 
 function renderChatHistory() {
   if (!dom.chatHistory) return;
   const messages = globalChatMessages || [];
-  dom.chatHistory.innerHTML = "";
+  const pinned = chatPinnedToBottom();
+  const keep = new Set(messages.map(chatKey));
+  chatNodes.forEach((node, key) => {
+    if (!keep.has(key)) {
+      node.wrapper.remove();
+      chatNodes.delete(key);
+    }
+  });
+  let cursor = dom.chatHistory.firstChild;
   messages.forEach((m) => {
-    const wrapper = document.createElement("div");
-    wrapper.className = `chat-msg ${m.role === "user" ? "user" : "assistant"}`;
-    const meta = document.createElement("div");
-    meta.className = "chat-meta";
-    meta.textContent = m.role === "user" ? "你" : "AI";
-    const bubble = document.createElement("div");
-    bubble.className = "chat-bubble";
-    if (m.loading) {
-      bubble.innerHTML =
-        '<span class="thinking">正在思考<span class="thinking-dots"><span>.</span><span>.</span><span>.</span></span></span>';
+    const existing = chatNodes.get(chatKey(m));
+    const node = existing || createChatNode(m);
+    if (existing) patchChatNode(node, m);
+    if (node.wrapper !== cursor) {
+      dom.chatHistory.insertBefore(node.wrapper, cursor);
     } else {
-      bubble.innerHTML = markdownToHtml(m.content || "");
-    }
-    const actions = document.createElement("div");
-    actions.className = "chat-actions-row";
-    const copyBtn = document.createElement("button");
-    copyBtn.type = "button";
-    copyBtn.className = "chat-copy";
-    copyBtn.setAttribute("title", "复制");
-    copyBtn.setAttribute("aria-label", "复制");
-    copyBtn.innerHTML =
-      '<svg viewBox="0 0 24 24" fill="none" aria-hidden="true"><path d="M9 9h10v11a1 1 0 0 1-1 1H10a1 1 0 0 1-1-1V9Z" stroke="currentColor" stroke-width="1.6" stroke-linejoin="round"/><path d="M6 15H5a1 1 0 0 1-1-1V4a1 1 0 0 1 1-1h10a1 1 0 0 1 1 1v1" stroke="currentColor" stroke-width="1.6" stroke-linecap="round"/></svg>';
-    const rawCopyText = String(m.content || "");
-    copyBtn.disabled = Boolean(m.loading) || rawCopyText.trim().length === 0;
-    copyBtn.addEventListener("click", async (e) => {
-      e.preventDefault();
-      e.stopPropagation();
-      const ok = await copyTextToClipboard(rawCopyText);
-      showToast(ok ? "已复制" : "复制失败", ok ? "success" : "error");
+      cursor = cursor.nextSibling;
+    }
+  });
+  if (pinned) dom.chatHistory.scrollTop = dom.chatHistory.scrollHeight;
+}
+
+function renderChatMessage(m) {
+  // 单条消息的增量更新，只碰这一个节点
+  if (!dom.chatHistory) return;
+  const node = chatNodes.get(chatKey(m));
+  if (!node) {
+    renderChatHistory();
+    return;
+  }
+  const pinned = chatPinnedToBottom();
+  patchChatNode(node, m);
+  if (pinned) dom.chatHistory.scrollTop = dom.chatHistory.scrollHeight;
+}
+
+async function recoverChatReply(userText) {
+  // SSE 续传只能回到生成所在的 worker；落到别的 worker（或流已过期）时 404，
+  // 这时等回复写进聊天存储后从历史里取：末尾是本次的提问 + 一条 AI 回复
+  for (let attempt = 0; attempt < 20; attempt += 1) {
+    try {
+      const page = await api.getChatHistory();
+      const messages = Array.isArray(page.messages) ? page.messages : [];
+      const last = messages[messages.length - 1];
+      const prev = messages[messages.length - 2];
+      if (last && last.role === "assistant" && prev && prev.role === "user" && prev.content === userText) {
+        return last;
+      }
+    } catch (e) {
+      // 历史接口偶发失败时继续等
+    }
+    await new Promise((resolve) => setTimeout(resolve, 1500));
+  }
+  return null;
+}
+
+async function readSse(res, onEvent) {
+  // 解析 text/event-stream：按空行分帧，注释行（心跳）忽略
+  if (!res.body) throw new Error("chat_stream_unsupported");
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder("utf-8");
+  let buffer = "";
+  const dispatch = (frame) => {
+    let event = "message";
+    let id = "";
+    const data = [];
+    frame.split("\n").forEach((line) => {
+      if (line.startsWith("event:")) event = line.slice(6).trim();
+      else if (line.startsWith("id:")) id = line.slice(3).trim();
+      else if (line.startsWith("data:")) data.push(line.slice(5).replace(/^ /, ""));
+    });
+    if (data.length) onEvent(event, JSON.parse(data.join("\n")), id);
+  };
+  while (true) {
+    let chunk;
+    try {
+      chunk = await reader.read();
+    } catch (e) {
+      throw new Error("network");
+    }
+    if (chunk.done) break;
+    buffer += decoder.decode(chunk.value, { stream: true });
+    let sep = buffer.indexOf("\n\n");
+    while (sep !== -1) {
+      dispatch(buffer.slice(0, sep));
+      buffer = buffer.slice(sep + 2);
+      sep = buffer.indexOf("\n\n");
+    }
+  }
+}
+
+const SEARCH_FIELD_LABELS = {
+  title: "标题",
+  background: "故事背景",
+  mainline: "主线",
+  darkline: "暗线",
+  style: "小说风格",
+  core_design: "核诡设计",
+  reversal: "反转设计",
+  highlights: "小说亮点",
+};
+
+function highlightSnippet(snippet) {
+  // highlights 是片段内命中的 [起, 止) 区间，已按起点排序，重叠的合并处理
+  const text = snippet.text || "";
+  let html = snippet.prefix ? "…" : "";
+  let cursor = 0;
+  (snippet.highlights || []).forEach(([start, end]) => {
+    if (end <= cursor) return;
+    const from = Math.max(start, cursor);
+    html += escapeHtml(text.slice(cursor, from));
+    html += `<mark>${escapeHtml(text.slice(from, end))}</mark>`;
+    cursor = end;
+  });
+  html += escapeHtml(text.slice(cursor));
+  return html + (snippet.suffix ? "…" : "");
+}
+
+function bindNovelCards() {
+  dom.novelList.querySelectorAll(".novel-card").forEach((card) => {
+    card.addEventListener("click", () => {
+      const id = card.getAttribute("data-id");
+      if (id) {
+        window.location.href = `/novel/${id}`;
+      }
     });
-    actions.appendChild(copyBtn);
-    wrapper.appendChild(meta);
-    wrapper.appendChild(bubble);
-    wrapper.appendChild(actions);
-    dom.chatHistory.appendChild(wrapper);
   });
-  dom.chatHistory.scrollTop = dom.chatHistory.scrollHeight;
 }
 
 function renderNovelList(items) {
@@ -276,21 +601,66 @@ function renderNovelList(items) {
     `
     )
     .join("");
-  dom.novelList.querySelectorAll(".novel-card").forEach((card) => {
-    card.addEventListener("click", () => {
-      const id = card.getAttribute("data-id");
-      if (id) {
-        window.location.href = `/novel/${id}`;
-      }
-    });
-  });
+  bindNovelCards();
+}
+
+function renderSearchHits(result) {
+  if (!dom.novelList) return;
+  if (!result.hits.length) {
+    dom.novelList.classList.add("empty");
+    dom.novelList.innerHTML = '<div class="empty-state">没有找到相关的小说</div>';
+    return;
+  }
+  dom.novelList.classList.remove("empty");
+  dom.novelList.innerHTML = result.hits
+    .map(
+      (hit) => `
+      <div class="novel-card" data-id="${escapeHtml(hit.novel_id)}">
+        <div class="novel-title">${escapeHtml(hit.title)}</div>
+        ${hit.snippets
+          .filter((snippet) => snippet.field !== "title")
+          .map(
+            (snippet) => `
+          <div class="novel-snippet">
+            <span class="novel-meta">${SEARCH_FIELD_LABELS[snippet.field] || snippet.field}：</span>${highlightSnippet(snippet)}
+          </div>`
+          )
+          .join("")}
+      </div>
+    `
+    )
+    .join("");
+  bindNovelCards();
 }
 
 async function initHome() {
   if (!dom.novelList || !dom.createBtn || !dom.titleInput) return;
-  const list = await api.listNovels();
+  let list = await api.listNovels();
   renderNovelList(list);
 
+  if (dom.searchInput) {
+    // 输入停顿 200ms 再查；慢的旧请求晚于新请求返回时丢弃
+    let timer = null;
+    let latest = 0;
+    dom.searchInput.addEventListener("input", () => {
+      clearTimeout(timer);
+      timer = setTimeout(async () => {
+        const query = dom.searchInput.value.trim();
+        const ticket = ++latest;
+        if (!query) {
+          renderNovelList(list);
+          return;
+        }
+        try {
+          const result = await api.search(query);
+          if (ticket === latest) renderSearchHits(result);
+        } catch (err) {
+          if (ticket === latest) showToast(err.message || "搜索失败", "error");
+        }
+      }, 200);
+    });
+  }
+
   dom.createBtn.addEventListener("click", async () => {
     const title = dom.titleInput.value.trim();
     if (!title) return;
@@ -298,8 +668,8 @@ async function initHome() {
     try {
       const novel = await api.createNovel(title);
       dom.titleInput.value = "";
-      const updated = await api.listNovels();
-      renderNovelList(updated);
+      list = await api.listNovels();
+      renderNovelList(list);
       window.location.href = `/novel/${novel.id}`;
     } finally {
       dom.createBtn.disabled = false;
@@ -339,6 +709,7 @@ async function initNovel() {
                 <textarea id="optimize-prompt" rows="4" placeholder="输入优化方向、要求、风格等"></textarea>
                 <label class="modal-label" for="optimize-result">AI 结果</label>
                 <textarea id="optimize-result" rows="10" placeholder="等待生成结果" readonly></textarea>
+                <div id="optimize-diff" class="optimize-diff" hidden></div>
               </div>
               <div class="modal-actions">
                 <button id="optimize-submit">生成优化</button>
@@ -372,6 +743,7 @@ async function initNovel() {
     dom.optimizeModal = document.getElementById("optimize-modal");
     dom.optimizePrompt = document.getElementById("optimize-prompt");
     dom.optimizeResult = document.getElementById("optimize-result");
+    dom.optimizeDiff = document.getElementById("optimize-diff");
     dom.optimizeSubmit = document.getElementById("optimize-submit");
     dom.optimizeApply = document.getElementById("optimize-apply");
     dom.optimizeRevert = document.getElementById("optimize-revert");
@@ -389,27 +761,67 @@ async function initNovel() {
     try {
       const history = await api.getChatHistory();
       globalChatMessages = Array.isArray(history.messages) ? history.messages : [];
+      chatHistoryBefore = history.has_more ? history.before : null;
     } catch (e) {
       globalChatMessages = [];
+      chatHistoryBefore = null;
     }
   }
   renderChatHistory();
 
+  const loadOlderChat = async () => {
+    if (chatHistoryLoading || chatHistoryBefore === null || !globalChatMessages) return;
+    chatHistoryLoading = true;
+    try {
+      const page = await api.getChatHistory(chatHistoryBefore);
+      const older = Array.isArray(page.messages) ? page.messages : [];
+      chatHistoryBefore = page.has_more ? page.before : null;
+      if (!older.length) return;
+      // 在顶部插入后保持当前看到的位置不跳
+      const el = dom.chatHistory;
+      const fromBottom = el.scrollHeight - el.scrollTop;
+      globalChatMessages = older.concat(globalChatMessages);
+      renderChatHistory();
+      el.scrollTop = el.scrollHeight - fromBottom;
+    } catch (e) {
+      // 翻页失败不影响当前对话，下次滚到顶部再试
+    } finally {
+      chatHistoryLoading = false;
+    }
+  };
+
+  if (dom.chatHistory) {
+    dom.chatHistory.addEventListener("scroll", () => {
+      if (dom.chatHistory.scrollTop < 40) loadOlderChat();
+    });
+    // 一页撑不满面板时没有滚动条，直接再往前取一页
+    if (dom.chatHistory.scrollHeight <= dom.chatHistory.clientHeight) loadOlderChat();
+  }
+
   const appendChatMessage = (role, content, extra) => {
     if (!globalChatMessages) globalChatMessages = [];
     globalChatMessages.push({ role, content, ...(extra || {}) });
-    if (globalChatMessages.length > 60) {
-      globalChatMessages = globalChatMessages.slice(-60);
+    if (globalChatMessages.length > CHAT_MAX_LOADED) {
+      const dropped = globalChatMessages.length - CHAT_MAX_LOADED;
+      globalChatMessages = globalChatMessages.slice(dropped);
+      // 从剩下的第一条往前翻；它是本页新发的、还没有 seq 时就不再往前翻
+      const first = globalChatMessages[0];
+      chatHistoryBefore = first && first.seq ? first.seq : null;
     }
     renderChatHistory();
   };
 
   const updateChatMessage = (id, updates) => {
     if (!globalChatMessages) return;
-    const idx = globalChatMessages.findIndex((m) => m.id === id);
-    if (idx === -1) return;
-    globalChatMessages[idx] = { ...globalChatMessages[idx], ...(updates || {}) };
-    renderChatHistory();
+    // 正在生成的消息总在末尾，从后往前找
+    for (let i = globalChatMessages.length - 1; i >= 0; i -= 1) {
+      const m = globalChatMessages[i];
+      if (m.id === id) {
+        Object.assign(m, updates || {});
+        renderChatMessage(m);
+        return;
+      }
+    }
   };
 
   if (dom.chatSend) {
@@ -419,26 +831,16 @@ async function initNovel() {
       if (!text) return;
       dom.chatSend.disabled = true;
       appendChatMessage("user", text);
-      const pendingId = Date.now() + Math.random();
+      const pendingId = `p${Date.now()}${Math.random()}`;
       appendChatMessage("assistant", "", { id: pendingId, loading: true });
       dom.chatInput.value = "";
       try {
         const useSearch = Boolean(dom.chatSearch && dom.chatSearch.checked);
-        const res = await fetch("/api/chat/send_stream", {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ message: text, use_search: useSearch }),
-        });
-        if (!res.ok) {
-          throw new Error("chat_failed");
-        }
-        if (!res.body) {
-          throw new Error("chat_stream_unsupported");
-        }
-
-        const reader = res.body.getReader();
-        const decoder = new TextDecoder("utf-8");
         let assistantText = "";
+        let lastEventId = "";
+        let finished = false;
+        let truncated = false;
+        let failure = "";
         let scheduled = false;
 
         const scheduleRender = () => {
@@ -446,22 +848,74 @@ async function initNovel() {
           scheduled = true;
           requestAnimationFrame(() => {
             scheduled = false;
-            updateChatMessage(pendingId, { loading: false, content: assistantText });
+            updateChatMessage(pendingId, {
+              loading: false,
+              streaming: true,
+              content: assistantText,
+            });
           });
         };
 
-        while (true) {
-          const { value, done } = await reader.read();
-          if (done) break;
-          if (value) {
-            assistantText += decoder.decode(value, { stream: true });
+        const onEvent = (event, data, id) => {
+          if (id) lastEventId = id;
+          if (event === "route" && data.route === "search") {
+            updateChatMessage(pendingId, { loading: false, streaming: true, content: "正在搜索…" });
+          } else if (event === "delta") {
+            assistantText += data.text || "";
             scheduleRender();
+          } else if (event === "done") {
+            finished = true;
+            truncated = Boolean(data.truncated);
+          } else if (event === "error") {
+            // 上游失败或中途断流：已收到的部分保留并标记中断，一个字都没收到才算发送失败
+            finished = true;
+            truncated = true;
+            failure = data.message || "chat_failed";
+          }
+        };
+
+        let res = await fetch("/api/chat/events", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ message: text, use_search: useSearch, novel_id: novelId }),
+        });
+        for (let attempt = 0; ; attempt += 1) {
+          if (!res.ok) {
+            throw requestError(res, "chat_failed");
+          }
+          try {
+            await readSse(res, onEvent);
+          } catch (err) {
+            // 网络中断：生成仍在服务端继续，带 Last-Event-ID 接着收，最多重连 3 次
+            if (!lastEventId || attempt >= 3 || err.message !== "network") throw err;
+          }
+          if (finished) break;
+          if (!lastEventId || attempt >= 3) throw new Error("chat_failed");
+          await new Promise((resolve) => setTimeout(resolve, 500 * (attempt + 1)));
+          res = await fetch("/api/chat/events", { headers: { "Last-Event-ID": lastEventId } });
+          if (res.status === 404) {
+            const reply = await recoverChatReply(text);
+            if (!reply) throw new Error("chat_failed");
+            assistantText = reply.content || "";
+            truncated = Boolean(reply.truncated);
+            break;
           }
         }
-        assistantText += decoder.decode();
-        updateChatMessage(pendingId, { loading: false, content: assistantText });
+        if (failure && !assistantText) throw new Error(failure);
+        updateChatMessage(pendingId, {
+          loading: false,
+          streaming: false,
+          truncated,
+          content: assistantText,
+        });
+        if (failure) showToast(failure, "error");
       } catch (e) {
-        updateChatMessage(pendingId, { loading: false, content: "发送失败，请稍后再试。" });
+        const busy = e && String(e.message || "").startsWith("服务繁忙");
+        updateChatMessage(pendingId, {
+          loading: false,
+          streaming: false,
+          content: busy ? `${e.message}。` : "发送失败，请稍后再试。",
+        });
       } finally {
         dom.chatSend.disabled = false;
       }
@@ -485,6 +939,7 @@ async function initNovel() {
       try {
         await api.clearChat();
         globalChatMessages = [];
+        chatHistoryBefore = null;
         renderChatHistory();
       } finally {
         dom.chatClear.disabled = false;
@@ -513,9 +968,83 @@ async function initNovel() {
   const groups = document.querySelectorAll(".section-group");
   let activeSection = "story";
 
+  const fileList = document.getElementById("file-list");
+  const fileInput = document.getElementById("manuscript-input");
+  const uploadBtn = document.getElementById("upload-btn");
+
+  // 下载走应用的跳转接口，点击时才签名
+  const fileDownloadUrl = (key) =>
+    `/api/novels/${novelId}/files/download?key=${encodeURIComponent(key)}`;
+
+  const renderFiles = (files) => {
+    if (!fileList) return;
+    if (!files.length) {
+      fileList.innerHTML = '<li class="empty-state">还没有上传稿件</li>';
+      return;
+    }
+    fileList.innerHTML = files
+      .map(
+        (f) => `
+        <li class="file-item">
+          <a href="${escapeHtml(fileDownloadUrl(f.key))}" rel="noopener">${escapeHtml(f.name)}</a>
+          <span class="novel-meta">${formatSize(f.size)} · ${escapeHtml(f.uploaded_at || "")}</span>
+          <button class="ghost" data-delete-file="${escapeHtml(f.key)}">删除</button>
+        </li>`,
+      )
+      .join("");
+  };
+
+  const loadFiles = async () => {
+    try {
+      const data = await api.listFiles(novelId);
+      renderFiles(data.files || []);
+    } catch (e) {
+      setStatus("稿件列表加载失败");
+    }
+  };
+
+  if (uploadBtn && fileInput) {
+    uploadBtn.addEventListener("click", () => fileInput.click());
+    fileInput.addEventListener("change", async () => {
+      const file = fileInput.files && fileInput.files[0];
+      fileInput.value = "";
+      if (!file) return;
+      uploadBtn.disabled = true;
+      try {
+        await api.uploadFile(novelId, file, (ratio) => {
+          setStatus(`上传中 ${Math.round(ratio * 100)}%`);
+        });
+        setStatus("");
+        showToast("上传成功", "success");
+        await loadFiles();
+      } catch (e) {
+        setStatus(e.message || "上传失败");
+        showToast(e.message || "上传失败", "error");
+      } finally {
+        uploadBtn.disabled = false;
+      }
+    });
+  }
+
+  if (fileList) {
+    fileList.addEventListener("click", async (e) => {
+      const button = e.target.closest("[data-delete-file]");
+      if (!button) return;
+      button.disabled = true;
+      try {
+        await api.deleteFile(novelId, button.getAttribute("data-delete-file"));
+        await loadFiles();
+      } catch (err) {
+        button.disabled = false;
+        showToast("删除失败", "error");
+      }
+    });
+  }
+
   const sectionMeta = {
     story: { title: "故事背景", subtitle: "整理世界观与主线脉络" },
     advanced: { title: "高级设计", subtitle: "强化风格与反转结构" },
+    files: { title: "稿件文件", subtitle: "上传与下载稿件原件" },
   };
 
   const setActiveSection = (name) => {
@@ -533,6 +1062,13 @@ async function initNovel() {
     if (subNode) {
       subNode.textContent = sectionMeta[name].subtitle;
     }
+    if (dom.saveBtn) {
+      // 稿件上传完即登记，没有要保存的内容
+      dom.saveBtn.hidden = name === "files";
+    }
+    if (name === "files") {
+      loadFiles();
+    }
   };
 
   menuItems.forEach((item) => {
@@ -561,6 +1097,30 @@ async function initNovel() {
     highlights: "提炼差异化卖点与读者记忆点，语言更有吸引力。",
   };
 
+  // 改动处标红/标绿；大段未改动的文字只留首尾，免得改动被淹没
+  const DIFF_CONTEXT_CHARS = 40;
+  const renderOptimizeDiff = (diff) => {
+    if (!dom.optimizeDiff) return;
+    const segments = Array.isArray(diff) ? diff : [];
+    if (!segments.some((seg) => seg.op !== "equal")) {
+      dom.optimizeDiff.hidden = true;
+      dom.optimizeDiff.innerHTML = "";
+      return;
+    }
+    dom.optimizeDiff.innerHTML = segments
+      .map((seg, idx) => {
+        const text = seg.text || "";
+        if (seg.op === "insert") return `<ins>${escapeHtml(text)}</ins>`;
+        if (seg.op === "delete") return `<del>${escapeHtml(text)}</del>`;
+        if (text.length <= DIFF_CONTEXT_CHARS * 2) return escapeHtml(text);
+        const head = idx === 0 ? "" : text.slice(0, DIFF_CONTEXT_CHARS);
+        const tail = idx === segments.length - 1 ? "" : text.slice(-DIFF_CONTEXT_CHARS);
+        return `${escapeHtml(head)}<span class="diff-gap">…</span>${escapeHtml(tail)}`;
+      })
+      .join("");
+    dom.optimizeDiff.hidden = false;
+  };
+
   const openOptimizeModal = (target, field) => {
     if (!dom.optimizeModal || !dom.optimizePrompt || !dom.optimizeResult) return;
     currentTarget = target;
@@ -569,6 +1129,7 @@ async function initNovel() {
     candidateText = "";
     dom.optimizePrompt.value = defaultInstructionByField[field] || "";
     dom.optimizeResult.value = "";
+    renderOptimizeDiff(null);
     dom.optimizeApply.disabled = true;
     dom.optimizeRevert.disabled = true;
     dom.optimizeModal.classList.add("active");
@@ -616,6 +1177,7 @@ async function initNovel() {
         if (dom.optimizeResult) {
           dom.optimizeResult.value = "生成中";
         }
+        renderOptimizeDiff(null);
         if (loadingTimer) {
           clearInterval(loadingTimer);
           loadingTimer = null;
@@ -633,6 +1195,7 @@ async function initNovel() {
           original: originalSnapshot,
           instruction: dom.optimizePrompt ? dom.optimizePrompt.value : "",
           field: currentField,
+          novel_id: novelId,
         });
         const text = result.text || "";
         candidateText = text;
@@ -641,6 +1204,7 @@ async function initNovel() {
           loadingTimer = null;
         }
         if (dom.optimizeResult) dom.optimizeResult.value = text;
+        renderOptimizeDiff(result.diff);
         if (dom.optimizeApply) dom.optimizeApply.disabled = false;
         if (dom.optimizeRevert) dom.optimizeRevert.disabled = false;
         setStatus("AI 优化完成，可保留或撤销");
@@ -698,7 +1262,7 @@ async function initNovel() {
             mainline: mainline ? mainline.value : "",
             darkline: darkline ? darkline.value : "",
           });
-        } else {
+        } else if (activeSection === "advanced") {
           const style = document.getElementById("style");
           const coreDesign = document.getElementById("core_design");
           const reversal = document.getElementById("reversal");